@@ -0,0 +1,247 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+# run from a checkout, without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+from ccam_prospect import __version__
+from ccam_prospect.utils.InputType import InputType
+from ccam_prospect.radianceCalibration import RadianceCalibration
+from ccam_prospect.relativeReflectanceCalibration import RelativeReflectanceCalibration
+from syntheticData import generate
+
+# the calibrations timed: PSV to RAD, PSV to RAD and REF, and RAD to REF
+SCENARIOS = ['radiance', 'psv_to_ref', 'rad_to_ref']
+# the number of files in each run, unless given with --sizes
+DEFAULT_SIZES = [1, 1000]
+
+
+@contextlib.contextmanager
+def quiet():
+    """quiet
+    send the output of the calibration, and of its worker processes, to /dev/null
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(devnull)
+        os.close(saved)
+
+
+def get_peak_rss_mb():
+    """get_peak_rss_mb
+    the peak resident memory of this process and of its finished worker processes
+
+    :return: the peak of this process and the peak of any one worker, in MB
+    """
+    import resource  # not on Windows
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # ru_maxrss is in bytes on macOS, KB elsewhere
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def run_scenario(scenario, in_dir, out_dir, jobs, results):
+    """run_scenario
+    calibrate a directory through the same entry point as the command line, in a fresh process
+    so the peak memory is that of this run alone, and put the time and memory on the results queue
+
+    :param: scenario one of SCENARIOS
+    :param: in_dir the directory of inputs
+    :param: out_dir the output directory
+    :param: jobs the number of processes
+    :param: results the queue to put the result on
+    """
+    log_file = os.path.join(out_dir, 'badInput.log')
+    with quiet():
+        start = time.perf_counter()
+        if scenario == 'radiance':
+            radiance_cal = RadianceCalibration(log_file, jobs=jobs)
+            radiance_cal.calibrate_to_radiance(InputType.DIRECTORY, in_dir, out_dir, True)
+        else:
+            relative_cal = RelativeReflectanceCalibration(log_file, jobs=jobs)
+            relative_cal.calibrate_relative_reflectance(InputType.DIRECTORY, in_dir, None, out_dir, True, True)
+        seconds = time.perf_counter() - start
+    (peak_rss, worker_peak_rss) = get_peak_rss_mb()
+    results.put({'seconds': seconds, 'peak_rss_mb': peak_rss, 'worker_peak_rss_mb': worker_peak_rss,
+                 'skipped': os.path.isfile(log_file)})
+
+
+def time_scenario(scenario, in_dir, work_dir, jobs):
+    """time_scenario
+    run one calibration in a fresh process, into an empty output directory that is removed afterwards
+
+    :param: scenario one of SCENARIOS
+    :param: in_dir the directory of inputs
+    :param: work_dir the directory for the output directory
+    :param: jobs the number of processes
+    :return: the time and peak memory of the run
+    """
+    out_dir = tempfile.mkdtemp(prefix=scenario + '_', dir=work_dir)
+    try:
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        process = context.Process(target=run_scenario, args=(scenario, in_dir, out_dir, jobs, results))
+        process.start()
+        result = results.get()
+        process.join()
+        return result
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def make_rad_inputs(psv_dir, rad_dir, jobs):
+    """make_rad_inputs
+    calibrate the synthetic PSV files to RAD files once, for the RAD to REF runs.  The PSV
+    labels are copied next to the RAD files, where the tool looks for them.
+
+    :param: psv_dir the directory of synthetic PSV files
+    :param: rad_dir the directory to write the RAD files to
+    :param: jobs the number of processes
+    :return: rad_dir
+    """
+    complete = os.path.join(rad_dir, '.complete')
+    if os.path.isfile(complete):
+        return rad_dir
+    os.makedirs(rad_dir, exist_ok=True)
+    with quiet():
+        RadianceCalibration(os.path.join(rad_dir, 'badInput.log'), jobs=jobs).calibrate_to_radiance(
+            InputType.DIRECTORY, psv_dir, rad_dir, True)
+    for name in os.listdir(psv_dir):
+        if name.endswith('.lbl'):
+            shutil.copy(os.path.join(psv_dir, name), rad_dir)
+    with open(complete, 'w') as f:
+        f.write('\n')
+    return rad_dir
+
+
+def get_environment(jobs):
+    """get_environment
+    what the benchmark ran on, to tell whether two baselines can be compared
+    """
+    return {
+        'ccam_prospect': __version__,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'jobs': jobs
+    }
+
+
+def run_benchmarks(data_dir, sizes, scenarios, jobs, repeat):
+    """run_benchmarks
+    time each scenario on each number of synthetic files.  Of several repeats, the fastest is kept.
+
+    :param: data_dir the directory of the synthetic files, kept between runs
+    :param: sizes the numbers of files
+    :param: scenarios the scenarios to run
+    :param: jobs the number of processes of each calibration
+    :param: repeat the number of times to run each scenario
+    :return: the results, one for each scenario and size
+    """
+    results = []
+    for size in sizes:
+        psv_dir = generate(os.path.join(data_dir, 'psv_{}'.format(size)), size)
+        inputs = {'radiance': psv_dir, 'psv_to_ref': psv_dir}
+        if 'rad_to_ref' in scenarios:
+            inputs['rad_to_ref'] = make_rad_inputs(psv_dir, os.path.join(data_dir, 'rad_{}'.format(size)), jobs)
+        for scenario in scenarios:
+            runs = [time_scenario(scenario, inputs[scenario], data_dir, jobs) for _ in range(repeat)]
+            best = min(runs, key=lambda run: run['seconds'])
+            result = {
+                'scenario': scenario,
+                'files': size,
+                'jobs': jobs,
+                'seconds': best['seconds'],
+                'files_per_second': size / best['seconds'],
+                'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+                'worker_peak_rss_mb': max(run['worker_peak_rss_mb'] for run in runs),
+                'skipped_inputs': any(run['skipped'] for run in runs)
+            }
+            print('{:<11} {:>7} files  {:9.3f} s  {:9.1f} files/s  peak RSS {:7.1f} MB'.format(
+                scenario, size, result['seconds'], result['files_per_second'],
+                max(result['peak_rss_mb'], result['worker_peak_rss_mb'])))
+            results.append(result)
+    return results
+
+
+def compare(baseline, results, tolerance):
+    """compare
+    compare results with a baseline: a scenario regresses if its throughput drops, or its
+    peak memory grows, by more than the tolerance
+
+    :param: baseline the baseline, as written by this script
+    :param: results the new results
+    :param: tolerance the fraction of change allowed, e.g. 0.1
+    :return: list of the regressions, as text
+    """
+    previous = {(r['scenario'], r['files'], r['jobs']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get((result['scenario'], result['files'], result['jobs']))
+        if old is None:
+            continue
+        speed = result['files_per_second'] / old['files_per_second']
+        memory = result['peak_rss_mb'] / old['peak_rss_mb']
+        print('{:<11} {:>7} files  throughput x{:.2f}  peak RSS x{:.2f}'.format(
+            result['scenario'], result['files'], speed, memory))
+        if speed < 1 - tolerance:
+            regressions.append('{} ({} files): throughput {:.1f} files/s, was {:.1f}'.format(
+                result['scenario'], result['files'], result['files_per_second'], old['files_per_second']))
+        if memory > 1 + tolerance:
+            regressions.append('{} ({} files): peak RSS {:.1f} MB, was {:.1f}'.format(
+                result['scenario'], result['files'], result['peak_rss_mb'], old['peak_rss_mb']))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the calibrations on synthetic CCAM files')
+    parser.add_argument('--data', action="store", dest='data', default='benchmark_data',
+                        help="directory for the synthetic files, kept between runs (default: benchmark_data)")
+    parser.add_argument('--sizes', action="store", dest='sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="numbers of files to time, e.g. 1 1000 100000 (default: 1 1000)")
+    parser.add_argument('--scenarios', action="store", dest='scenarios', nargs='+', default=SCENARIOS,
+                        choices=SCENARIOS, help="calibrations to time (default: all)")
+    parser.add_argument('-j', '--jobs', action="store", dest='jobs', type=int, default=1,
+                        help="number of processes of each calibration")
+    parser.add_argument('--repeat', action="store", dest='repeat', type=int, default=1,
+                        help="run each calibration this many times and keep the fastest")
+    parser.add_argument('-o', action="store", dest='output', default='benchmark.json',
+                        help="JSON file to write the results to (default: benchmark.json)")
+    parser.add_argument('--baseline', action="store", dest='baseline',
+                        help="JSON results of an earlier run to compare with; exits with 1 on a regression")
+    parser.add_argument('--tolerance', action="store", dest='tolerance', type=float, default=0.1,
+                        help="fraction of change from the baseline allowed (default: 0.1)")
+
+    args = parser.parse_args()
+    os.makedirs(args.data, exist_ok=True)
+    benchmark = {
+        'environment': get_environment(args.jobs),
+        'results': run_benchmarks(args.data, args.sizes, args.scenarios, args.jobs, args.repeat)
+    }
+    with open(args.output, 'w') as f:
+        json.dump(benchmark, f, indent=1)
+    print('results written to ' + os.path.abspath(args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), benchmark['results'], args.tolerance)
+        for regression in regressions:
+            print('REGRESSION: ' + regression)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# the root of the checkout, so the package is run from the source without installing it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules that are only to be imported once the feature that uses them runs
+LAZY_MODULES = ['matplotlib', 'jinja2', 'ccam_prospect.plotpanel']
+# reported by a scenario that cannot run here, e.g. the window without a display
+SKIPPED = 'skipped'
+
+# what each scenario runs in a fresh interpreter.  Each prints the lazy modules it loaded.
+REPORT_MODULES = ('import json, sys; print(json.dumps([m for m in {} if m in sys.modules]))'
+                  .format(LAZY_MODULES))
+SCENARIOS = {
+    # the imports of runApp.py, up to the point the window is created
+    'gui_import': 'import runApp\n' + REPORT_MODULES,
+    # runApp.py up to the first drawing of the main window
+    'gui_window': ('import tkinter as tk\n'
+                   'from ccam_prospect.mainapplication import MainApplication\n'
+                   'try:\n'
+                   '    root_window = tk.Tk()\n'
+                   'except tk.TclError:\n'
+                   '    print("{}")\n'.format(SKIPPED) +
+                   '    sys.exit(0)\n'
+                   'MainApplication(root_window)\n'
+                   'root_window.update()\n'
+                   'root_window.destroy()\n' + REPORT_MODULES),
+    # the command line, as far as parsing the arguments
+    'cli': ('from ccam_prospect.ccamProspect import main\n'
+            'try:\n'
+            '    main(["rad", "-h"])\n'
+            'except SystemExit:\n'
+            '    pass\n' + REPORT_MODULES)
+}
+
+
+def time_scenario(scenario, repeat):
+    """time_scenario
+    run a scenario in a fresh interpreter, as the user starts it, and keep the fastest run
+
+    :param: scenario one of SCENARIOS
+    :param: repeat the number of runs
+    :return: the time of the fastest run in seconds and the lazy modules loaded, or None if the scenario was skipped
+    """
+    code = 'import sys\n' + SCENARIOS[scenario]
+    best = None
+    loaded = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+        seconds = time.perf_counter() - start
+        last_line = output.strip().splitlines()[-1] if output.strip() else ''
+        if last_line == SKIPPED:
+            return None
+        loaded = json.loads(last_line)
+        best = seconds if best is None else min(best, seconds)
+    return best, loaded
+
+
+def check_budget(results, budget):
+    """check_budget
+    :param: results the result of each scenario
+    :param: budget the most seconds a scenario may take to start
+    :return: list of the scenarios over the budget, or that loaded a lazy module, as text
+    """
+    problems = []
+    for result in results:
+        if result['skipped']:
+            continue
+        if result['seconds'] > budget:
+            problems.append('{} took {:.3f} s, the budget is {:.3f} s'.format(result['scenario'], result['seconds'],
+                                                                            budget))
+        if result['lazy_modules_loaded']:
+            problems.append('{} loaded {}'.format(result['scenario'], ', '.join(result['lazy_modules_loaded'])))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time the startup of the GUI and the command line')
+    parser.add_argument('--scenarios', action="store", dest='scenarios', nargs='+', default=list(SCENARIOS),
+                        choices=list(SCENARIOS), help="startups to time (default: all)")
+    parser.add_argument('--repeat', action="store", dest='repeat', type=int, default=5,
+                        help="start each scenario this many times and keep the fastest (default: 5)")
+    parser.add_argument('--budget', action="store", dest='budget', type=float, default=1.0,
+                        help="seconds each startup may take; exits with 1 if one takes longer (default: 1.0)")
+    parser.add_argument('-o', action="store", dest='output', default='startup.json',
+                        help="JSON file to write the results to (default: startup.json)")
+
+    args = parser.parse_args()
+    results = []
+    for scenario in args.scenarios:
+        timed = time_scenario(scenario, args.repeat)
+        if timed is None:
+            print('{:<11} skipped (no display)'.format(scenario))
+            results.append({'scenario': scenario, 'skipped': True, 'seconds': None, 'lazy_modules_loaded': []})
+            continue
+        (seconds, loaded) = timed
+        print('{:<11} {:7.3f} s{}'.format(scenario, seconds, '  loaded ' + ', '.join(loaded) if loaded else ''))
+        results.append({'scenario': scenario, 'skipped': False, 'seconds': seconds, 'lazy_modules_loaded': loaded})
+
+    with open(args.output, 'w') as f:
+        json.dump({'python': sys.version.split()[0], 'budget': args.budget, 'results': results}, f, indent=1)
+    print('results written to ' + os.path.abspath(args.output))
+
+    problems = check_budget(results, args.budget)
+    for problem in problems:
+        print('OVER BUDGET: ' + problem)
+    if problems:
+        sys.exit(1)
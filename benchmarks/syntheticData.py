@@ -0,0 +1,132 @@
+import argparse
+import os
+import sys
+import numpy as np
+
+# run from a checkout, without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ccam_prospect.utils.PsvFile import HEADER_LINES, VNIR_LINES, VIS_LINES, UV_LINES
+
+# the integration times of the synthetic files (s), in turn, one for each built-in reference
+INTEGRATION_TIMES = [0.007, 0.034, 0.404, 5.004]
+# spacecraft clock of the first synthetic file
+FIRST_SCLK = 404238000
+# marks a directory of synthetic files as complete
+COMPLETE_FILE = '.complete'
+
+
+def get_psv_filename(index):
+    """get_psv_filename
+    the name of a synthetic PSV file, in the same form as a real one
+
+    :param: index the number of the file
+    :return: the file name
+    """
+    return 'cl5_{:09d}psv_f0050104ccam01076p1.tab'.format(FIRST_SCLK + index)
+
+
+def make_header(index, t_int, distance):
+    """make_header
+    the 29 header lines of a synthetic PSV file, ending with the >>>>Begin line
+
+    :param: index the number of the file
+    :param: t_int the integration time, in s
+    :param: distance the distance to target, in m
+    :return: list of the header lines
+    """
+    ipbc = 1.0
+    ict = (t_int - 0.00356) * 33000000 / ipbc
+    lines = ['"Synthetic CCAM passive spectrum {}"\n'.format(index),
+             '"distToTarget:{:.3f}"\n'.format(distance),
+             '"IPBCdivisor:{:.1f}"\n'.format(ipbc),
+             '"ICTdivisor:{:.3f}"\n'.format(ict)]
+    while len(lines) < HEADER_LINES - 1:
+        lines.append('"field{0}:{0}"\n'.format(len(lines)))
+    lines.append('">>>>Begin Processed"\n')
+    return lines
+
+
+def make_spectra(rng):
+    """make_spectra
+    the lines of a synthetic PSV file after the header: for each spectrometer, a dark offset
+    with noise in the first channels and a smooth signal above it, in DN, one value per line
+
+    :param: rng the numpy random generator
+    :return: array of the values of every line after the header
+    """
+    values = rng.normal(500.0, 5.0, UV_LINES[1] - HEADER_LINES)
+    for (start, end) in (VNIR_LINES, VIS_LINES, UV_LINES):
+        channels = np.linspace(0.0, np.pi, end - start)
+        values[start - HEADER_LINES:end - HEADER_LINES] += rng.uniform(500, 3000) * np.sin(channels) ** 2
+    return values
+
+
+def make_label(index, t_int):
+    """make_label
+    a short PDS3 label for a synthetic PSV file, with the keywords the tool reads
+
+    :param: index the number of the file
+    :param: t_int the integration time, in s
+    :return: the label
+    """
+    return ('PDS_VERSION_ID = PDS3\n'
+            'START_TIME = 2012-10-20T12:00:{:02d}.000\n'
+            'PLANET_DAY_NUMBER = 76\n'
+            'SPACECRAFT_CLOCK_START_COUNT = "{}"\n'
+            'INTEGRATION_TIME = {}\n'
+            'END\n').format(index % 60, FIRST_SCLK + index, t_int)
+
+
+def make_psv(directory, index, rng):
+    """make_psv
+    write one synthetic PSV file and its label
+
+    :param: directory the directory to write to
+    :param: index the number of the file
+    :param: rng the numpy random generator
+    :return: the PSV file
+    """
+    t_int = INTEGRATION_TIMES[index % len(INTEGRATION_TIMES)]
+    psv_file = os.path.join(directory, get_psv_filename(index))
+    lines = make_header(index, t_int, 2000.0 + index % 5000)
+    with open(psv_file, 'w') as f:
+        f.writelines(lines)
+        f.write('\n'.join('%.3f' % value for value in make_spectra(rng)) + '\n')
+    with open(psv_file.replace('.tab', '.lbl'), 'w') as f:
+        f.write(make_label(index, t_int))
+    return psv_file
+
+
+def generate(directory, count, seed=0):
+    """generate
+    write count synthetic PSV files and their labels to a directory, the same files for the
+    same seed.  A directory that already holds a complete set is left as it is.
+
+    :param: directory the directory to write to, created if it does not exist
+    :param: count the number of files
+    :param: seed the seed of the random values
+    :return: the directory
+    """
+    complete = os.path.join(directory, COMPLETE_FILE)
+    if os.path.isfile(complete):
+        with open(complete) as f:
+            if f.read().strip() == '{} {}'.format(count, seed):
+                return directory
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for index in range(count):
+        make_psv(directory, index, rng)
+    with open(complete, 'w') as f:
+        f.write('{} {}\n'.format(count, seed))
+    return directory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write synthetic CCAM PSV files and labels')
+    parser.add_argument('directory', help="directory to write the files to")
+    parser.add_argument('count', type=int, help="number of files")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random values")
+
+    args = parser.parse_args()
+    generate(args.directory, args.count, args.seed)
+    print('{} synthetic PSV files in {}'.format(args.count, os.path.abspath(args.directory)))
@@ -0,0 +1,4 @@
+from ccam_prospect.ccamProspect import main
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import importlib
+import sys
+from ccam_prospect import __version__
+
+# the subcommands of ccam-prospect: the module whose main runs each one, and what it does.
+# A module is only imported when its subcommand runs, so a calibration from a workflow
+# engine does not pay for the imports of the GUI, the plotting or the other commands.
+COMMANDS = {
+    'rad': ('ccam_prospect.radianceCalibration', 'calibrate PSV files to radiance (RAD)'),
+    'ref': ('ccam_prospect.relativeReflectanceCalibration',
+            'calibrate PSV or RAD files to relative reflectance (REF)'),
+    'catalog': ('ccam_prospect.headerCatalog', 'build or query a catalog of the headers of PSV and RAD files'),
+    'compare': ('ccam_prospect.compareOutputs', 'compare RAD and REF outputs with golden outputs'),
+    'gui': ('ccam_prospect.mainapplication', 'open the calibration window')
+}
+PROG = 'ccam-prospect'
+
+
+def print_usage(stream):
+    """print_usage
+    print the subcommands
+
+    :param: stream the stream to print to
+    """
+    stream.write('usage: {} COMMAND [-h] [ARGS]\n\ncommands:\n'.format(PROG))
+    for (name, (module, description)) in COMMANDS.items():
+        stream.write('  {:<9} {}\n'.format(name, description))
+    stream.write('\nrun "{} COMMAND -h" for the arguments of a command\n'.format(PROG))
+
+
+def main(argv=None):
+    """main
+    the ccam-prospect console entry point: run the subcommand named by the first argument
+
+    :param: argv the arguments, without the program name (default: sys.argv[1:])
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv or argv[0] in ('-h', '--help'):
+        print_usage(sys.stdout if argv else sys.stderr)
+        sys.exit(0 if argv else 1)
+    if argv[0] == '--version':
+        print('{} {}'.format(PROG, __version__))
+        return
+    if argv[0] not in COMMANDS:
+        sys.stderr.write('{}: unknown command {}\n'.format(PROG, argv[0]))
+        print_usage(sys.stderr)
+        sys.exit(2)
+    (module, description) = COMMANDS[argv[0]]
+    importlib.import_module(module).main(argv[1:], '{} {}'.format(PROG, argv[0]))
+
+
+if __name__ == "__main__":
+    main()
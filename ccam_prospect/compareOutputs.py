@@ -0,0 +1,50 @@
+import argparse
+import json
+import os
+import sys
+import time
+from ccam_prospect.utils.OutputComparison import load_outputs, compare_outputs, print_summary
+
+
+def main(argv=None, prog=None):
+    """main
+    compare outputs with golden outputs from the command line
+
+    :param: argv the arguments, without the program name (default: sys.argv[1:])
+    :param: prog the program name shown in the help, e.g. ccam-prospect compare
+    """
+    # create an argument parser
+    parser = argparse.ArgumentParser(prog=prog, description='Compare RAD and REF outputs with golden outputs')
+    parser.add_argument('golden', help="directory of golden RAD and REF files, or a golden cube")
+    parser.add_argument('new', help="directory of new RAD and REF files, or a new cube")
+    parser.add_argument('--atol', action="store", dest='atol', type=float, default=1E-6,
+                        help="absolute tolerance of each channel (default: 1e-6, the last digit of a table)")
+    parser.add_argument('--rtol', action="store", dest='rtol', type=float, default=0.0,
+                        help="relative tolerance of each channel (default: 0)")
+    parser.add_argument('--report', action="store", dest='report',
+                        help="write the deviations of every file to this JSON file")
+    parser.add_argument('-j', '--jobs', action="store", dest='jobs', type=int, default=1,
+                        help="number of processes to read the files")
+
+    args = parser.parse_args(argv)
+    for path in (args.golden, args.new):
+        if not os.path.exists(path):
+            print(path + ' does not exist.')
+            sys.exit(2)
+
+    start = time.time()
+    report = compare_outputs(load_outputs(args.golden, args.jobs), load_outputs(args.new, args.jobs),
+                             args.atol, args.rtol)
+    report.update(golden=args.golden, new=args.new)
+    print_summary(report)
+    print('compared in {:.1f} s'.format(time.time() - start))
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=1)
+        print('report written to ' + os.path.abspath(args.report))
+    if report['files_differ'] or report['only_in_golden'] or report['only_in_new']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
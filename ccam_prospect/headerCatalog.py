@@ -0,0 +1,54 @@
+import argparse
+import sqlite3
+import sys
+import time
+from ccam_prospect.utils.HeaderCatalog import HeaderCatalog
+
+
+def main(argv=None, prog=None):
+    """main
+    build or query a header catalog from the command line
+
+    :param: argv the arguments, without the program name (default: sys.argv[1:])
+    :param: prog the program name shown in the help, e.g. ccam-prospect catalog
+    """
+    # create an argument parser
+    parser = argparse.ArgumentParser(prog=prog, description='Catalog the headers of CCAM PSV and RAD files')
+    parser.add_argument('--catalog', action="store", dest='catalog', required=True,
+                        help="the SQLite catalog file to create or update")
+    parser.add_argument('-d', action="store", dest='directory',
+                        help="Directory containing .tab files to add to the catalog, recursively")
+    parser.add_argument('-q', action="store", dest='query',
+                        help="print the files that match this query, e.g. \"sol between 1000 and 1100 and t_int=34\"")
+
+    args = parser.parse_args(argv)
+    if args.directory is None and args.query is None:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    try:
+        # a query alone does not create a catalog, so a mistyped --catalog is not an empty one
+        catalog = HeaderCatalog(args.catalog, create=args.directory is not None)
+    except FileNotFoundError as e:
+        print(e)
+        sys.exit(1)
+    try:
+        if args.directory is not None:
+            start = time.time()
+            (read, removed) = catalog.update(args.directory)
+            print('{}: {} headers read, {} files removed in {:.1f} s'.format(args.catalog, read, removed,
+                                                                           time.time() - start))
+        if args.query is not None:
+            try:
+                paths = catalog.select(args.query)
+            except sqlite3.Error as e:
+                print(args.query + ': not a valid catalog query - ' + str(e))
+                sys.exit(1)
+            for path in paths:
+                print(path)
+    finally:
+        catalog.close()
+
+
+if __name__ == "__main__":
+    main()
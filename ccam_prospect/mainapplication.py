@@ -1,3 +1,4 @@
+import argparse
 import tkinter as tk
 import os
 from tkinter import filedialog, ttk, messagebox, Grid
@@ -5,8 +6,11 @@ from datetime import datetime
 from ccam_prospect.utils.InputType import InputType, input_type_switcher
 from ccam_prospect.relativeReflectanceCalibration import RelativeReflectanceCalibration
 from ccam_prospect.radianceCalibration import RadianceCalibration
-from ccam_prospect.plotpanel import PlotPanel
 from ccam_prospect.utils.CustomExceptions import CancelExecutionException, InputFileNotFoundException
+from ccam_prospect.utils.CalibrationWorker import CalibrationWorker, PROGRESS, WARNING, DONE
+
+# how often the window checks the calibration running in the background for events (ms)
+POLL_INTERVAL = 50
 
 class MainApplication:
 
@@ -22,9 +26,11 @@ class MainApplication:
         now = datetime.now()
         self.logfile = "badInput_{}.log".format(now.strftime("%Y%m%d.%H%M%S"))
 
-        # set up the calibration environments and the progress monitor
-        self.radiance_cal = RadianceCalibration(self.logfile, self)
-        self.relative_cal = RelativeReflectanceCalibration(self.logfile, self)
+        # set up the calibration environments and the progress monitor.  The calibrations run
+        # in the background and report their progress and warnings through the worker.
+        self.worker = CalibrationWorker()
+        self.radiance_cal = RadianceCalibration(self.logfile, self.worker)
+        self.relative_cal = RelativeReflectanceCalibration(self.logfile, self.worker)
         self.window = root_window
         self.progress_var = tk.IntVar()
         self.overwrite_rad = tk.IntVar()
@@ -80,6 +86,7 @@ class MainApplication:
         self.separator3 = ttk.Separator(root_window, orient="horizontal")
         self.calibrate_rad_button = tk.Button(root_window, text="Calibrate to RAD", width=20, command=self.start_rad)
         self.calibrate_button = tk.Button(root_window, text="Calibrate to REF", width=20, command=self.start_calibration)
+        self.cancel_button = tk.Button(root_window, text="Cancel", state="disabled", command=self.cancel_clicked)
 
         # progress bar
         self.progress = ttk.Progressbar(root_window, orient=tk.HORIZONTAL, length=100, mode='determinate',
@@ -121,6 +128,7 @@ class MainApplication:
         self.overwrite_ref_button.grid(column=2, row=16, columnspan=2, sticky="w", pady=(5, 0), padx=(5, 10))
         self.calibrate_rad_button.grid(column=0, row=17, columnspan=2, sticky="w", pady=(5, 0), padx=(20, 5))
         self.calibrate_button.grid(column=2, row=17, columnspan=2, sticky="w", pady=(5, 0), padx=(5, 10))
+        self.cancel_button.grid(column=4, row=17, pady=(5, 0), padx=(1, 10))
         self.progress.grid(column=0, row=18, columnspan=5, sticky="ew", pady=(10, 10), padx=(5, 5))
 
         self.separator4.grid(column=0, row=19, columnspan=5, sticky="ew", pady=(10,10))
@@ -190,12 +198,65 @@ class MainApplication:
 
     def update_progress(self, value):
         """update_progress
-        update the progress bar to this given value
+        update the progress bar to this given value.  The bar is redrawn with the
+        rest of the window, when the event loop is idle.
         :param: value the value to set the progress bar
         """
         self.progress_var.set(value)
-        self.progress.update()
-        self.window.update_idletasks()
+
+    def run_in_background(self, function, *args):
+        """run_in_background
+        start a calibration in the background and poll it for events until it is done.
+        The calibrate buttons are disabled while it runs.
+        :param: function the calibration to run
+        :param: args the arguments to the calibration
+        """
+        if self.worker.is_running():
+            return
+        self.calibrate_rad_button.config(state="disabled")
+        self.calibrate_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.update_progress(0)
+        self.worker.start(function, *args)
+        self.window.after(POLL_INTERVAL, self.poll_worker)
+
+    def poll_worker(self):
+        """poll_worker
+        handle the events posted by the calibration running in the background: show its
+        progress, ask the user about its warnings, and report how it finished
+        """
+        for (kind, value) in self.worker.get_events():
+            if kind == PROGRESS:
+                self.update_progress(value)
+            elif kind == WARNING:
+                self.worker.answer_warning(value, self.show_warning_dialog(value[0]))
+            elif kind == DONE:
+                self.calibration_done(value)
+                return
+        self.window.after(POLL_INTERVAL, self.poll_worker)
+
+    def calibration_done(self, error):
+        """calibration_done
+        re-enable the calibrate buttons and report how the calibration finished
+        :param: error the exception the calibration stopped with, or None
+        """
+        self.calibrate_rad_button.config(state="normal")
+        self.calibrate_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
+        if isinstance(error, InputFileNotFoundException):
+            messagebox.showinfo('Error', 'The input file ({}) does not exist'.format(error.file))
+        elif isinstance(error, CancelExecutionException):
+            messagebox.showinfo('Cancel', 'You have chosen to cancel. The calibration will not continue.')
+        elif error is not None:
+            messagebox.showinfo('Error', 'The calibration stopped with an error: {}'.format(error))
+        print('******** finished calibration ********')
+
+    def cancel_clicked(self):
+        """cancel_clicked
+        the action handler for the cancel button: stop the calibration after the current file
+        """
+        self.cancel_button.config(state="disabled")
+        self.worker.cancel()
 
     def start_calibration(self):
         """start_calibration
@@ -217,15 +278,9 @@ class MainApplication:
                     messagebox.showinfo('Error', 'The output directory file ({}) does not exist. '
                                                  'Please choose a different output directory'.format(out_dir))
                     return
-        try:
-            # the call to calibrate to relative reflectance
-            self.relative_cal.calibrate_relative_reflectance(file_type, file, custom_directory, out_dir,
-                                                             self.overwrite_rad.get(), self.overwrite_ref.get())
-        except InputFileNotFoundException as ife:
-            messagebox.showinfo('Error', 'The input file ({}) does not exist'.format(ife.file))
-        except CancelExecutionException:
-            messagebox.showinfo('Cancel', 'You have chosen to cancel. The calibration will not continue.')
-        print('******** finished calibration ********')
+        # the call to calibrate to relative reflectance
+        self.run_in_background(self.relative_cal.calibrate_relative_reflectance, file_type, file,
+                               custom_directory, out_dir, self.overwrite_rad.get(), self.overwrite_ref.get())
 
     def start_rad(self):
         """start_rad
@@ -245,16 +300,15 @@ class MainApplication:
                     messagebox.showinfo('Error', 'The output directory file ({}) does not exist. '
                                                  'Please choose a different output directory'.format(out_dir))
                     return
-        try:
-            self.radiance_cal.calibrate_to_radiance(file_type, file, out_dir, self.overwrite_rad.get())
-        except InputFileNotFoundException as ife:
-            messagebox.showinfo('Error', 'The input file ({}) does not exist'.format(ife.file))
-        print('******** finished calibration ********')
+        self.run_in_background(self.radiance_cal.calibrate_to_radiance, file_type, file, out_dir,
+                               self.overwrite_rad.get())
 
     def open_plots(self):
         """open_plots
         open the plotting window
         """
+        # the plotting loads matplotlib and its Tk backend, so it is only imported once it is opened
+        from ccam_prospect.plotpanel import PlotPanel
         self.window.withdraw()
         new_win = tk.Toplevel(self.window)
         def handler(): self.on_close_other_frame(new_win)
@@ -277,7 +331,15 @@ class MainApplication:
         return messagebox.askyesnocancel('WARNING', warning + "\n" + question)
 
 
-def main():
+def main(argv=None, prog=None):
+    """main
+    open the calibration window
+
+    :param: argv the arguments, without the program name (default: sys.argv[1:]).  There are none but -h.
+    :param: prog the program name shown in the help, e.g. ccam-prospect gui
+    """
+    parser = argparse.ArgumentParser(prog=prog, description='Open the CCAM_PROSPECT calibration window')
+    parser.parse_args(argv)
     root_window = tk.Tk()
     root_window.title("CCAM_PROSPECT")
     app = MainApplication(root_window)
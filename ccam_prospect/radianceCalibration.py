@@ -1,19 +1,44 @@
 import argparse
+import contextlib
+import functools
+import sqlite3
 import os
-import math as math
 import numpy as np
 import sys
 from datetime import datetime
 from ccam_prospect.utils.InputType import InputType
 import ccam_prospect.utils.constant as constants
-from ccam_prospect.utils.Utilities import get_integration_time, write_final, write_label, get_header_values
+from ccam_prospect.utils.Utilities import LABEL_KEYS, write_final, write_label, integration_time, get_label_values
+from ccam_prospect.utils.Discovery import discover_files, walk_files, is_psv_file, read_file_list
+from ccam_prospect.utils.Parallel import run_in_pool
+from ccam_prospect.utils.Pipeline import CalibrationJob, Pipeline, run_stages
+from ccam_prospect.utils.Manifest import get_manifest
+from ccam_prospect.utils.PsvFile import PsvFile
+from ccam_prospect.utils.HeaderCatalog import HeaderCatalog
+from ccam_prospect.utils.Preflight import list_inputs, preflight, write_report
+from ccam_prospect.utils.RunLog import MISSING, UNREADABLE, INVALID_HEADER, INVALID_QUERY, get_run_log, make_entry
+from ccam_prospect.utils.InputFiles import INPUT_ERRORS, get_archive_index, input_exists, get_output_base, find_input, \
+    strip_compression
+from ccam_prospect.utils.SharedConstants import SharedConstants, attach_constants
+from ccam_prospect.utils.SpectralCube import SpectralCube, make_cube_entry
+from ccam_prospect.utils.StageTimings import StageTimings, run_profiled
+from ccam_prospect.utils.Progress import FAILED, get_outcome, make_run_progress
+from ccam_prospect.utils.LabelWriter import LabelWriter
+from ccam_prospect.utils.CalibrationConstants import get_calibration_constants
 from ccam_prospect.utils.CustomExceptions import NonStandardHeaderException, CancelExecutionException, \
     InputFileNotFoundException
 
+# channel ranges of each spectrometer in a combined uv, vis, vnir spectrum and the
+# channels of that spectrometer used to compute its offset (see remove_batch_offsets)
+SPECTROMETER_OFFSETS = [((0, 2048), (0, 11)),          # UV
+                        ((2048, 4096), (0, 5)),        # VIS
+                        ((4096, 6144), (1816, 1832))]  # VNIR
+
 
 class RadianceCalibration:
 
-    def __init__(self, log_file, main_app=None):
+    def __init__(self, log_file, main_app=None, jobs=1, pipeline=False, manifest=None, cube=None, catalog=None,
+                 timing=None, progress_bar=False, status_file=None):
         # variables parsed from spectra file
         self.vnir = []
         self.vis = []
@@ -21,157 +46,179 @@ class RadianceCalibration:
         self.headers = {}
         self.main_app = main_app
         self.total_files = 1
-        self.current_file = 1
         self.header_string = ""
         self.logfile = log_file
+        self.run_log = get_run_log(log_file)  # buffered log of the inputs skipped, see RunLog
+        self.log_entries = None  # log entries kept to send back from a worker process
+        self.jobs = jobs       # number of processes for a list or directory of files
+        self.pipeline = pipeline  # stream a list or directory through threaded read, calibrate and write stages
+        # manifest of the inputs of every output, to skip outputs that are up to date
+        self.manifest = get_manifest(manifest) if manifest else None
+        # one file with every spectrum calibrated in the run, see SpectralCube
+        self.cube = SpectralCube(cube, 'RAD') if cube else None
+        self.cube_rows = None  # spectra for the cube kept to send back from a worker process
+        self.catalog = catalog  # header catalog to choose files by query, see HeaderCatalog
+        self.timing = timing    # JSON report of the time of each stage of each file, see StageTimings
+        self.timings = None     # the time of each stage in the current run, if there is a timing report
+        self.progress_bar = progress_bar  # draw a progress bar on the terminal
+        self.status_file = status_file    # JSON or Prometheus file of the status of a run, see StatusFile
+        self.progress = None    # the progress of the current run, if it is shown anywhere, see RunProgress
+        self.outcomes = None    # outcome of each file kept to send back from a worker process
+        self.label_writer = None  # writes the labels of a run in the background, see LabelWriter
         self.show_header_warning = True
         self.show_list_warning = True
 
-    def get_headers(self, filename):
-        """get_headers
-        Just grab the first 29 lines (the header) to be copied to the calibrated rad file
+    def write_log(self, file, stage, reason, message):
+        """write_log
+        track a skipped input in the run log.  In a worker process the
+        entry is kept and logged by the main process instead.
+
+        :param: file the input that was skipped
+        :param: stage the stage that skipped it, e.g. radiance calibration
+        :param: reason the reason it was skipped, e.g. MISSING
+        :param: message the description of the problem
         """
-        with open(filename, 'r') as f:
-            self.header_string = [next(f) for x in range(29)]
+        entry = make_entry(file, stage, reason, message)
+        if self.log_entries is not None:
+            self.log_entries.append(entry)
+        else:
+            self.run_log.add(entry)
 
-    def read_spectra(self, filename):
-        """read_spectra
-        open the response file and read the appropriate lines into
-        each array of vnir, vis, and uv
+    def report_file(self, file, outcome):
+        """report_file
+        count a finished file in the progress of the run, if it is shown.  In a worker
+        process the outcome is kept and counted by the main process instead.
 
-            field    line
+        :param: file the input file
+        :param: outcome the outcome of the file, one of Progress.OUTCOMES
+        """
+        if self.outcomes is not None:
+            self.outcomes.append((file, outcome))
+        elif self.progress is not None:
+            self.progress.add(file, outcome)
 
-            vnir:     79:2127
-            vis:      2227:4275
-            uv:       4375:6423
+    def finish_job(self, job):
+        """finish_job
+        report a file once it is finished, see report_file
+
+        :param: job the CalibrationJob for the file
         """
-        with open(filename, 'r') as f:
-            self.vnir = np.array([float(line.rstrip('\n')) for line in f.readlines()[79:2127]])
-        with open(filename, 'r') as f:
-            self.vis = np.array([float(line.rstrip('\n')) for line in f.readlines()[2227:4275]])
-        with open(filename, 'r') as f:
-            self.uv = np.array([float(line.rstrip('\n')) for line in f.readlines()[4375:6423]])
-
-    def remove_offsets(self):
-        """remove_offsets
-        Find the offsets for each channel and subtract from each signal in DN
-        This version uses the following lines to compute offsets
-            VNIR: 1905-1920  ->   1816:1832
-            VIS:  2237-2241  ->   0:5
-            UV:   4385-4395  ->   0:11
-
-        :return: the new values, with offset subtracted
+        self.report_file(job.input_file, get_outcome(job))
+
+    def add_to_cube(self, job):
+        """add_to_cube
+        add the calibrated spectrum to the cube, if there is one.  In a worker process the
+        spectrum is kept and added by the main process instead.
+
+        :param: job the CalibrationJob for the file
         """
-        # get appropriate sets of values
-        vnir_off = self.vnir[1816:1832]
-        vis_off = self.vis[0:5]
-        uv_off = self.uv[0:11]
-
-        # get mean of each set of values
-        vnir_mean = np.mean(vnir_off)
-        vis_mean = np.mean(vis_off)
-        uv_mean = np.mean(uv_off)
-
-        # subtract offset from each channel
-        self.vnir = np.array([v - vnir_mean for v in self.vnir])
-        self.vis = np.array([v - vis_mean for v in self.vis])
-        self.uv = np.array([v - uv_mean for v in self.uv])
-
-    def get_solid_angle(self):
-        """get_solid_angle
-        Calculate the solid angle subtended by the telescope aperature
-        SA = pi * sin(arctan((a/2)/d))^2
-
-        :return: the solid angle, in radians
+        if self.cube_rows is None and self.cube is None:
+            return
+        row = (make_cube_entry(job.input_file, job.headers, job.original_label, job.label_values), job.wavelength,
+               job.values)
+        if self.cube_rows is not None:
+            self.cube_rows.append(row)
+        else:
+            self.cube.append(*row)
+
+    def time_stage(self, job, stage):
+        """time_stage
+        time one stage of the calibration of a file, if the run is timed
+
+        :param: job the CalibrationJob for the file
+        :param: stage the name of the stage, one of StageTimings.STAGES
+        :return: context manager to time the stage in
         """
-        try:
-            distance = float(self.headers['distToTarget'])
-        except KeyError:
-            raise NonStandardHeaderException
+        if self.timings is None:
+            return contextlib.nullcontext()
+        return self.timings.time(job.input_file, stage)
 
-        return math.pi * math.pow(math.sin(math.atan(constants.aperture / 2 / distance)), 2)
+    def read_file(self, filename, timer=None):
+        """read_file
+        read the PSV file once, keeping the header values, the header lines
+        to be copied to the calibrated rad file, and the vnir, vis and uv spectra
 
-    def get_area_on_target(self):
-        """get_area_on_target
-        Calculate the associated area on the target based on the
-        distance to target and angular field of view
-            A = pi * (FOV * d/2)^2
+            field    line
+
+            vnir:     79:2127
+            vis:      2227:4275
+            uv:       4375:6423
 
-        :return: the area on the target
+        :param: filename the PSV file to read
+        :param: timer function of a stage name that returns a context manager timing that stage, see PsvFile
+        :return: the parsed PSV file
         """
-        try:
-            distance = float(self.headers['distToTarget'])
-        except KeyError:
-            raise NonStandardHeaderException
-        return math.pi * math.pow(constants.fov * distance / 2 / 10, 2)
+        psv = PsvFile(filename, timer)
+        self.headers = psv.headers
+        self.header_string = psv.header_string
+        self.vnir = psv.vnir
+        self.vis = psv.vis
+        self.uv = psv.uv
+        return psv
 
     @staticmethod
-    def get_radiance(photons, wavelengths, t_int, fov_tgt, sa_steradian):
-        """get_radiance
-        Calculate the radiance value of each of the spectra values in photons
-        RAD = p/t/A/SA/w
-        where p  = value of spectra in photons
-              t  = integration time
-              A  = area on the target
-              SA = the solid angle subtended by the telescope aperture
-              w  = the spectral bin width
-
-        :param photons: the values for the observation, in photons
-        :param wavelengths: the wavelengths corresponding to each value in photos
-        :param t_int: integration time
-        :param fov_tgt: the area of the FOV on the target
-        :param sa_steradian: solid angle subtended by aperture in steradians
-        :return: the calibrated radiance values
+    def calibrate_batch(spectra_dn, distance, ipbc_divisor, ict_divisor):
+        """calibrate_batch
+        Calibrate a stack of spectra to radiance in one call. Each row is a combined
+        uv, vis, vnir spectrum in DN, ordered by wavelength (see PsvFile.get_spectrum).
+        Removes the offsets, then applies the gain, solid angle, area on target, bin width
+        and unit conversion to every row at once.
+
+        :param spectra_dn: N x 6144 array of spectra, in DN
+        :param distance: the distance to target of each spectrum
+        :param ipbc_divisor: the IPBC divisor of each spectrum
+        :param ict_divisor: the ICT divisor of each spectrum
+        :return: N x 6144 array of radiance values, in W/m^2/sr/um
         """
-        rad = np.array([p / t_int / fov_tgt / sa_steradian for p in photons])
-
-        # divide each photon by the bin width (w = next wavelength - this wavelength)
-        w = np.zeros(len(wavelengths))
-        for iw in range(0, len(wavelengths) - 1):
-            i_next = iw + 1
-            w[iw] = wavelengths[i_next] - wavelengths[iw]
-        w[-1] = w[-2]
-        return np.divide(rad, w)
+        return RadianceCalibration.get_batch_radiance(RadianceCalibration.remove_batch_offsets(spectra_dn),
+                                                      distance, ipbc_divisor, ict_divisor)
 
     @staticmethod
-    def get_wl_and_gain(gain_file):
-        """get_wl_and_response
-        read the gain file to get the wavelength and response function
-        (photons/DN) for each response to use to convert to units of photons
-
-        :param gain_file: the gain file
-        :return: wl, the wavelength for each response
-        :return: gain, the gain for each response to get photons/DN
-        """
-        with open(gain_file, 'r') as f:
-            wl = np.array([float(row.split()[0]) for row in f])
-        with open(gain_file, 'r') as f:
-            gain = np.array([float(row.split()[1]) for row in f])
+    def remove_batch_offsets(spectra_dn):
+        """remove_batch_offsets
+        subtract the offset of each spectrometer from a stack of spectra (see calibrate_batch)
 
-        return wl, gain
+        :param spectra_dn: N x 6144 array of spectra, in DN
+        :return: N x 6144 array of spectra with the offsets removed, in DN
+        """
+        spectra = np.array(spectra_dn, dtype=float, ndmin=2)
+        for (start, end), (off_start, off_end) in SPECTROMETER_OFFSETS:
+            channels = spectra[:, start:end]
+            channels -= np.mean(channels[:, off_start:off_end], axis=1, keepdims=True)
+        return spectra
 
     @staticmethod
-    def convert_to_output_units(radiance, wavelengths):
-        """convert_to_output_untis
-        do the final conversion to output units
-
-        :param radiance: the final radiance values
-        :param wavelengths: wavelengths of the radiance values
-        :return: the final radiance in correct output units
+    def get_batch_radiance(spectra, distance, ipbc_divisor, ict_divisor):
+        """get_batch_radiance
+        apply the gain, solid angle, area on target, bin width and unit conversion
+        to a stack of spectra with the offsets removed (see calibrate_batch)
+
+        :param spectra: N x 6144 array of spectra with the offsets removed, in DN
+        :param distance: the distance to target of each spectrum
+        :param ipbc_divisor: the IPBC divisor of each spectrum
+        :param ict_divisor: the ICT divisor of each spectrum
+        :return: N x 6144 array of radiance values, in W/m^2/sr/um
         """
-        rad_hc = np.multiply(radiance, constants.hc)
-        converted_rad = np.divide(rad_hc, np.multiply(wavelengths, 1E-9))
-        return np.multiply(converted_rad, 1E7)
+        distance = np.asarray(distance, dtype=float).reshape(-1, 1)
+        ipbc_divisor = np.asarray(ipbc_divisor, dtype=float).reshape(-1, 1)
+        ict_divisor = np.asarray(ict_divisor, dtype=float).reshape(-1, 1)
+
+        t_int = integration_time(ipbc_divisor, ict_divisor)
+        sa_steradian = np.pi * np.sin(np.arctan(constants.aperture / 2 / distance)) ** 2
+        fov_tgt = np.pi * (constants.fov * distance / 2 / 10) ** 2
+
+        return spectra * get_calibration_constants().radiance_factor / (t_int * fov_tgt * sa_steradian)
 
     @staticmethod
     def psv_to_rad(psv_file, out_dir):
         """psv_to_rad
         replace each instance of PSV with RAD.
-        Also replace .txt with .tab in the case of a raw file
+        Also replace .txt with .tab in the case of a raw file.  The RAD file of a compressed
+        PSV file is not compressed, and that of a PSV file inside an archive is next to the archive.
 
         :param: the original file
         """
-        (path, filename) = os.path.split(psv_file)
+        (path, filename) = os.path.split(get_output_base(psv_file))
         rad_filename = filename.replace('psv', 'rad')
         rad_filename = rad_filename.replace('PSV', 'RAD')
         rad_filename = rad_filename.replace('.TXT', '.tab')
@@ -185,25 +232,23 @@ class RadianceCalibration:
 
         return out_filename
 
-    def update_progress(self, value=None):
+    def update_progress(self, value):
         """update_progress
-        update the progress bar to this value
+        update the progress bar to this value, within the calibration of a single file.
+        The progress of a run of several files is counted by report_file.
         """
         if self.main_app is not None:
-            if value is not None:
-                self.main_app.update_progress(value)
-            else:
-                self.main_app.update_progress((self.current_file / self.total_files) * 100)
+            self.main_app.update_progress(value)
 
     @staticmethod
     def get_original_label(filename):
         """get_original_label
-        the filename of the label for the input psv file.  should be a.lbl file """
-        original_label = filename.replace('.tab', '.lbl')
+        the filename of the label for the input psv file.  should be a.lbl file, which may be compressed """
+        original_label = strip_compression(filename).replace('.tab', '.lbl')
         original_label = original_label.replace('.txt', '.lbl')
         original_label = original_label.replace('.TAB', '.lbl')
         original_label = original_label.replace('.TXT', '.lbl')
-        return original_label
+        return find_input(original_label) or original_label
 
     def calibrate_file(self, ccam_file, out_dir, overwrite):
         """calibrate_file
@@ -213,44 +258,70 @@ class RadianceCalibration:
         :param: out_dir: output directory
         :param: overwrite: a boolean representing if files should be overwritten or not
         """
+        job = CalibrationJob(ccam_file, out_dir, overwrite)
+        run_stages(self.get_stages(), job)
+        self.finish_job(job)
+        return job.result
+
+    def get_stages(self):
+        """get_stages
+        the steps to calibrate a file, in order.  Each takes the CalibrationJob for the file
+        and returns it, or returns None once the file is finished.
+        """
+        return [self.read_stage, self.calibrate_stage, self.write_stage]
+
+    def read_stage(self, job):
+        """read_stage
+        check the input file and read the PSV file and its header values
+
+        :param: job the CalibrationJob for the file
+        :return: the job, or None if the file is finished
+        """
+        ccam_file = job.input_file
         # check that file exists, is a file, and is a psv *.tab or .txt file
-        if os.path.exists(ccam_file) and os.path.isfile(ccam_file):
-            if "psv" in ccam_file.lower() and \
-                    (ccam_file.lower().endswith(".tab") or ccam_file.lower().endswith(".txt")):
+        if input_exists(ccam_file):
+            if is_psv_file(ccam_file):
 
-                out_filename = self.psv_to_rad(ccam_file, out_dir)
-                if not overwrite:
+                job.out_filename = self.psv_to_rad(ccam_file, job.out_dir)
+                if not job.overwrite:
                     # if we don't want to overwrite existing files, we can skip this file if it already exists
-                    if os.path.exists(out_filename) and os.path.isfile(out_filename):
-                        print(out_filename + " already exists, skipping")
-                        return True
+                    if os.path.exists(job.out_filename) and os.path.isfile(job.out_filename):
+                        print(job.out_filename + " already exists, skipping")
+                        job.result = True
+                        job.skipped = True
+                        return None
 
                 # check for original label
-                original_label = self.get_original_label(ccam_file)
-
-                self.headers = get_header_values(ccam_file)
-                self.get_headers(ccam_file)
+                job.original_label = self.get_original_label(ccam_file)
+
+                if self.manifest is not None:
+                    # skip outputs already written from the same input and constants
+                    job.record = self.manifest.make_record(ccam_file, job.original_label,
+                                                           get_calibration_constants().gain_file)
+                    if self.manifest.is_current(job.out_filename, job.record):
+                        print(job.out_filename + " is up to date, skipping")
+                        job.result = True
+                        job.skipped = True
+                        return None
 
                 try:
-                    self.read_spectra(ccam_file)
-                except ValueError:
-                    with open(self.logfile, 'a+') as log:
-                        print(ccam_file + ': not formatted correctly. skipping')
-                        log.write(ccam_file + ': radiance calibration - file not formatted correctly \n')
-                    return False
-
-                self.remove_offsets()
-
-                # calculate some needed values
+                    psv = self.read_file(ccam_file, functools.partial(self.time_stage, job))
+                except INPUT_ERRORS:
+                    print(ccam_file + ': not formatted correctly. skipping')
+                    self.write_log(ccam_file, 'radiance calibration', UNREADABLE, 'file not formatted correctly')
+                    job.result = False
+                    return None
+                job.headers = psv.headers
+                job.header_string = psv.header_string
+                job.values = psv.get_spectrum()
+
+                # get the header values needed for the calibration
                 try:
-                    t_int = get_integration_time(ccam_file)
-                    sa_steradian = self.get_solid_angle()
-                    fov_tgt = self.get_area_on_target()
+                    job.calibration_headers = psv.get_calibration_headers()
                 except NonStandardHeaderException:
                     warning = 'not a valid PSV file header. Skipping this file.'
                     # write to log file
-                    with open(self.logfile, 'a+') as log:
-                        log.write(ccam_file + ': radiance calibration - ' + warning + '\n')
+                    self.write_log(ccam_file, 'radiance calibration', INVALID_HEADER, warning)
                     if self.show_header_warning:
                         # show warning
                         if self.main_app is not None:
@@ -259,56 +330,90 @@ class RadianceCalibration:
                         # cancel
                         raise CancelExecutionException
                     # exit because file was invalid
-                    return False
+                    job.result = False
+                    return None
 
-                if self.total_files == 1:
-                    self.update_progress(25)
-
-                # combine arrays into one ordered by wavelength
-                all_spectra_dn = np.concatenate([self.uv, self.vis, self.vnir])
-
-                # get the wavelengths and gains from gain_mars.edit
-                my_path = os.path.abspath(os.path.dirname(__file__))
-                gain_file = os.path.join(my_path, "constants/gain_mars.edit")
-                (wavelength, gain) = self.get_wl_and_gain(gain_file)
+                if input_exists(job.original_label):
+                    # read the values of the original label once, for the new label and the cube
+                    with self.time_stage(job, 'read_label'):
+                        job.label_values = get_label_values(job.original_label, LABEL_KEYS)
 
-                # multiply by the gain to get in photos
-                all_spectra_photons = np.multiply(all_spectra_dn, gain)
-
-                # calculate the radiance values
-                radiance = self.get_radiance(all_spectra_photons, wavelength, t_int, fov_tgt, sa_steradian)
-                if self.total_files == 1:
-                    self.update_progress(50)
-
-                # convert to units of W/m^2/sr/um from phot/sec/cm^2/sr/nm
-                radiance_final = self.convert_to_output_units(radiance, wavelength)
-
-                # rename the PSV file to RAD
-                write_final(out_filename, wavelength, radiance_final, header=self.header_string)
-
-                if os.path.exists(original_label):
-                    # write new label based on original, if it exists
-                    (path, filename) = os.path.split(original_label)
-                    new_label_filename = filename.replace('PSV', 'RAD')
-                    new_label_filename = new_label_filename.replace('psv', 'rad')
-                    new_label_filename = new_label_filename.replace('lbl', 'xml')
-                    (out_path, filename) = os.path.split(out_filename)
-                    new_label = os.path.join(out_path, new_label_filename)
-                    write_label(new_label, original_label, True)
-                print(ccam_file + ' calibrated and written to ' + out_filename)
                 if self.total_files == 1:
-                    self.update_progress(100)
-                return True
+                    self.update_progress(25)
+                return job
             else:
-                return False
+                job.result = False
+                return None
         else:
             if self.main_app is not None:
                 raise InputFileNotFoundException(ccam_file)
             if "psv" in ccam_file or "rad" in ccam_file or "ref" in ccam_file:
                 # only log if a PDS file
                 print(ccam_file + " does not exist.")
-                with open(self.logfile, 'a+') as log:
-                    log.write(ccam_file + ': radiance input - file does not exist \n')
+                self.write_log(ccam_file, 'radiance input', MISSING, 'file does not exist')
+            return None
+
+    def calibrate_stage(self, job):
+        """calibrate_stage
+        remove offsets and calculate the radiance values in units of W/m^2/sr/um
+
+        :param: job the CalibrationJob for the file
+        :return: the job
+        """
+        (distance, ipbc, ict) = job.calibration_headers
+        with self.time_stage(job, 'offsets'):
+            spectra = self.remove_batch_offsets(job.values)
+        with self.time_stage(job, 'radiance'):
+            job.values = self.get_batch_radiance(spectra, distance, ipbc, ict)[0]
+        job.wavelength = get_calibration_constants().wavelength
+        if self.total_files == 1:
+            self.update_progress(50)
+        return job
+
+    def write_stage(self, job):
+        """write_stage
+        write the RAD file, and a new label if the original label exists
+
+        :param: job the CalibrationJob for the file
+        :return: the job
+        """
+        # rename the PSV file to RAD
+        with self.time_stage(job, 'write_table'):
+            write_final(job.out_filename, job.wavelength, job.values, header=job.header_string)
+
+        if job.label_values is not None:
+            # write new label based on original, if it exists
+            (path, filename) = os.path.split(strip_compression(job.original_label))
+            new_label_filename = filename.replace('PSV', 'RAD')
+            new_label_filename = new_label_filename.replace('psv', 'rad')
+            new_label_filename = new_label_filename.replace('lbl', 'xml')
+            (out_path, filename) = os.path.split(job.out_filename)
+            new_label = os.path.join(out_path, new_label_filename)
+            if self.label_writer is not None:
+                self.label_writer.submit(self.write_new_label, job, new_label)
+            else:
+                self.write_new_label(job, new_label)
+        if self.manifest is not None:
+            self.manifest.record(job.out_filename, job.record)
+        self.add_to_cube(job)
+        print(job.input_file + ' calibrated and written to ' + job.out_filename)
+        if self.total_files == 1:
+            self.update_progress(100)
+        job.result = True
+        return job
+
+    def write_new_label(self, job, new_label):
+        """write_new_label
+        write the PDS4 label of a RAD file and record it in the manifest.  This runs in
+        the thread of the label writer, if there is one.
+
+        :param: job the CalibrationJob for the file
+        :param: new_label the label to write
+        """
+        with self.time_stage(job, 'write_label'):
+            write_label(new_label, job.original_label, True, job.label_values)
+        if self.manifest is not None:
+            self.manifest.record(new_label, job.record)
 
     def calibrate_directory(self, directory, out_dir, overwrite):
         """calibrate_directory
@@ -318,28 +423,24 @@ class RadianceCalibration:
         :param: out_dir the destination directory for output
         :param: overwrite a boolean representing if files should be overwritten or not
        """
-        # total number of files to potentially calibrate
-        self.total_files = sum([len(files) for r, d, files in os.walk(directory)])
-        self.current_file = 1
         try:
-            for file in os.listdir(directory):
-                full_path = os.path.join(directory, file)
-                if os.path.isdir(full_path) and full_path is not out_dir:
-                    # recursive call for each subdirectory
-                    self.calibrate_directory(os.path.join(directory, file), out_dir, overwrite)
-                else:
-                    self.calibrate_file(full_path, out_dir, overwrite)
-                    self.current_file += 1
-                    self.update_progress()
-            self.update_progress(100)
-            return True
+            if self.pipeline:
+                # stream the PSV files straight from the walk of the tree
+                files = walk_files(directory, is_psv_file, out_dir)
+            else:
+                # walk the tree once to find every PSV file to calibrate
+                files = discover_files(directory, is_psv_file, out_dir)
         except FileNotFoundError:
             print(directory + " does not exist.")
-            with open(self.logfile, 'a+') as log:
-                log.write(directory + ': radiance input - directory does not exist \n')
+            self.write_log(directory, 'radiance input', MISSING, 'directory does not exist')
             if self.main_app is not None:
                 raise InputFileNotFoundException(directory)
             return False
+        if self.pipeline:
+            self.calibrate_pipeline(files, out_dir, overwrite)
+        else:
+            self.calibrate_files(files, out_dir, overwrite)
+        return True
 
     def calibrate_list(self, list_file, out_dir, overwrite):
         """calibrate_list
@@ -350,67 +451,226 @@ class RadianceCalibration:
         :param: overwrite a boolean representing if files should be overwritten or not
         """
         try:
-            # read each line into a list of files
-            files = open(list_file).read().splitlines()
+            list_handle = open(list_file)
         except FileNotFoundError:
             print(list_file + " radiance input: file does not exist")
-            with open(self.logfile, 'a+') as log:
-                log.write(list_file + ':   radiance input: file does not exist \n')
+            self.write_log(list_file, 'radiance input', MISSING, 'file does not exist')
             if self.main_app is not None:
                 raise InputFileNotFoundException(list_file)
             return False
+        with list_handle:
+            if self.pipeline:
+                # stream each line of the list through the pipeline
+                self.calibrate_pipeline(read_file_list(list_handle), out_dir, overwrite)
+            else:
+                # read each line into a list of files
+                self.calibrate_files(list(read_file_list(list_handle)), out_dir, overwrite)
+        return True
+
+    def calibrate_query(self, query, out_dir, overwrite):
+        """calibrate_query
+        calibrate the PSV files in the header catalog that match this query
+
+        :param: query the condition on the catalog columns, e.g. "sol between 1000 and 1100 and t_int = 34"
+        :param: out_dir the destination directory for output
+        :param: overwrite a boolean representing if files should be overwritten or not
+        """
+        catalog = HeaderCatalog(self.catalog, create=False)
+        try:
+            files = catalog.select(query, is_psv_file)
+        except sqlite3.Error as e:
+            print(query + ': not a valid catalog query - ' + str(e))
+            self.write_log(query, 'radiance input', INVALID_QUERY, 'not a valid catalog query')
+            return False
+        finally:
+            catalog.close()
+        if self.pipeline:
+            self.calibrate_pipeline(files, out_dir, overwrite)
+        else:
+            self.calibrate_files(files, out_dir, overwrite)
+        return True
+
+    def calibrate_files(self, files, out_dir, overwrite):
+        """calibrate_files
+        calibrate each file, one after another or on a pool of self.jobs processes.
+        The results and the log lines for each file come back in the same order as the files.
+
+        :param: files the list of files to calibrate
+        :param: out_dir the destination directory for output
+        :param: overwrite a boolean representing if files should be overwritten or not
+        :return: the result of calibrate_file for each file
+        """
         self.total_files = len(files)
-        self.current_file = 1
+        if self.progress is not None:
+            self.progress.set_total(len(files))
+        results = []
+        if self.jobs > 1:
+            manifest_path = self.manifest.path if self.manifest is not None else None
+            tasks = [(self.logfile, manifest_path, self.cube is not None, self.timings is not None, file, out_dir,
+                      overwrite) for file in files]
+            # load the gain file once, for every worker to share
+            shared = SharedConstants()
+            # list each compressed tar archive once, rather than once in each worker
+            archives = get_archive_index(files)
+            try:
+                for (result, log_entries, manifest_changes, cube_rows, timing_records, outcomes) in run_in_pool(
+                        calibrate_file_worker, tasks, self.jobs, attach_constants, (shared.descriptor,),
+                        archives):
+                    for entry in log_entries:
+                        self.run_log.add(entry)
+                    if timing_records:
+                        self.timings.extend(timing_records)
+                    if manifest_changes:
+                        self.manifest.update(manifest_changes)
+                    for row in cube_rows or []:
+                        self.cube.append(*row)
+                    results.append(result)
+                    for (file, outcome) in outcomes:
+                        self.report_file(file, outcome)
+            finally:
+                shared.close()
+            return results
+
         for file in files:
             # calibrate each file in the list
             try:
-                self.calibrate_file(file, out_dir, overwrite)
-                self.current_file += 1
-                self.update_progress()
+                results.append(self.calibrate_file(file, out_dir, overwrite))
             except InputFileNotFoundException:
+                results.append(False)
+                self.report_file(file, FAILED)
                 warning = file + ": file not found. Skipping this file."
                 if self.show_list_warning:
                     print(warning)
-                    with open(self.logfile, 'a+') as log:
-                        log.write(file + ': radiance calibration - file does not exist \n')
+                    self.write_log(file, 'radiance calibration', MISSING, 'file does not exist')
                     if self.main_app is not None:
                         self.show_list_warning = self.main_app.show_warning_dialog(warning)
                 if self.show_list_warning is None:
                     # cancel
                     raise CancelExecutionException
-        self.update_progress(100)
-        return True
+        return results
+
+    def calibrate_pipeline(self, files, out_dir, overwrite):
+        """calibrate_pipeline
+        calibrate each file with the read, calibrate and write stages running in their own
+        threads, connected by bounded queues, so reading, calibrating and writing overlap.
+
+        :param: files iterable of the files to calibrate, read as the pipeline needs them
+        :param: out_dir the destination directory for output
+        :param: overwrite a boolean representing if files should be overwritten or not
+        """
+        jobs = (CalibrationJob(file, out_dir, overwrite) for file in files)
+        Pipeline(self.get_stages(), on_finished=self.finish_job).run(jobs)
 
     def calibrate_to_radiance(self, file_type, file_name, out_dir, overwrite):
         """calibrate_to_radiance
         entry point to calibrate a file, list of files, or directory
 
-        :param: file_type either file, list of files, or directory
-        :param: file_name the name of the file / directory
+        :param: file_type either file, list of files, directory, or query of the header catalog
+        :param: file_name the name of the file / directory, or the query
         :param: out_dir the destination directory for output
         :param: overwrite a boolean representing if files should be overwritten or not
         """
-        if file_type.value is InputType.FILE.value:
-            return self.calibrate_file(file_name, out_dir, overwrite)
-        elif file_type.value is InputType.FILE_LIST.value:
-            return self.calibrate_list(file_name, out_dir, overwrite)
-        else:
-            return self.calibrate_directory(file_name, out_dir, overwrite)
-
-
-if __name__ == "__main__":
+        self.run_log.start_run()
+        self.timings = StageTimings() if self.timing else None
+        self.progress = make_run_progress('radiance', self.main_app, self.progress_bar, self.status_file)
+        # worker processes write their own labels, so there is only a label writer on one process
+        self.label_writer = LabelWriter() if self.jobs <= 1 else None
+        try:
+            if file_type.value is InputType.FILE.value:
+                if self.progress is not None:
+                    self.progress.set_total(1)
+                return self.calibrate_file(file_name, out_dir, overwrite)
+            elif file_type.value is InputType.FILE_LIST.value:
+                return self.calibrate_list(file_name, out_dir, overwrite)
+            elif file_type.value is InputType.QUERY.value:
+                return self.calibrate_query(file_name, out_dir, overwrite)
+            else:
+                return self.calibrate_directory(file_name, out_dir, overwrite)
+        finally:
+            try:
+                if self.label_writer is not None:
+                    self.label_writer.close()
+            finally:
+                self.label_writer = None
+                self.run_log.finish_run()
+                if self.manifest is not None:
+                    self.manifest.save()
+                if self.cube is not None:
+                    self.cube.close()
+                if self.timings is not None:
+                    self.timings.write_report(self.timing)
+                if self.progress is not None:
+                    self.progress.finish()
+
+
+def calibrate_file_worker(task):
+    """calibrate_file_worker
+    calibrate one file in a worker process
+
+    :param: task tuple of the log file, manifest file, whether there is a cube, whether the run is timed,
+            file to calibrate, output directory and overwrite option
+    :return: the result of calibrate_file, the log entries, the manifest changes,
+             the spectra for the cube, the timing records and the outcome for this file
+    """
+    (log_file, manifest, cube, timed, ccam_file, out_dir, overwrite) = task
+    radiance_cal = RadianceCalibration(log_file, manifest=manifest)
+    radiance_cal.log_entries = []
+    radiance_cal.outcomes = []
+    if cube:
+        radiance_cal.cube_rows = []
+    if timed:
+        radiance_cal.timings = StageTimings()
+    result = radiance_cal.calibrate_file(ccam_file, out_dir, overwrite)
+    manifest_changes = radiance_cal.manifest.take_changes() if radiance_cal.manifest is not None else None
+    timing_records = radiance_cal.timings.records if timed else None
+    return (result, radiance_cal.log_entries, manifest_changes, radiance_cal.cube_rows, timing_records,
+            radiance_cal.outcomes)
+
+
+def main(argv=None, prog=None):
+    """main
+    the radiance calibration from the command line
+
+    :param: argv the arguments, without the program name (default: sys.argv[1:])
+    :param: prog the program name shown in the help, e.g. ccam-prospect rad
+    """
     # create an argument parser
-    parser = argparse.ArgumentParser(description='Calibrate CCAM to Radiance')
+    parser = argparse.ArgumentParser(prog=prog, description='Calibrate CCAM to Radiance')
     parser.add_argument('-f', action="store", dest='ccamFile', help="CCAM psv *.tab file")
     parser.add_argument('-d', action="store", dest='directory', help="Directory containing .tab files")
     parser.add_argument('-l', action="store", dest='list', help="File with a list of .tab files")
+    parser.add_argument('-q', action="store", dest='query',
+                        help="calibrate the files in the header catalog that match this query, e.g. "
+                             "\"sol between 1000 and 1100 and t_int=34\" (needs --catalog)")
+    parser.add_argument('--catalog', action="store", dest='catalog',
+                        help="header catalog made by headerCatalog.py, for -q")
     parser.add_argument('-o', action="store", dest='out_dir', help="directory to store the output files")
     parser.add_argument('--no-overwrite-rad', action="store_false", dest='overwrite',
                         help="do not overwrite existing files")
+    run_mode = parser.add_mutually_exclusive_group()
+    run_mode.add_argument('-j', '--jobs', action="store", dest='jobs', type=int, default=1,
+                          help="number of processes to calibrate a list or directory of files")
+    run_mode.add_argument('--pipeline', action="store_true", dest='pipeline',
+                          help="overlap reading, calibrating and writing of a list or directory of files")
+    parser.add_argument('--manifest', action="store", dest='manifest',
+                        help="manifest of the inputs of each output; only calibrate outputs that are out of date")
+    parser.add_argument('--cube', action="store", dest='cube',
+                        help="also write every spectrum to one memory-mapped file CUBE, with an index in CUBE.json")
+    parser.add_argument('--preflight', action="store", dest='preflight',
+                        help="only check the header of each input and write a JSON report to PREFLIGHT")
+    parser.add_argument('--timing', action="store", dest='timing',
+                        help="write a JSON report of the time of each stage of each file to TIMING")
+    parser.add_argument('--profile', action="store", dest='profile',
+                        help="run under cProfile and write the profile statistics to PROFILE")
+    parser.add_argument('--progress', action="store_true", dest='progress',
+                        help="draw a progress bar with the throughput and time left on stderr")
+    parser.add_argument('--status', action="store", dest='status',
+                        help="rewrite the status of the run to STATUS every 10 s: JSON, or Prometheus text if "
+                             "STATUS ends with .prom")
     parser.set_defaults(overwrite=True)
 
-    args = parser.parse_args()
-    if len(sys.argv) == 1:
+    args = parser.parse_args(argv)
+    if not (sys.argv[1:] if argv is None else argv):
         parser.print_help(sys.stderr)
         sys.exit(1)
     if args.ccamFile is not None:
@@ -419,11 +679,20 @@ if __name__ == "__main__":
     elif args.directory is not None:
         in_file_type = InputType.DIRECTORY
         in_file = args.directory
+    elif args.query is not None:
+        in_file_type = InputType.QUERY
+        in_file = args.query
     else:
         in_file_type = InputType.FILE_LIST
         in_file = args.list
 
     start_calibration = True
+    if in_file_type is InputType.QUERY and args.catalog is None:
+        print('a query (-q) needs a header catalog (--catalog).')
+        start_calibration = False
+    elif in_file_type is InputType.QUERY and not os.path.isfile(args.catalog):
+        print('header catalog: ' + args.catalog + ' does not exist. Please enter an existing catalog.')
+        start_calibration = False
 
     out_directory = args.out_dir
     if out_directory is not None:
@@ -433,9 +702,27 @@ if __name__ == "__main__":
                 print('output directory: ' + out_directory + ' does not exist. Please enter an existing directory.')
                 start_calibration = False
 
+    if start_calibration and args.preflight is not None:
+        # check the inputs instead of calibrating them
+        start_calibration = False
+        try:
+            inputs = list_inputs(in_file_type, in_file, is_psv_file, out_directory, args.catalog)
+        except FileNotFoundError:
+            print(in_file + " does not exist.")
+        else:
+            if inputs is not None:
+                write_report(args.preflight, preflight(inputs, False, jobs=args.jobs))
+
     if start_calibration:
         now = datetime.now()
         logfile = "badInput_{}.log".format(now.strftime("%Y%m%d.%H%M%S"))
 
-        radianceCal = RadianceCalibration(logfile)
-        radianceCal.calibrate_to_radiance(in_file_type, in_file, out_directory, args.overwrite)
+        radianceCal = RadianceCalibration(logfile, jobs=args.jobs, pipeline=args.pipeline,
+                                          manifest=args.manifest, cube=args.cube, catalog=args.catalog,
+                                          timing=args.timing, progress_bar=args.progress, status_file=args.status)
+        run_profiled(args.profile, radianceCal.calibrate_to_radiance, in_file_type, in_file, out_directory,
+                     args.overwrite)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,136 @@
 import numpy as np
 import os
 import argparse
+import contextlib
+import sqlite3
 import sys
 from datetime import datetime
 from ccam_prospect.utils.InputType import InputType
 from ccam_prospect.utils.CustomExceptions import InputFileNotFoundException, NonStandardHeaderException, \
     CancelExecutionException
-from ccam_prospect.utils.Utilities import get_integration_time, write_final, write_label
+from ccam_prospect.utils.Utilities import LABEL_KEYS, get_integration_time, integration_time, write_final, \
+    write_label, get_header_values, get_label_values
+from ccam_prospect.utils.Discovery import discover_files, walk_files, is_psv_or_rad_file, is_rad_file, \
+    read_file_list
+from ccam_prospect.utils.Parallel import run_in_pool
+from ccam_prospect.utils.Pipeline import CalibrationJob, Pipeline, run_stages
+from ccam_prospect.utils.Manifest import get_manifest
+from ccam_prospect.utils.CalibrationConstants import get_calibration_constants
+from ccam_prospect.utils.SharedConstants import SharedConstants, attach_constants
+from ccam_prospect.utils.SpectralCube import SpectralCube, make_cube_entry
+from ccam_prospect.utils.HeaderCatalog import HeaderCatalog
+from ccam_prospect.utils.Preflight import list_inputs, preflight, write_report
+from ccam_prospect.utils.RunLog import MISSING, INVALID_HEADER, NONSTANDARD_EXPOSURE, CUSTOM_MISMATCH, \
+    INVALID_QUERY, get_run_log, make_entry
+from ccam_prospect.utils.InputFiles import get_archive_index, open_input, input_exists, get_output_base, find_input, \
+    strip_compression
+from ccam_prospect.utils.ReferenceSpectra import REFERENCE_FILES, get_reference_files, get_reference, \
+    get_reference_for_time, get_convolution, get_reference_integration_time
+from ccam_prospect.utils.StageTimings import StageTimings, run_profiled
+from ccam_prospect.utils.Progress import FAILED, get_outcome, make_run_progress
+from ccam_prospect.utils.LabelWriter import LabelWriter
 from ccam_prospect.radianceCalibration import RadianceCalibration
 
 
 class RelativeReflectanceCalibration:
-    def __init__(self, log_file, main_app=None):
+    def __init__(self, log_file, main_app=None, jobs=1, pipeline=False, manifest=None, fused=False,
+                 write_rad=True, cube=None, catalog=None, timing=None, progress_bar=False, status_file=None):
         self.rad_file = ''
         self.wavelength = []
         self.main_app = main_app
         self.total_files = 1
-        self.current_file = 1
         self.logfile = log_file
+        self.run_log = get_run_log(log_file)  # buffered log of the inputs skipped, see RunLog
+        self.log_entries = None               # log entries kept to send back from a worker process
+        self.jobs = jobs                      # number of processes for a list or directory of files
+        self.pipeline = pipeline              # stream a list or directory through threaded stages
+        # manifest of the inputs of every output, to skip outputs that are up to date
+        self.manifest = get_manifest(manifest) if manifest else None
+        self.fused = fused                    # calibrate PSV files to radiance in memory, see fused_read_stage
+        self.write_rad = write_rad            # keep the RAD files made by the fused calibration
+        # one file with every spectrum calibrated in the run, see SpectralCube
+        self.cube = SpectralCube(cube, 'REF') if cube else None
+        self.cube_rows = None                 # spectra for the cube kept to send back from a worker process
+        self.catalog = catalog                # header catalog to choose files by query, see HeaderCatalog
+        self.timing = timing                  # JSON report of the time of each stage of each file, see StageTimings
+        self.timings = None                   # the time of each stage in the current run, if there is a timing report
+        self.progress_bar = progress_bar      # draw a progress bar on the terminal
+        self.status_file = status_file        # JSON or Prometheus file of the status of a run, see StatusFile
+        self.progress = None                  # the progress of the current run, if it is shown anywhere
+        self.outcomes = None                  # outcome of each file kept to send back from a worker process
+        self.label_writer = None              # writes the labels of a run in the background, see LabelWriter
         self.show_mismatched_warning = True   # show dialog for mismatched exposure time
         self.show_exposure_warning = True     # show dialog for nonstandard exposure time
         self.show_header_warning = True       # show dialog for nonstandard header
         self.show_list_warning = True         # show dialog for file in list doesn't exist
 
+    def write_log(self, file, stage, reason, message):
+        """write_log
+        track a skipped input in the run log.  In a worker process the
+        entry is kept and logged by the main process instead.
+
+        :param file: the input that was skipped
+        :param stage: the stage that skipped it, e.g. relative reflectance calibration
+        :param reason: the reason it was skipped, e.g. NONSTANDARD_EXPOSURE
+        :param message: the description of the problem
+        """
+        entry = make_entry(file, stage, reason, message)
+        if self.log_entries is not None:
+            self.log_entries.append(entry)
+        else:
+            self.run_log.add(entry)
+
+    def report_file(self, file, outcome):
+        """report_file
+        count a finished file in the progress of the run, if it is shown.  In a worker
+        process the outcome is kept and counted by the main process instead.
+
+        :param file: the input file
+        :param outcome: the outcome of the file, one of Progress.OUTCOMES
+        """
+        if self.outcomes is not None:
+            self.outcomes.append((file, outcome))
+        elif self.progress is not None:
+            self.progress.add(file, outcome)
+
+    def finish_job(self, job):
+        """finish_job
+        report a file once it is finished, see report_file
+
+        :param job: the CalibrationJob for the file
+        """
+        self.report_file(job.input_file, get_outcome(job))
+
+    def add_to_cube(self, job):
+        """add_to_cube
+        add the calibrated spectrum to the cube, if there is one.  In a worker process the
+        spectrum is kept and added by the main process instead.
+
+        :param job: the CalibrationJob for the file
+        """
+        if self.cube_rows is None and self.cube is None:
+            return
+        # the header values of the RAD file, unless the fused calibration already has them
+        headers = job.headers or get_header_values(job.rad_file)
+        entry = make_cube_entry(job.input_file, headers, job.original_label, job.label_values)
+        row = (entry, job.wavelength, job.values)
+        if self.cube_rows is not None:
+            self.cube_rows.append(row)
+        else:
+            self.cube.append(*row)
+
+    def time_stage(self, job, stage):
+        """time_stage
+        time one stage of the calibration of a file, if the run is timed
+
+        :param job: the CalibrationJob for the file
+        :param stage: the name of the stage, one of StageTimings.STAGES
+        :return: context manager to time the stage in
+        """
+        if self.timings is None:
+            return contextlib.nullcontext()
+        return self.timings.time(job.input_file, stage)
+
     def do_division(self, values):
         """
         Divide each value in the file by the calibration values
@@ -30,9 +138,28 @@ class RelativeReflectanceCalibration:
         :param values:
         :return: the divided values
         """
-        with open(self.rad_file) as f:
-            values_orig = [float(x.split()[1].strip()) for index, x in enumerate(f) if index > 28]
+        return self.divide_values(self.read_rad_values(self.rad_file), values)
+
+    @staticmethod
+    def read_rad_values(rad_file):
+        """
+        Read the radiance values from the table of a RAD file, skipping the header
+
+        :param rad_file: the RAD file
+        :return: the radiance values
+        """
+        with open_input(rad_file) as f:
+            return np.fromiter((float(x.split()[1]) for index, x in enumerate(f) if index > 28), dtype=float)
 
+    @staticmethod
+    def divide_values(values_orig, values):
+        """
+        Divide each radiance value by the calibration values
+
+        :param values_orig: the radiance values
+        :param values: the calibration values
+        :return: the divided values
+        """
         # divide original values by the appropriate calibration values
         # to get relative reflectance.  If divide by 0, just = 0
         with np.errstate(divide='ignore', invalid='ignore'):
@@ -50,10 +177,7 @@ class RelativeReflectanceCalibration:
         :param values:
         :return: multiplied values
         """
-        my_path = os.path.abspath(os.path.dirname(__file__))
-        sol76dir = os.path.join(my_path, "sol76")
-        convolve = os.path.join(sol76dir, 'Target11_60_95.txt.conv')
-        values_conv = [float(x.split()[1].strip()) for x in open(convolve).readlines()]
+        values_conv = get_convolution()
 
         # multiply original values by the appropriate calibration values
         # to get relative reflectance.
@@ -61,14 +185,79 @@ class RelativeReflectanceCalibration:
 
         return c
 
+    @classmethod
+    def get_reflectance(cls, radiance, values):
+        """
+        Calibrate radiance to relative reflectance: divide by the calibration values, multiply
+        by the lab bidirectional spectrum, and replace saturated channels that are too large
+        for PDS fixed-width with 0s.  Works on one spectrum or on a stack of spectra.
+
+        :param radiance: the radiance values, one spectrum per row
+        :param values: the calibration values
+        :return: the relative reflectance values
+        """
+        final_values = cls.do_multiplication(cls.divide_values(radiance, values))
+        return np.where(abs(final_values) > 10E20, 0, final_values)
+
+    def calibrate_batch(self, radiance, t_int, custom_target_file=None, files=None):
+        """
+        Calibrate a stack of radiance spectra to relative reflectance.  The spectra are grouped
+        by integration time and each group is calibrated against its reference in one call.
+        A spectrum with no reference for its integration time (not one of 7, 34, 404 or 5004 ms,
+        or not the time of the custom target file) is tracked in the run log, as calibrate_file
+        does, and its row is left as NaN.
+
+        :param radiance: N x 6144 array of radiance spectra
+        :param t_int: the integration time of each spectrum, in ms, rounded
+        :param custom_target_file: a custom file to use for calibration (default=None)
+        :param files: the file of each spectrum, for the run log (default: the row number)
+        :return: N x 6144 array of relative reflectance values
+        :return: boolean array, True for each spectrum that was calibrated
+        """
+        radiance = np.array(radiance, dtype=float, ndmin=2)
+        t_int = np.asarray(t_int).reshape(-1)
+        reflectance = np.full_like(radiance, np.nan)
+        calibrated = np.zeros(len(radiance), dtype=bool)
+        custom_t_int = get_reference_integration_time(custom_target_file) if custom_target_file else None
+
+        for group_t_int in np.unique(t_int):
+            rows = t_int == group_t_int
+            if custom_target_file and group_t_int != custom_t_int:
+                self.log_batch_rows(rows, files, CUSTOM_MISMATCH, 'custom target file integration time does not match.')
+                continue
+            reference = get_reference_for_time(int(group_t_int), custom_target_file)
+            if reference is None:
+                self.log_batch_rows(rows, files, NONSTANDARD_EXPOSURE,
+                                    'Exposure time is not one of 7, 34, 404, or 5004. Skipping this file.')
+                continue
+            self.wavelength = reference.wavelength
+            reflectance[rows] = self.get_reflectance(radiance[rows], reference.values)
+            calibrated[rows] = True
+        return reflectance, calibrated
+
+    def log_batch_rows(self, rows, files, reason, message):
+        """log_batch_rows
+        track the spectra of a batch that could not be calibrated in the run log
+
+        :param rows: boolean array, True for each spectrum to track
+        :param files: the file of each spectrum, or None to track the row number
+        :param reason: the reason they were skipped, e.g. NONSTANDARD_EXPOSURE
+        :param message: the description of the problem
+        """
+        for row in np.flatnonzero(rows):
+            file = files[row] if files is not None else 'row ' + str(row)
+            print('Warning: ' + file + ': ' + message + ' File tracked in log')
+            self.write_log(file, 'relative reflectance calibration', reason, message)
+
     @staticmethod
     def get_rad_filename(input_file):
         """get_rad_filename
-        create the filename of the corresponding rad file to this psv file
+        create the filename of the corresponding rad file to this psv file.  The RAD file of a
+        compressed file is not compressed, and that of a file inside an archive is next to the archive.
         :param: input_file: the input psv file
         """
         # replace PSV with RAD
-        (path, filename) = os.path.split(input_file)
+        (path, filename) = os.path.split(get_output_base(input_file))
         rad_filename = filename.replace('psv', 'rad')
         rad_filename = rad_filename.replace('PSV', 'RAD')
         rad_file = os.path.join(path, rad_filename)
@@ -93,7 +282,9 @@ class RelativeReflectanceCalibration:
         self.rad_file = self.get_rad_filename(input_file)
 
         if "rad" in self.rad_file.lower() and self.rad_file.lower().endswith(".tab"):
-            if self.rad_file == input_file:
+            if self.rad_file == get_output_base(input_file):
+                # the input is the rad file, perhaps compressed or inside an archive
+                self.rad_file = input_file
                 return True
             if os.path.isfile(self.rad_file) and not overwrite_rad:
                 # valid rad file already exists, just return
@@ -107,25 +298,30 @@ class RelativeReflectanceCalibration:
         else:
             (out_dir, filename) = os.path.split(input_file)
         radiance_cal = RadianceCalibration(self.logfile, self.main_app)
-        return radiance_cal.calibrate_to_radiance(InputType.FILE, input_file, out_dir, overwrite_rad)
-
-    def choose_values(self, custom_target_file=None):
+        radiance_cal.log_entries = self.log_entries
+        radiance_cal.total_files = self.total_files  # only a run of one file shows the progress of its stages
+        radiance_cal.manifest = self.manifest
+        radiance_cal.timings = self.timings
+        radiance_cal.label_writer = self.label_writer
+        return radiance_cal.calibrate_file(input_file, out_dir, overwrite_rad)
+
+    def choose_values(self, custom_target_file=None, t_int=None):
         """ choose_values
         Choose which values to use for calibration, based on integration time.  The integration
         time of the file chosen to calibrate must match that of the input file.  If the integration
         times do not match, log filename to error log file and keep going.
 
         :param custom_target_file: a custom file to use for calibration (default=None)
+        :param t_int: the integration time of the input, in seconds, if already known.
+                      Otherwise it is read from the header of the RAD file.
         :return: the values to use for calibration
         """
         if not custom_target_file:
             # built-in target files
-            my_path = os.path.abspath(os.path.dirname(__file__))
-            sol76dir = os.path.join(my_path, "sol76")
-            ms7 = os.path.join(sol76dir, 'CL0_404238481PSV_F0050104CCAM02076P1.TXT.RAD.cor.7ms.txt.cos')
-            ms34 = os.path.join(sol76dir, 'CL0_404238492PSV_F0050104CCAM02076P1.TXT.RAD.cor.34ms.txt.cos')
-            ms404 = os.path.join(sol76dir, 'CL9_404238503PSV_F0050104CCAM02076P1.TXT.RAD.cor.404ms.txt.cos')
-            ms5004 = os.path.join(sol76dir, 'CL9_404238538PSV_F0050104CCAM02076P1.TXT.RAD.cor.5004ms.txt.cos')
+            ms7 = REFERENCE_FILES[7]
+            ms34 = REFERENCE_FILES[34]
+            ms404 = REFERENCE_FILES[404]
+            ms5004 = REFERENCE_FILES[5004]
         else:
             # using a custom target file, set it to each integration time
             #    - will be checked for matching time later
@@ -137,12 +333,13 @@ class RelativeReflectanceCalibration:
         # now get the cosine-corrected values from the correct file
         # calculate integration time for the file that is being calibrated
         try:
-            t_int = get_integration_time(self.rad_file)
+            if t_int is None:
+                t_int = get_integration_time(self.rad_file)
         except NonStandardHeaderException:
             warning = self.rad_file + ': not a valid RAD file header. Skipping this file.'
             # write to log file
-            with open(self.logfile, 'a+') as log:
-                log.write(self.rad_file + ': relative reflectance calibration - ' + warning + '\n')
+            self.write_log(self.rad_file, 'relative reflectance calibration', INVALID_HEADER,
+                           'not a valid RAD file header. Skipping this file.')
             if self.show_header_warning:
                 print('error - ' + warning + ' File tracked in log')
                 # show warning
@@ -169,8 +366,8 @@ class RelativeReflectanceCalibration:
             warning = self.rad_file + ': Exposure time is not one of 7, 34, 404, or 5004. Skipping this file.'
             print('Warning: ' + warning + ' File tracked in log')
             # track in log file
-            with open(self.logfile, 'a+') as log:
-                log.write(self.rad_file + ': relative reflectance calibration - ' + warning + ' \n')
+            self.write_log(self.rad_file, 'relative reflectance calibration', NONSTANDARD_EXPOSURE,
+                           'Exposure time is not one of 7, 34, 404, or 5004. Skipping this file.')
             if self.show_exposure_warning:
                 # show warning
                 if self.main_app is not None:
@@ -185,16 +382,14 @@ class RelativeReflectanceCalibration:
             # if using a custom file, check that the custom exposure time and input exposure times match.
             # If they don't - throw an error, log in file, and
             if custom_target_file:
-                t_int_custom = get_integration_time(custom_target_file)
-                t_int_custom = round(t_int_custom * 1000)
+                t_int_custom = get_reference_integration_time(custom_target_file)
                 if t_int_custom != t_int:
                     warning = 'integration times between input file ' + self.rad_file + ' (' + str(t_int) + ')'\
                         ' and custom target file ' + str(custom_target_file) + ' (' + str(t_int_custom) + ') ' \
                         ' do not match. Skipping this file.'
                     # write to log file
-                    with open(self.logfile, 'a+') as log:
-                        log.write(self.rad_file + ': relative reflectance calibration - custom target file'
-                                                  ' integration time does not match.\n')
+                    self.write_log(self.rad_file, 'relative reflectance calibration', CUSTOM_MISMATCH,
+                                   'custom target file integration time does not match.')
                     print('****************************\n '
                           'WARNING: ' + warning + ' \n****************************\n ')
                     if self.show_mismatched_warning:
@@ -208,29 +403,26 @@ class RelativeReflectanceCalibration:
                     return None
 
             # valid file with correct integration time. -
-            # get the values, but skip the header
-            values = [float(x.split()[1].strip()) for x in open(fn).readlines() if '"' not in x]
-            # get the wavelengths
-            self.wavelength = [float(x.split()[0].strip()) for x in open(fn).readlines() if '"' not in x]
+            # get the values and the wavelengths, read once per process
+            reference = get_reference(fn)
+            values = reference.values
+            self.wavelength = reference.wavelength
 
         return values
 
-    def update_progress(self, value=None):
+    def update_progress(self, value):
         """update_progress
-        update progress on the main app
+        update progress on the main app, within the calibration of a single file.
+        The progress of a run of several files is counted by report_file.
         """
         if self.main_app is not None:
-            if value is not None:
-                self.main_app.update_progress(value)
-            else:
-                if self.total_files != 0:
-                    self.main_app.update_progress((self.current_file / self.total_files) * 100)
+            self.main_app.update_progress(value)
 
     def rad_to_ref(self, out_dir):
         """rad_to_ref
         rename rad file to ref.
         """
-        out_filename = self.rad_file.replace('RAD', 'REF')
+        out_filename = get_output_base(self.rad_file).replace('RAD', 'REF')
         out_filename = out_filename.replace('rad', 'ref')
         if out_dir is not None:
             # then save calibrated file to out dir also
@@ -242,14 +434,14 @@ class RelativeReflectanceCalibration:
     @staticmethod
     def get_original_label(filename):
         """get_original_label
-        the filename of the label for the input psv file.  should be a.lbl file """
-        original_label = filename.replace('.tab', '.lbl')
+        the filename of the label for the input psv file.  should be a.lbl file, which may be compressed """
+        original_label = strip_compression(filename).replace('.tab', '.lbl')
         original_label = original_label.replace('.txt', '.lbl')
         original_label = original_label.replace('.TAB', '.lbl')
         original_label = original_label.replace('.TXT', '.lbl')
         original_label = original_label.replace('rad', 'psv')
         original_label = original_label.replace('RAD', 'PSV')
-        return original_label
+        return find_input(original_label) or original_label
 
     def calibrate_file(self, filename, custom_file, out_dir, overwrite_rad, overwrite_ref):
         """calibrate_file
@@ -261,55 +453,229 @@ class RelativeReflectanceCalibration:
         :param overwrite_rad: boolean to overwrite radiance files
         :param overwrite_ref: boolean to overwrite relative reflectance files
         """
+        job = CalibrationJob(filename, out_dir, overwrite_ref, overwrite_rad=overwrite_rad, custom_file=custom_file)
+        run_stages(self.get_stages(), job)
+        self.finish_job(job)
+        return job.result
+
+    def get_stages(self):
+        """get_stages
+        the steps to calibrate a file, in order.  Each takes the CalibrationJob for the file
+        and returns it, or returns None once the file is finished.
+        """
+        return [self.read_stage, self.calibrate_stage, self.write_stage]
+
+    def read_stage(self, job):
+        """read_stage
+        get a valid rad file, choose the calibration values based on its
+        exposure time and read its radiance values
+
+        :param job: the CalibrationJob for the file
+        :return: the job, or None if the file is finished
+        """
+        if self.is_fused(job):
+            return self.fused_read_stage(job)
+
         # check for valid rad file
-        valid = self.get_rad_file(filename, out_dir, overwrite_rad)
-
-        if valid:
-            # valid rad file
-            print('calibrating' + filename)
-
-            out_filename = self.rad_to_ref(out_dir)
-            if not overwrite_ref:
-                # if we don't want to overwrite existing files, we can skip this file if it already exists
-                if os.path.exists(out_filename) and os.path.isfile(out_filename):
-                    print(out_filename + " already exists, skipping")
-                    return
-
-            # now choose values based on exp time
-            values = self.choose_values(custom_file)
-            if values is None:
-                return
-            if self.total_files == 1:
-                self.update_progress(25)
-            # then calibrate by dividing by values
-            new_values = self.do_division(values)
-            if self.total_files == 1:
-                self.update_progress(75)
-            # convolve
-            final_values = self.do_multiplication(new_values)
-            # replace saturated channels that are too large for PDS fixed-width with 0s
-            final_values = np.where(abs(final_values) > 10E20, 0, final_values)
-
-            # rename rad to ref to get outfile name and then write to file
-            write_final(out_filename, self.wavelength, final_values)
-
-            # check for original label
-            original_label = self.get_original_label(filename)
-            if os.path.exists(original_label):
-                # write new label based on original
-                (path, label_name) = os.path.split(original_label)
-                new_label_filename = label_name.replace('PSV', 'REF')
-                new_label_filename = new_label_filename.replace('psv', 'ref')
-                new_label_filename = new_label_filename.replace('lbl', 'xml')
-                (out_path, filename) = os.path.split(out_filename)
-                new_label = os.path.join(out_path, new_label_filename)
-                write_label(new_label, original_label, False)
-
-            if self.total_files == 1:
-                self.update_progress(100)
-
-            print(filename + ' calibrated and written to ' + out_filename)
+        valid = self.get_rad_file(job.input_file, job.out_dir, job.overwrite_rad)
+        if not valid:
+            return None
+
+        # valid rad file
+        job.rad_file = self.rad_file
+        print('calibrating' + job.input_file)
+
+        # the RAD file is checked rather than the input, so a PSV input and its RAD file give the same record
+        if self.is_done(job, job.rad_file):
+            return None
+
+        # now choose values based on exp time
+        with self.time_stage(job, 'header'):
+            job.reference_values = self.choose_values(job.custom_file)
+        if job.reference_values is None:
+            return None
+        job.wavelength = self.wavelength
+        self.read_original_label(job)
+        if self.total_files == 1:
+            self.update_progress(25)
+
+        with self.time_stage(job, 'read'):
+            job.values = self.read_rad_values(job.rad_file)
+        return job
+
+    def is_done(self, job, record_file, gain_file=None):
+        """is_done
+        check if the REF file can be skipped, because it already exists and is not to be
+        overwritten, or because the manifest shows it is up to date
+
+        :param job: the CalibrationJob for the file
+        :param record_file: the file the REF file is calibrated from, for the manifest
+        :param gain_file: the gain file, if the REF file is calibrated straight from a PSV file
+        :return: True if the file is finished
+        """
+        job.out_filename = self.rad_to_ref(job.out_dir)
+        if not job.overwrite:
+            # if we don't want to overwrite existing files, we can skip this file if it already exists
+            if os.path.exists(job.out_filename) and os.path.isfile(job.out_filename):
+                print(job.out_filename + " already exists, skipping")
+                job.skipped = True
+                return True
+
+        if self.manifest is not None:
+            # skip outputs already written from the same input and constants
+            job.record = self.manifest.make_record(record_file, self.get_original_label(job.input_file),
+                                                   gain_file, get_reference_files(job.custom_file))
+            if self.manifest.is_current(job.out_filename, job.record):
+                print(job.out_filename + " is up to date, skipping")
+                job.skipped = True
+                return True
+        return False
+
+    def is_fused(self, job):
+        """is_fused
+        check if the input is a PSV file to calibrate with the fused calibration.  Inputs that
+        are RAD files, or that have a RAD file that is not to be overwritten, use the RAD file.
+
+        :param job: the CalibrationJob for the file
+        :return: True if the file is calibrated by fused_read_stage
+        """
+        if not self.fused:
+            return False
+        rad_file = self.get_rad_filename(job.input_file)
+        if is_rad_file(rad_file):
+            if rad_file == get_output_base(job.input_file):
+                return False
+            if os.path.isfile(rad_file) and not job.overwrite_rad:
+                return False
+        return True
+
+    def fused_read_stage(self, job):
+        """fused_read_stage
+        calibrate a PSV file to radiance in memory and pass the radiance values and
+        header values straight on, rather than writing the RAD file and reading it back.
+        The RAD file is only written if self.write_rad.  The radiance values are rounded
+        to the precision of a RAD table, so the REF file is the same either way.  A file
+        whose REF file is skipped is not read at all.
+
+        :param job: the CalibrationJob for the file
+        :return: the job, or None if the file is finished
+        """
+        rad_filename = self.get_rad_filename(job.input_file)
+        if job.out_dir is not None:
+            (path, filename) = os.path.split(rad_filename)
+            rad_filename = os.path.join(job.out_dir, filename)
+        self.rad_file = job.rad_file = rad_filename
+
+        # an input that does not exist is logged by the radiance calibration
+        gain_file = get_calibration_constants().gain_file
+        if input_exists(job.input_file) and self.is_done(job, job.input_file, gain_file):
+            return None
 
+        radiance_cal = RadianceCalibration(self.logfile, self.main_app)
+        radiance_cal.log_entries = self.log_entries
+        radiance_cal.total_files = self.total_files
+        radiance_cal.timings = self.timings
+        radiance_cal.label_writer = self.label_writer
+        rad_job = CalibrationJob(job.input_file, job.out_dir)
+        if radiance_cal.read_stage(rad_job) is None:
+            return None
+        radiance_cal.calibrate_stage(rad_job)
+        if self.write_rad:
+            if self.manifest is not None:
+                radiance_cal.manifest = self.manifest
+                rad_job.record = self.manifest.make_record(job.input_file, rad_job.original_label, gain_file)
+            radiance_cal.write_stage(rad_job)
+        print('calibrating' + job.input_file)
+
+        # choose values based on the exposure time in the PSV header
+        (distance, ipbc, ict) = rad_job.calibration_headers
+        job.reference_values = self.choose_values(job.custom_file, integration_time(ipbc, ict))
+        if job.reference_values is None:
+            return None
+        job.wavelength = self.wavelength
+        self.read_original_label(job, rad_job)
+        if self.total_files == 1:
+            self.update_progress(25)
+
+        job.headers = rad_job.headers
+        job.values = np.round(rad_job.values, 6)
+        return job
+
+    def read_original_label(self, job, rad_job=None):
+        """read_original_label
+        find the original label of the input and read its values once, for the new label
+        and the cube.  The fused calibration has already read it for the RAD label.
+
+        :param job: the CalibrationJob for the file
+        :param rad_job: the CalibrationJob of the fused radiance calibration of the file, if any
+        """
+        job.original_label = self.get_original_label(job.input_file)
+        if rad_job is not None and rad_job.original_label == job.original_label:
+            job.label_values = rad_job.label_values
+        elif input_exists(job.original_label):
+            with self.time_stage(job, 'read_label'):
+                job.label_values = get_label_values(job.original_label, LABEL_KEYS)
+
+    def calibrate_stage(self, job):
+        """calibrate_stage
+        divide by the calibration values and multiply by the lab bidirectional spectrum
+
+        :param job: the CalibrationJob for the file
+        :return: the job
+        """
+        with self.time_stage(job, 'reflectance'):
+            job.values = self.get_reflectance(job.values, job.reference_values)
+        if self.total_files == 1:
+            self.update_progress(75)
+        return job
+
+    def write_stage(self, job):
+        """write_stage
+        write the REF file, and a new label if the original label exists
+
+        :param job: the CalibrationJob for the file
+        :return: the job
+        """
+        # rename rad to ref to get outfile name and then write to file
+        with self.time_stage(job, 'write_table'):
+            write_final(job.out_filename, job.wavelength, job.values)
+
+        # check for original label
+        if job.label_values is not None:
+            # write new label based on original
+            (path, label_name) = os.path.split(strip_compression(job.original_label))
+            new_label_filename = label_name.replace('PSV', 'REF')
+            new_label_filename = new_label_filename.replace('psv', 'ref')
+            new_label_filename = new_label_filename.replace('lbl', 'xml')
+            (out_path, filename) = os.path.split(job.out_filename)
+            new_label = os.path.join(out_path, new_label_filename)
+            if self.label_writer is not None:
+                self.label_writer.submit(self.write_new_label, job, new_label)
+            else:
+                self.write_new_label(job, new_label)
+        if self.manifest is not None:
+            self.manifest.record(job.out_filename, job.record)
+        self.add_to_cube(job)
+
+        if self.total_files == 1:
+            self.update_progress(100)
+
+        print(job.input_file + ' calibrated and written to ' + job.out_filename)
+        job.result = True
+        return job
+
+    def write_new_label(self, job, new_label):
+        """write_new_label
+        write the PDS4 label of a REF file and record it in the manifest.  This runs in
+        the thread of the label writer, if there is one.
+
+        :param job: the CalibrationJob for the file
+        :param new_label: the label to write
+        """
+        with self.time_stage(job, 'write_label'):
+            write_label(new_label, job.original_label, False, job.label_values)
+        if self.manifest is not None:
+            self.manifest.record(new_label, job.record)
 
     def calibrate_directory(self, directory, custom_file, out_dir, overwrite_rad, overwrite_ref):
         """calibrate_directory
@@ -321,28 +687,24 @@ class RelativeReflectanceCalibration:
         :param overwrite_rad: boolean to overwrite radiance files
         :param overwrite_ref: boolean to overwrite relative reflectance files
         """
-        self.total_files = sum([len(files) for r, d, files in os.walk(directory)])
-        self.current_file = 1
         try:
-            for file_name in os.listdir(directory):
-                # check each file in directory (file or subdirectory?)
-                full_path = os.path.join(directory, file_name)
-                if os.path.isdir(full_path) and full_path is not out_dir:
-                    # recursive call for each subdirectory
-                    self.calibrate_directory(os.path.join(directory, file_name), custom_file, out_dir,
-                                             overwrite_rad, overwrite_ref)
-                else:
-                    # calibrate each file individually
-                    self.calibrate_file(full_path, custom_file, out_dir, overwrite_rad, overwrite_ref)
-                    self.current_file += 1
-                    self.update_progress()
+            if self.pipeline:
+                # stream the PSV or RAD files straight from the walk of the tree
+                files = walk_files(directory, is_psv_or_rad_file, out_dir)
+            else:
+                # walk the tree once to find every PSV or RAD file to calibrate
+                files = discover_files(directory, is_psv_or_rad_file, out_dir)
         except FileNotFoundError:
             print(directory + ": directory does not exist.")
-            with open(self.logfile, 'a+') as log:
-                log.write(directory + ': relative reflectance input - directory does not exist \n')
+            self.write_log(directory, 'relative reflectance input', MISSING, 'directory does not exist')
             if self.main_app is not None:
                 raise InputFileNotFoundException(directory)
-        self.update_progress(100)
+            self.update_progress(100)
+            return
+        if self.pipeline:
+            self.calibrate_pipeline(files, custom_file, out_dir, overwrite_rad, overwrite_ref)
+        else:
+            self.calibrate_files(files, custom_file, out_dir, overwrite_rad, overwrite_ref)
 
     def calibrate_list(self, list_file, custom_file, out_dir, overwrite_rad, overwrite_ref):
         """calibrate_list
@@ -355,23 +717,93 @@ class RelativeReflectanceCalibration:
         :param overwrite_ref: boolean to overwrite relative reflectance files
         """
         try:
-            # read each line into a list of files
-            files = open(list_file).read().splitlines()
+            list_handle = open(list_file)
         except FileNotFoundError:
-            with open(self.logfile, 'a+') as log:
-                log.write(list_file + ':   relative reflectance input: file does not exist \n')
+            self.write_log(list_file, 'relative reflectance input', MISSING, 'file does not exist')
             if self.main_app is not None:
                 raise InputFileNotFoundException(list_file)
             return
+        with list_handle:
+            if self.pipeline:
+                # stream each line of the list through the pipeline
+                files = read_file_list(list_handle)
+                self.calibrate_pipeline(files, custom_file, out_dir, overwrite_rad, overwrite_ref)
+            else:
+                # read each line into a list of files
+                files = list(read_file_list(list_handle))
+                self.calibrate_files(files, custom_file, out_dir, overwrite_rad, overwrite_ref)
+
+    def calibrate_query(self, query, custom_file, out_dir, overwrite_rad, overwrite_ref):
+        """calibrate_query
+        calibrate the PSV and RAD files in the header catalog that match this query
+
+        :param query: the condition on the catalog columns, e.g. "sol between 1000 and 1100 and t_int = 34"
+        :param custom_file: custom calibration file
+        :param out_dir: the destination directory for output
+        :param overwrite_rad: boolean to overwrite radiance files
+        :param overwrite_ref: boolean to overwrite relative reflectance files
+        """
+        catalog = HeaderCatalog(self.catalog, create=False)
+        try:
+            files = catalog.select(query, is_psv_or_rad_file)
+        except sqlite3.Error as e:
+            print(query + ': not a valid catalog query - ' + str(e))
+            self.write_log(query, 'relative reflectance input', INVALID_QUERY, 'not a valid catalog query')
+            return
+        finally:
+            catalog.close()
+        if self.pipeline:
+            self.calibrate_pipeline(files, custom_file, out_dir, overwrite_rad, overwrite_ref)
+        else:
+            self.calibrate_files(files, custom_file, out_dir, overwrite_rad, overwrite_ref)
+
+    def calibrate_files(self, files, custom_file, out_dir, overwrite_rad, overwrite_ref):
+        """calibrate_files
+        calibrate each file, one after another or on a pool of self.jobs processes.
+        The log lines for each file are written in the same order as the files.
+
+        :param files: the list of psv or rad files to calibrate
+        :param custom_file: custom calibration file
+        :param out_dir: the destination directory for output
+        :param overwrite_rad: boolean to overwrite radiance files
+        :param overwrite_ref: boolean to overwrite relative reflectance files
+        """
         self.total_files = len(files)
-        self.current_file = 1
+        if self.progress is not None:
+            self.progress.set_total(len(files))
+        if self.jobs > 1:
+            manifest_path = self.manifest.path if self.manifest is not None else None
+            tasks = [(self.logfile, manifest_path, self.fused, self.write_rad, self.cube is not None,
+                      self.timings is not None, file_name, custom_file, out_dir, overwrite_rad, overwrite_ref)
+                     for file_name in files]
+            # load the gain and reference files once, for every worker to share
+            shared = SharedConstants(get_reference_files(custom_file))
+            # list each compressed tar archive once, rather than once in each worker
+            archives = get_archive_index(files)
+            try:
+                for (log_entries, manifest_changes, cube_rows, timing_records, outcomes) in run_in_pool(
+                        calibrate_file_worker, tasks, self.jobs, attach_constants, (shared.descriptor,),
+                        archives):
+                    for entry in log_entries:
+                        self.run_log.add(entry)
+                    if timing_records:
+                        self.timings.extend(timing_records)
+                    if manifest_changes:
+                        self.manifest.update(manifest_changes)
+                    for row in cube_rows or []:
+                        self.cube.append(*row)
+                    for (file, outcome) in outcomes:
+                        self.report_file(file, outcome)
+            finally:
+                shared.close()
+            return
+
         for file_name in files:
             try:
                 # calibrate each file in the list
                 self.calibrate_file(file_name, custom_file, out_dir, overwrite_rad, overwrite_ref)
-                self.current_file += 1
-                self.update_progress()
             except InputFileNotFoundException:
+                self.report_file(file_name, FAILED)
                 warning = file_name + ": file not found. Skipping this file."
                 if self.show_list_warning:
                     if self.main_app is not None:
@@ -379,44 +811,144 @@ class RelativeReflectanceCalibration:
                 if self.show_list_warning is None:
                     # cancel
                     raise CancelExecutionException
-        self.update_progress(100)
+
+    def calibrate_pipeline(self, files, custom_file, out_dir, overwrite_rad, overwrite_ref):
+        """calibrate_pipeline
+        calibrate each file with the read, calibrate and write stages running in their own
+        threads, connected by bounded queues, so reading, calibrating and writing overlap.
+
+        :param files: iterable of the psv or rad files to calibrate, read as the pipeline needs them
+        :param custom_file: custom calibration file
+        :param out_dir: the destination directory for output
+        :param overwrite_rad: boolean to overwrite radiance files
+        :param overwrite_ref: boolean to overwrite relative reflectance files
+        """
+        jobs = (CalibrationJob(file_name, out_dir, overwrite_ref, overwrite_rad=overwrite_rad, custom_file=custom_file)
+                for file_name in files)
+        Pipeline(self.get_stages(), on_finished=self.finish_job).run(jobs)
 
     def calibrate_relative_reflectance(self, file_type, file_name, custom_file, out_dir, overwrite_rad, overwrite_ref):
         """calibrate_relative_reflectance
         start the calibration for file, list of files, or directory.
 
-        :param file_type: the type of input: list, file, or directory.
-        :param file_name: the input file
+        :param file_type: the type of input: list, file, directory, or query of the header catalog.
+        :param file_name: the input file, or the query
         :param custom_file: if there is a custom file relative reflectance
         :param out_dir: the output directory
         :param overwrite_rad: boolean to overwrite radiance files
         :param overwrite_ref: boolean to overwrite relative reflectance files
         :return:
         """
-        if file_type.value is InputType.FILE.value:
-            self.calibrate_file(file_name, custom_file, out_dir, overwrite_rad, overwrite_ref)
-        elif file_type.value is InputType.FILE_LIST.value:
-            self.calibrate_list(file_name, custom_file, out_dir, overwrite_rad, overwrite_ref)
-        else:
-            self.calibrate_directory(file_name, custom_file, out_dir, overwrite_rad, overwrite_ref)
-
-
-if __name__ == "__main__":
+        self.run_log.start_run()
+        self.timings = StageTimings() if self.timing else None
+        self.progress = make_run_progress('relative reflectance', self.main_app, self.progress_bar,
+                                          self.status_file)
+        # worker processes write their own labels, so there is only a label writer on one process
+        self.label_writer = LabelWriter() if self.jobs <= 1 else None
+        try:
+            if file_type.value is InputType.FILE.value:
+                if self.progress is not None:
+                    self.progress.set_total(1)
+                self.calibrate_file(file_name, custom_file, out_dir, overwrite_rad, overwrite_ref)
+            elif file_type.value is InputType.FILE_LIST.value:
+                self.calibrate_list(file_name, custom_file, out_dir, overwrite_rad, overwrite_ref)
+            elif file_type.value is InputType.QUERY.value:
+                self.calibrate_query(file_name, custom_file, out_dir, overwrite_rad, overwrite_ref)
+            else:
+                self.calibrate_directory(file_name, custom_file, out_dir, overwrite_rad, overwrite_ref)
+        finally:
+            try:
+                if self.label_writer is not None:
+                    self.label_writer.close()
+            finally:
+                self.label_writer = None
+                self.run_log.finish_run()
+                if self.manifest is not None:
+                    self.manifest.save()
+                if self.cube is not None:
+                    self.cube.close()
+                if self.timings is not None:
+                    self.timings.write_report(self.timing)
+                if self.progress is not None:
+                    self.progress.finish()
+
+
+def calibrate_file_worker(task):
+    """calibrate_file_worker
+    calibrate one file in a worker process
+
+    :param task: tuple of the log file, the manifest file, the fused and write_rad options,
+                 whether there is a cube, whether the run is timed, and the arguments to calibrate_file
+    :return: the log entries, the manifest changes, the spectra for the cube, the timing records
+             and the outcome for this file
+    """
+    (log_file, manifest, fused, write_rad, cube, timed, file_name, custom_file, out_dir, overwrite_rad,
+     overwrite_ref) = task
+    relative_cal = RelativeReflectanceCalibration(log_file, manifest=manifest, fused=fused, write_rad=write_rad)
+    relative_cal.log_entries = []
+    relative_cal.outcomes = []
+    if cube:
+        relative_cal.cube_rows = []
+    if timed:
+        relative_cal.timings = StageTimings()
+    relative_cal.calibrate_file(file_name, custom_file, out_dir, overwrite_rad, overwrite_ref)
+    manifest_changes = relative_cal.manifest.take_changes() if relative_cal.manifest is not None else None
+    timing_records = relative_cal.timings.records if timed else None
+    return relative_cal.log_entries, manifest_changes, relative_cal.cube_rows, timing_records, relative_cal.outcomes
+
+
+def main(argv=None, prog=None):
+    """main
+    the relative reflectance calibration from the command line
+
+    :param argv: the arguments, without the program name (default: sys.argv[1:])
+    :param prog: the program name shown in the help, e.g. ccam-prospect ref
+    """
     # create a command line parser
-    parser = argparse.ArgumentParser(description='Relative Reflectance Calibration')
+    parser = argparse.ArgumentParser(prog=prog, description='Relative Reflectance Calibration')
     parser.add_argument('-f', action="store", dest='ccamFile', help="CCAM psv or rad *.tab file")
     parser.add_argument('-d', action="store", dest='directory', help="Directory containing .tab files to calibrate")
     parser.add_argument('-l', action="store", dest='list', help="File with a list of .tab files to calibrate")
+    parser.add_argument('-q', action="store", dest='query',
+                        help="calibrate the files in the header catalog that match this query, e.g. "
+                             "\"sol between 1000 and 1100 and t_int=34\" (needs --catalog)")
+    parser.add_argument('--catalog', action="store", dest='catalog',
+                        help="header catalog made by headerCatalog.py, for -q")
     parser.add_argument('-c', action="store", dest='customFile', help="custom calibration file")
     parser.add_argument('-o', action="store", dest='out_dir', help="directory to store the output files")
     parser.add_argument('--no-overwrite-rad', action="store_false", dest='overwrite_rad',
                         help="do not overwrite existing RAD files")
     parser.add_argument('--no-overwrite-ref', action="store_false", dest='overwrite_ref',
                         help="do not overwrite existing REF files")
-    parser.set_defaults(overwrite_rad=True, overwrite_ref=True)
-
-    args = parser.parse_args()
-    if len(sys.argv) == 1:
+    run_mode = parser.add_mutually_exclusive_group()
+    run_mode.add_argument('-j', '--jobs', action="store", dest='jobs', type=int, default=1,
+                          help="number of processes to calibrate a list or directory of files")
+    run_mode.add_argument('--pipeline', action="store_true", dest='pipeline',
+                          help="overlap reading, calibrating and writing of a list or directory of files")
+    parser.add_argument('--manifest', action="store", dest='manifest',
+                        help="manifest of the inputs of each output; only calibrate outputs that are out of date")
+    parser.add_argument('--fused', action="store_true", dest='fused',
+                        help="calibrate PSV files to relative reflectance in memory, "
+                             "without reading back the RAD files")
+    parser.add_argument('--no-write-rad', action="store_false", dest='write_rad',
+                        help="do not keep the RAD files of PSV inputs (implies --fused)")
+    parser.add_argument('--cube', action="store", dest='cube',
+                        help="also write every REF spectrum to one memory-mapped file CUBE, with an index in CUBE.json")
+    parser.add_argument('--preflight', action="store", dest='preflight',
+                        help="only check the header of each input and write a JSON report to PREFLIGHT")
+    parser.add_argument('--timing', action="store", dest='timing',
+                        help="write a JSON report of the time of each stage of each file to TIMING")
+    parser.add_argument('--profile', action="store", dest='profile',
+                        help="run under cProfile and write the profile statistics to PROFILE")
+    parser.add_argument('--progress', action="store_true", dest='progress',
+                        help="draw a progress bar with the throughput and time left on stderr")
+    parser.add_argument('--status', action="store", dest='status',
+                        help="rewrite the status of the run to STATUS every 10 s: JSON, or Prometheus text if "
+                             "STATUS ends with .prom")
+    parser.set_defaults(overwrite_rad=True, overwrite_ref=True, write_rad=True)
+
+    args = parser.parse_args(argv)
+    if not (sys.argv[1:] if argv is None else argv):
         parser.print_help(sys.stderr)
         sys.exit(1)
     if args.ccamFile is not None:
@@ -425,11 +957,20 @@ if __name__ == "__main__":
     elif args.directory is not None:
         in_file_type = InputType.DIRECTORY
         file = args.directory
+    elif args.query is not None:
+        in_file_type = InputType.QUERY
+        file = args.query
     else:
         in_file_type = InputType.FILE_LIST
         file = args.list
 
     start_calibration = True
+    if in_file_type is InputType.QUERY and args.catalog is None:
+        print('a query (-q) needs a header catalog (--catalog).')
+        start_calibration = False
+    elif in_file_type is InputType.QUERY and not os.path.isfile(args.catalog):
+        print('header catalog: ' + args.catalog + ' does not exist. Please enter an existing catalog.')
+        start_calibration = False
 
     out_directory = args.out_dir
     if out_directory is not None:
@@ -439,6 +980,17 @@ if __name__ == "__main__":
                 print('output directory: ' + out_directory + ' does not exist. Please enter an existing directory.')
                 start_calibration = False
 
+    if start_calibration and args.preflight is not None:
+        # check the inputs instead of calibrating them
+        start_calibration = False
+        try:
+            inputs = list_inputs(in_file_type, file, is_psv_or_rad_file, out_directory, args.catalog)
+        except FileNotFoundError:
+            print(file + " does not exist.")
+        else:
+            if inputs is not None:
+                write_report(args.preflight, preflight(inputs, True, args.customFile, args.jobs))
+
     if start_calibration:
         ow_rad = args.overwrite_rad
         ow_ref = args.overwrite_ref
@@ -446,5 +998,14 @@ if __name__ == "__main__":
         now = datetime.now()
         logfile = "badInput_{}.log".format(now.strftime("%Y%m%d.%H%M%S"))
 
-        calibrate_ref = RelativeReflectanceCalibration(logfile)
-        calibrate_ref.calibrate_relative_reflectance(in_file_type, file, args.customFile, out_directory, ow_rad, ow_ref)
+        calibrate_ref = RelativeReflectanceCalibration(logfile, jobs=args.jobs, pipeline=args.pipeline,
+                                                       manifest=args.manifest, fused=args.fused or not args.write_rad,
+                                                       write_rad=args.write_rad, cube=args.cube,
+                                                       catalog=args.catalog, timing=args.timing,
+                                                       progress_bar=args.progress, status_file=args.status)
+        run_profiled(args.profile, calibrate_ref.calibrate_relative_reflectance, in_file_type, file, args.customFile,
+                     out_directory, ow_rad, ow_ref)
+
+
+if __name__ == "__main__":
+    main()
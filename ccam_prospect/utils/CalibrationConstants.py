@@ -0,0 +1,99 @@
+import os
+import numpy as np
+import ccam_prospect.utils.constant as constants
+
+my_path = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_GAIN_FILE = os.path.join(my_path, "../constants/gain_mars.edit")
+
+
+def get_bin_widths(wavelengths):
+    """get_bin_widths
+    the spectral bin width of each channel (w = next wavelength - this wavelength).
+    The last channel uses the width of the one before it.
+
+    :param: wavelengths the wavelength of each channel
+    :return: the bin widths
+    """
+    w = np.empty(len(wavelengths))
+    w[:-1] = np.diff(wavelengths)
+    w[-1] = w[-2]
+    return w
+
+
+class CalibrationConstants:
+    """CalibrationConstants
+    The wavelengths and gains from a gain file, along with the per-channel factor that
+    converts photons/DN to radiance in W/m^2/sr/um:
+
+        factor = gain / w * hc / (wl * 1E-9) * 1E7
+
+    so that radiance = DN * factor / t / A / SA
+    """
+    # the array attributes, see from_arrays
+    ARRAYS = ('wavelength', 'gain', 'bin_width', 'unit_factor', 'radiance_factor')
+
+    def __init__(self, gain_file=DEFAULT_GAIN_FILE):
+        self.gain_file = gain_file
+        with open(gain_file, 'r') as f:
+            table = np.array([row.split()[0:2] for row in f], dtype=float)
+        self.wavelength = table[:, 0]
+        self.gain = table[:, 1]
+        self.bin_width = get_bin_widths(self.wavelength)
+        self.unit_factor = constants.hc / (self.wavelength * 1E-9) * 1E7
+        self.radiance_factor = self.gain / self.bin_width * self.unit_factor
+
+    @classmethod
+    def from_arrays(cls, gain_file, arrays):
+        """from_arrays
+        calibration constants made from arrays that were already computed, e.g. in shared memory
+
+        :param: gain_file the gain file the arrays were computed from
+        :param: arrays dictionary of the arrays, by the name of each attribute in ARRAYS
+        :return: the calibration constants
+        """
+        calibration_constants = cls.__new__(cls)
+        calibration_constants.gain_file = gain_file
+        for name in cls.ARRAYS:
+            setattr(calibration_constants, name, arrays[name])
+        return calibration_constants
+
+
+# the calibration constants shared by every calibration in this process
+_calibration_constants = None
+
+
+def get_calibration_constants():
+    """get_calibration_constants
+    the calibration constants for this process, loaded from the default gain file the first time they are used
+
+    :return: the calibration constants
+    """
+    global _calibration_constants
+    if _calibration_constants is None:
+        _calibration_constants = CalibrationConstants()
+    return _calibration_constants
+
+
+def set_calibration_constants(gain_file=None):
+    """set_calibration_constants
+    replace the calibration constants for this process, e.g. to use an alternate gain file
+
+    :param: gain_file the gain file to load, or None to go back to the default gain file
+    :return: the new calibration constants
+    """
+    global _calibration_constants
+    if gain_file is None:
+        _calibration_constants = None
+        return get_calibration_constants()
+    _calibration_constants = CalibrationConstants(gain_file)
+    return _calibration_constants
+
+
+def use_calibration_constants(calibration_constants):
+    """use_calibration_constants
+    use calibration constants that were already loaded, e.g. attached from shared memory
+
+    :param: calibration_constants the calibration constants for this process
+    """
+    global _calibration_constants
+    _calibration_constants = calibration_constants
@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+from ccam_prospect.utils.CustomExceptions import CancelExecutionException
+
+# the kinds of event a worker posts to its queue
+PROGRESS = 'progress'  # the percent of the calibration done
+WARNING = 'warning'    # a warning to ask the user about, see show_warning_dialog
+DONE = 'done'          # the calibration finished, or stopped with an exception
+# the shortest time between two progress events (s), so a run of many small files does not
+# flood the queue.  The last progress of a run (100) is always posted.
+PROGRESS_INTERVAL = 0.1
+
+
+class CalibrationWorker:
+    """CalibrationWorker
+    Runs a calibration in a background thread, so the window stays responsive.  The worker
+    stands in for the main application of the calibrations: their progress and warnings
+    are posted as events to a queue, which the GUI polls on its own thread, see get_events.
+    A warning waits for the answer of the user, given with answer_warning.
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self.thread = None
+        self.cancelled = threading.Event()
+        self.last_progress = 0.0
+
+    def is_running(self):
+        """is_running
+        :return: True if a calibration is running
+        """
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, function, *args):
+        """start
+        run a calibration in the background.  A DONE event is posted when it returns, with
+        None, or with the exception it raised.
+
+        :param: function the calibration to run, e.g. calibrate_to_radiance
+        :param: args the arguments to the calibration
+        """
+        self.cancelled.clear()
+        self.last_progress = 0.0
+
+        def run():
+            error = None
+            try:
+                function(*args)
+            except Exception as e:
+                error = e
+            self.events.put((DONE, error))
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        """cancel
+        stop the calibration once the file being calibrated is done
+        """
+        self.cancelled.set()
+
+    def get_events(self):
+        """get_events
+        :return: list of the events posted since the last call, as (kind, value) tuples
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def update_progress(self, value):
+        """update_progress
+        post the progress of the calibration, at most once every PROGRESS_INTERVAL.  The
+        calibrations report their progress after each file, so a cancel takes effect here,
+        between two files.
+
+        :param: value the percent of the calibration done
+        """
+        if self.cancelled.is_set():
+            raise CancelExecutionException()
+        now = time.perf_counter()
+        if value >= 100 or now - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = now
+            self.events.put((PROGRESS, value))
+
+    def show_warning_dialog(self, warning):
+        """show_warning_dialog
+        post a warning to the GUI and wait for the user to answer it
+
+        :param: warning the warning
+        :return: True to keep showing this warning, False to stop showing it, or None to cancel
+        """
+        answer = queue.Queue(maxsize=1)
+        self.events.put((WARNING, (warning, answer)))
+        return answer.get()
+
+    @staticmethod
+    def answer_warning(value, answer):
+        """answer_warning
+        give the answer of the user to the worker waiting on a WARNING event
+
+        :param: value the value of the WARNING event
+        :param: answer the answer from the warning dialog
+        """
+        value[1].put(answer)
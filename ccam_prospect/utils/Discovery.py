@@ -0,0 +1,125 @@
+import os
+from ccam_prospect.utils.InputFiles import INPUT_ERRORS, is_archive, list_members, strip_compression
+
+
+def is_psv_file(filename):
+    """is_psv_file
+    a PSV file to calibrate has psv in the name and ends with .tab or .txt,
+    or .tab.gz, .txt.bz2 and so on if it is compressed
+
+    :param: filename the file name or path
+    :return: True if the file is a PSV file
+    """
+    lower = strip_compression(filename).lower()
+    return "psv" in lower and (lower.endswith(".tab") or lower.endswith(".txt"))
+
+
+def is_rad_file(filename):
+    """is_rad_file
+    a RAD file to calibrate has rad in the name and ends with .tab, or .tab.gz and so on if it is compressed
+
+    :param: filename the file name or path
+    :return: True if the file is a RAD file
+    """
+    lower = strip_compression(filename).lower()
+    return "rad" in lower and lower.endswith(".tab")
+
+
+def is_ref_file(filename):
+    """is_ref_file
+    a REF file written by the relative reflectance calibration has ref in the name and ends with .tab
+
+    :param: filename the file name or path
+    :return: True if the file is a REF file
+    """
+    lower = strip_compression(filename).lower()
+    return "ref" in lower and lower.endswith(".tab")
+
+
+def is_psv_or_rad_file(filename):
+    """is_psv_or_rad_file
+    input to the relative reflectance calibration can be either a PSV or a RAD file
+
+    :param: filename the file name or path
+    :return: True if the file is a PSV or RAD file
+    """
+    return is_psv_file(filename) or is_rad_file(filename)
+
+
+def walk_files(directory, is_candidate, exclude_dir=None):
+    """walk_files
+    walk the directory tree once with os.scandir, yielding each file that is a candidate
+    for calibration.  Entries are visited in name order, each subdirectory in its place,
+    so the order is the same from run to run.  The files inside tar and zip archives are
+    candidates too, in the order they are stored.  The top directory is opened right away,
+    so a missing directory raises FileNotFoundError here rather than part way through.
+
+    :param: directory the top directory to search
+    :param: is_candidate function of the full path, True if the file should be calibrated
+    :param: exclude_dir a directory not to search, e.g. the output directory
+    :return: generator of the full path of each candidate file
+    """
+    if exclude_dir is not None:
+        exclude_dir = os.path.abspath(exclude_dir)
+    return iterate_tree(sorted_entries(directory), is_candidate, exclude_dir)
+
+
+def sorted_entries(directory):
+    """sorted_entries
+    the entries of one directory, in name order
+    """
+    with os.scandir(directory) as it:
+        return sorted(it, key=lambda e: e.name)
+
+
+def iterate_tree(entries, is_candidate, exclude_dir):
+    """iterate_tree
+    yield each candidate file under the entries of the top directory, depth first
+    """
+    # stack of iterators over the entries of each open directory
+    stack = [iter(entries)]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+        elif entry.is_dir():
+            if exclude_dir is None or os.path.abspath(entry.path) != exclude_dir:
+                stack.append(iter(sorted_entries(entry.path)))
+        elif entry.is_file() and is_archive(entry.name):
+            try:
+                members = list_members(entry.path)
+            except INPUT_ERRORS:
+                print(entry.path + ': archive could not be read. skipping')
+                continue
+            for member in members:
+                if is_candidate(member):
+                    yield member
+        elif entry.is_file() and is_candidate(entry.path):
+            yield entry.path
+
+
+def discover_files(directory, is_candidate, exclude_dir=None):
+    """discover_files
+    find every candidate file in the directory tree, so the total is known before calibrating
+
+    :param: directory the top directory to search
+    :param: is_candidate function of the full path, True if the file should be calibrated
+    :param: exclude_dir a directory not to search, e.g. the output directory
+    :return: list of the full path of each candidate file
+    """
+    return list(walk_files(directory, is_candidate, exclude_dir))
+
+
+def read_file_list(list_handle):
+    """read_file_list
+    the files named in a list of files, one per line.  Line endings, LF or CRLF, are
+    stripped and blank lines are skipped.  The lines are read as they are needed, so a
+    long list can be streamed through the pipeline.
+
+    :param: list_handle the open list of files
+    :return: generator of each file in the list
+    """
+    for line in list_handle:
+        line = line.rstrip('\r\n')
+        if line.strip():
+            yield line
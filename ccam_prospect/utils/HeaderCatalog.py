@@ -0,0 +1,155 @@
+import os
+import sqlite3
+from ccam_prospect.utils.Utilities import get_header_values
+from ccam_prospect.utils.Discovery import walk_files, is_psv_or_rad_file, is_psv_file
+from ccam_prospect.utils.InputFiles import INPUT_ERRORS, input_stat, find_input, strip_compression
+from ccam_prospect.utils.SpectralCube import make_cube_entry
+
+# the columns of every catalog entry.  Each header field gets a column of its own as well.
+CATALOG_COLUMNS = [('path', 'TEXT PRIMARY KEY'), ('size', 'INTEGER'), ('mtime_ns', 'INTEGER'), ('kind', 'TEXT'),
+                   ('sol', 'INTEGER'), ('sclk', 'INTEGER'), ('t_int', 'INTEGER'), ('distance', 'REAL')]
+
+
+def get_label_file(filename):
+    """get_label_file
+    the original label of a PSV or RAD file, which may be compressed
+
+    :param: filename the PSV or RAD file
+    :return: the label, or None if there is none
+    """
+    (path, name) = os.path.split(strip_compression(filename))
+    for extension in ('.tab', '.txt', '.TAB', '.TXT'):
+        name = name.replace(extension, '.lbl')
+    name = name.replace('rad', 'psv').replace('RAD', 'PSV')
+    return find_input(os.path.join(path, name))
+
+
+def quote(name):
+    """quote
+    quote a header field to use it as a column name
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+class HeaderCatalog:
+    """HeaderCatalog
+    A SQLite catalog of the headers of the PSV and RAD files in an archive, so the files
+    to calibrate can be chosen by a query instead of by reading every file.  Each file has
+    its path, size, modification time, kind (PSV or RAD), sol, spacecraft clock, integration
+    time (ms, rounded) and distance to target, and a column for every header field.
+
+    Only the header of each file is read, up to the >>>>Begin line, and only for files
+    that are new or have changed since the last update.
+    """
+
+    def __init__(self, path, create=True):
+        """
+        :param: path the catalog file
+        :param: create True to create the catalog if it does not exist, False to raise FileNotFoundError,
+                e.g. to query it
+        """
+        if not create and not os.path.isfile(path):
+            raise FileNotFoundError(path + ': header catalog does not exist')
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS catalog ({})'.format(
+            ', '.join(name + ' ' + column_type for (name, column_type) in CATALOG_COLUMNS)))
+        for column in ('sol', 'sclk', 't_int'):
+            self.connection.execute('CREATE INDEX IF NOT EXISTS catalog_{0} ON catalog ({0})'.format(column))
+        self.columns = self.get_columns()
+
+    def get_columns(self):
+        """get_columns
+        :return: the lower-case names of the columns of the catalog
+        """
+        return {row[1].lower() for row in self.connection.execute('PRAGMA table_info(catalog)')}
+
+    def add_header_columns(self, headers):
+        """add_header_columns
+        add a column for each header field not yet in the catalog.  The columns have numeric
+        affinity, so numeric fields compare as numbers.  A field with the same name as one
+        of CATALOG_COLUMNS is only kept in that column.
+        """
+        for key in headers:
+            if key.lower() not in self.columns:
+                self.connection.execute('ALTER TABLE catalog ADD COLUMN ' + quote(key) + ' NUMERIC')
+                self.columns.add(key.lower())
+
+    def update(self, directory, exclude_dir=None):
+        """update
+        bring the catalog up to date with the PSV and RAD files in this directory tree:
+        read the headers of new and changed files, and remove files that no longer exist
+
+        :param: directory the top directory of the archive
+        :param: exclude_dir a directory not to search, e.g. the output directory
+        :return: the number of files read and the number of files removed
+        """
+        known = {}
+        prefix = os.path.join(os.path.abspath(directory), '')
+        for (path, size, mtime_ns) in self.connection.execute(
+                'SELECT path, size, mtime_ns FROM catalog WHERE substr(path, 1, ?) = ?', (len(prefix), prefix)):
+            known[path] = (size, mtime_ns)
+
+        read = 0
+        with self.connection:
+            for filename in walk_files(directory, is_psv_or_rad_file, exclude_dir):
+                path = os.path.abspath(filename)
+                try:
+                    stat = input_stat(filename)
+                    if known.pop(path, None) == stat:
+                        continue
+                    headers = get_header_values(filename)
+                    self.add_entry(path, stat, headers, get_label_file(filename))
+                except INPUT_ERRORS:
+                    print(filename + ': header could not be read. skipping')
+                    continue
+                read += 1
+            # whatever is left was not found again
+            self.connection.executemany('DELETE FROM catalog WHERE path = ?', [(path,) for path in known])
+        return read, len(known)
+
+    def add_entry(self, path, stat, headers, label_file):
+        """add_entry
+        add or replace the catalog entry of one file
+
+        :param: path the absolute path of the file
+        :param: stat the size and modification time of the file
+        :param: headers the header values of the file
+        :param: label_file the original label of the file, if any
+        """
+        entry = make_cube_entry(path, headers, label_file)
+        t_int = entry['integration_time']
+        values = {
+            'path': path,
+            'size': stat[0],
+            'mtime_ns': stat[1],
+            'kind': 'PSV' if is_psv_file(path) else 'RAD',
+            'sol': entry['sol'],
+            'sclk': entry['sclk'],
+            't_int': round(t_int * 1000) if t_int is not None else None,
+            'distance': entry['distance']
+        }
+        self.add_header_columns(headers)
+        fixed = {name for (name, column_type) in CATALOG_COLUMNS}
+        for (key, value) in headers.items():
+            if key.lower() not in fixed:
+                values[key] = value
+        self.connection.execute('INSERT OR REPLACE INTO catalog ({}) VALUES ({})'.format(
+            ', '.join(quote(key) for key in values), ', '.join('?' for _ in values)), list(values.values()))
+
+    def select(self, query, is_candidate=None):
+        """select
+        the files in the catalog that match a query, e.g. "sol between 1000 and 1100 and t_int = 34"
+
+        :param: query an SQL condition on the columns of the catalog
+        :param: is_candidate function of the path, True if the file should be selected, e.g. is_psv_file
+        :return: list of the paths of the matching files, in path order
+        """
+        rows = self.connection.execute('SELECT path FROM catalog WHERE ' + query + ' ORDER BY path')
+        return [path for (path,) in rows if is_candidate is None or is_candidate(path)]
+
+    def close(self):
+        """close
+        close the catalog file
+        """
+        self.connection.close()
@@ -0,0 +1,344 @@
+import bisect
+import bz2
+import collections
+import gzip
+import io
+import lzma
+import os
+import tarfile
+import threading
+import zipfile
+import zlib
+
+# functions to open each kind of compressed file, by suffix
+COMPRESSED_SUFFIXES = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+# suffixes of tar and zip archives, such as compressed PDS volumes
+ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.zip')
+# functions to decompress each kind of compressed tar archive, by suffix.  The decompressed stream is a plain tar.
+COMPRESSED_TAR_SUFFIXES = {'.tar.gz': gzip.open, '.tgz': gzip.open, '.tar.bz2': bz2.open, '.tbz2': bz2.open,
+                           '.tar.xz': lzma.open, '.txz': lzma.open}
+# the members of a compressed tar archive kept in memory once read or passed, so reading one
+# again, e.g. the label stored before its table, does not decompress the archive from the start
+MEMBER_CACHE_BYTES = 32 * 1024 * 1024  # the most bytes kept for one archive
+MEMBER_CACHE_LARGEST = 4 * 1024 * 1024  # larger members are not kept
+# errors raised when an input is damaged, e.g. a truncated compressed file, along with ValueError
+INPUT_ERRORS = (ValueError, EOFError, OSError, lzma.LZMAError, zlib.error, tarfile.TarError, zipfile.BadZipFile)
+
+# archives already opened in this process, by path.  A forked worker process opens its own,
+# rather than sharing the position in each file with the process it was forked from.
+_archives = {}
+_archives_lock = threading.Lock()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_archives.clear)
+# the members of compressed tar archives listed by another process, by the path of the archive, see use_archive_index
+_archive_index = {}
+
+
+def is_archive(filename):
+    """is_archive
+    a tar or zip archive has one of ARCHIVE_SUFFIXES
+
+    :param: filename the file name or path
+    :return: True if the file is an archive
+    """
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def get_compression(filename):
+    """get_compression
+    the compression suffix of a compressed file, e.g. .gz
+
+    :param: filename the file name or path
+    :return: the suffix, or None if the file is not compressed
+    """
+    suffix = os.path.splitext(filename)[1].lower()
+    return suffix if suffix in COMPRESSED_SUFFIXES else None
+
+
+def strip_compression(filename):
+    """strip_compression
+    the name of a compressed file without its compression suffix, e.g. x.tab for x.tab.gz
+
+    :param: filename the file name or path
+    :return: the name without the suffix
+    """
+    if get_compression(filename) is not None:
+        return os.path.splitext(filename)[0]
+    return filename
+
+
+def get_tar_compression(filename):
+    """get_tar_compression
+    the compression suffix of a compressed tar archive, e.g. .tar.gz
+
+    :param: filename the file name or path
+    :return: the suffix, or None if the file is not a compressed tar archive
+    """
+    lower = filename.lower()
+    for suffix in COMPRESSED_TAR_SUFFIXES:
+        if lower.endswith(suffix):
+            return suffix
+    return None
+
+
+class Archive:
+    """Archive
+    A tar or zip archive opened once, whose members are read in place, without
+    extracting them to disk.  A compressed tar archive can only be read forward: going
+    back to an earlier member decompresses it again from the start.  So its members are
+    read straight from the decompressed stream in the order they are stored, and the
+    small members passed on the way to the one asked for, such as the label stored
+    before its table, are kept in memory for when they are read, see MEMBER_CACHE_BYTES.
+    """
+
+    def __init__(self, path, members=None):
+        """
+        :param: path the archive file
+        :param: members the TarInfo of each member of a tar archive, if already listed, see get_archive_index
+        """
+        self.path = path
+        self.lock = threading.Lock()  # the members of an archive are read one at a time
+        self.zip = None
+        self.tar = None
+        self.stream = None
+        if path.lower().endswith('.zip'):
+            self.zip = zipfile.ZipFile(path)
+            self.members = {info.filename: info for info in self.zip.infolist() if not info.is_dir()}
+            return
+        compression = get_tar_compression(path)
+        if compression is None or members is None:
+            self.tar = tarfile.open(path, 'r:*')
+            if members is None:
+                members = self.tar.getmembers()
+        self.members = {info.name: info for info in members if info.isfile()}
+        if compression is not None:
+            if self.tar is not None:
+                self.tar.close()
+                self.tar = None
+            self.stream = COMPRESSED_TAR_SUFFIXES[compression](path, 'rb')
+            self.stored = sorted(self.members.values(), key=lambda info: info.offset_data)
+            self.offsets = [info.offset_data for info in self.stored]
+            self.position = 0  # the offset in the decompressed stream after the last member read
+            self.cache = collections.OrderedDict()
+            self.cache_bytes = 0
+            self.rewinds = 0   # the number of times the stream went back, decompressing from the start
+
+    def get_size(self, member):
+        """get_size
+        :param: member the name of the member
+        :return: the size of the member, uncompressed
+        """
+        info = self.members[member]
+        return info.file_size if self.zip is not None else info.size
+
+    def read(self, member):
+        """read
+        :param: member the name of the member
+        :return: the contents of the member
+        """
+        with self.lock:
+            if self.zip is not None:
+                return self.zip.read(self.members[member])
+            if self.stream is None:
+                with self.tar.extractfile(self.members[member]) as f:
+                    return f.read()
+            return self.read_stored(self.members[member])
+
+    def read_stored(self, info):
+        """read_stored
+        read a member of a compressed tar archive from the cache, or from the stream,
+        keeping the small members passed on the way.  The caller holds the lock.
+
+        :param: info the TarInfo of the member
+        :return: the contents of the member
+        """
+        if info.name in self.cache:
+            self.cache.move_to_end(info.name)
+            return self.cache[info.name]
+        if info.issparse():
+            # the data of a sparse member is not stored in one piece
+            with tarfile.open(self.path, 'r:*') as tar, tar.extractfile(info) as f:
+                return f.read()
+        if info.offset_data < self.position:
+            self.rewinds += 1
+            self.position = 0
+        for passed in self.stored[bisect.bisect_left(self.offsets, self.position):
+                                  bisect.bisect_left(self.offsets, info.offset_data)]:
+            if passed.size <= MEMBER_CACHE_LARGEST and not passed.issparse():
+                self.keep(passed.name, self.read_data(passed))
+        data = self.read_data(info)
+        self.keep(info.name, data)
+        return data
+
+    def read_data(self, info):
+        """read_data
+        read the data of a member from the decompressed stream, going forward if it is after the last member read
+        """
+        self.stream.seek(info.offset_data)
+        data = self.stream.read(info.size)
+        if len(data) != info.size:
+            raise EOFError(self.path + ': unexpected end of data in ' + info.name)
+        self.position = info.offset_data + info.size
+        return data
+
+    def keep(self, name, data):
+        """keep
+        keep a member in the cache, dropping the members used longest ago to stay within MEMBER_CACHE_BYTES
+        """
+        if len(data) > MEMBER_CACHE_LARGEST or name in self.cache:
+            return
+        self.cache[name] = data
+        self.cache_bytes += len(data)
+        while self.cache_bytes > MEMBER_CACHE_BYTES:
+            self.cache_bytes -= len(self.cache.popitem(last=False)[1])
+
+
+def get_archive(path):
+    """get_archive
+    the archive at this path, opened once per process
+
+    :param: path the archive file
+    :return: the Archive
+    """
+    with _archives_lock:
+        if path not in _archives:
+            _archives[path] = Archive(path, _archive_index.get(path))
+        return _archives[path]
+
+
+def get_archive_index(files):
+    """get_archive_index
+    the members of each compressed tar archive that holds some of the inputs, to give to
+    worker processes, so each does not decompress the whole archive again to list them
+
+    :param: files the inputs, some of which may be inside compressed tar archives
+    :return: dictionary of the TarInfo of each member, by the path of the archive
+    """
+    index = {}
+    for file in files:
+        (archive, member) = split_member(file)
+        if archive is not None and archive not in index and get_tar_compression(archive) is not None:
+            try:
+                index[archive] = list(get_archive(archive).members.values())
+            except INPUT_ERRORS:
+                # each worker reads the archive itself, and logs its members as unreadable
+                continue
+    return index
+
+
+def use_archive_index(index):
+    """use_archive_index
+    use the members of compressed tar archives listed by another process, e.g. in a worker process
+
+    :param: index the members of each archive, from get_archive_index
+    """
+    with _archives_lock:
+        _archive_index.update(index)
+
+
+def split_member(path):
+    """split_member
+    split the path of a file inside an archive, e.g. volume.tar.gz/data/x.tab, into the archive and the member
+
+    :param: path the path of the input
+    :return: the archive path and the member name, or (None, None) if the path is not inside an archive
+    """
+    if os.path.exists(path):
+        return None, None
+    head = path
+    parts = []
+    while True:
+        (head, tail) = os.path.split(head)
+        if not tail:
+            return None, None
+        parts.append(tail)
+        if is_archive(head) and os.path.isfile(head):
+            return head, '/'.join(reversed(parts))
+
+
+def list_members(archive_path):
+    """list_members
+    the path of each file inside an archive, as used by open_input, in the order they are stored
+
+    :param: archive_path the archive
+    :return: list of the paths
+    """
+    return [os.path.join(archive_path, member) for member in get_archive(archive_path).members]
+
+
+def input_exists(path):
+    """input_exists
+    check if an input exists, either as a file or inside an archive
+
+    :param: path the path of the input
+    :return: True if the input exists
+    """
+    if os.path.isfile(path):
+        return True
+    (archive, member) = split_member(path)
+    return archive is not None and member in get_archive(archive).members
+
+
+def input_stat(path):
+    """input_stat
+    the size and modification time of an input.  Inside an archive, this is the
+    size of the member and the modification time of the archive.
+
+    :param: path the path of the input
+    :return: the size and the modification time, in ns
+    """
+    (archive, member) = split_member(path)
+    if archive is None:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    return get_archive(archive).get_size(member), os.stat(archive).st_mtime_ns
+
+
+def open_input(path, mode='r'):
+    """open_input
+    open an input for reading, whether it is a plain file, a gzip, bz2 or xz compressed
+    file, or a file inside a tar or zip archive.  Compressed files are decompressed as
+    they are read.  A file inside an archive is read from the archive into memory.
+
+    :param: path the path of the input
+    :param: mode 'r' to read text or 'rb' to read bytes
+    :return: the open file
+    """
+    compression = get_compression(path)
+    if compression is not None and os.path.isfile(path):
+        return COMPRESSED_SUFFIXES[compression](path, 'rt' if mode == 'r' else mode)
+    (archive, member) = split_member(path)
+    if archive is None:
+        return open(path, mode)
+    data = io.BytesIO(get_archive(archive).read(member))
+    if compression is not None:
+        # a compressed file inside an archive
+        data = COMPRESSED_SUFFIXES[compression](data, 'rb')
+    return io.TextIOWrapper(data) if mode == 'r' else data
+
+
+def get_output_base(path):
+    """get_output_base
+    the path that output file names are based on: the input without its compression
+    suffix, and, for a file inside an archive, in the directory of the archive
+
+    :param: path the path of the input
+    :return: the plain path
+    """
+    (archive, member) = split_member(path)
+    if archive is not None:
+        path = os.path.join(os.path.dirname(archive), os.path.basename(member))
+    return strip_compression(path)
+
+
+def find_input(path):
+    """find_input
+    find an input that may be stored compressed, e.g. the label of a compressed PSV file
+
+    :param: path the path of the input, uncompressed
+    :return: the path of the input as it is stored, or None if it does not exist
+    """
+    for candidate in [path] + [path + suffix for suffix in COMPRESSED_SUFFIXES]:
+        if input_exists(candidate):
+            return candidate
+    return None
@@ -6,6 +6,7 @@ class InputType(Enum):
     FILE = auto()
     FILE_LIST = auto()
     DIRECTORY = auto()
+    QUERY = auto()
 
 
 input_type_switcher = {
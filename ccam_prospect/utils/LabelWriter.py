@@ -0,0 +1,57 @@
+import queue
+import threading
+from ccam_prospect.utils.Pipeline import END_OF_QUEUE
+
+
+class LabelWriter:
+    """LabelWriter
+    Writes the labels of a run in a background thread, so rendering and writing the label
+    of one file overlaps the reading and calibrating of the next.  At most max_pending
+    labels wait to be written, so memory stays bounded.  The first error raised while
+    writing a label is raised again by submit or close.
+    """
+
+    def __init__(self, max_pending=64):
+        """
+        :param: max_pending the maximum number of labels waiting to be written
+        """
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.errors = []
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def work(self):
+        """work
+        write each label from the queue.  After a failure, keep taking labels so submit is not blocked.
+        """
+        while True:
+            item = self.queue.get()
+            if item is END_OF_QUEUE:
+                break
+            if self.errors:
+                continue
+            (function, args) = item
+            try:
+                function(*args)
+            except BaseException as e:
+                self.errors.append(e)
+
+    def submit(self, function, *args):
+        """submit
+        write a label in the background
+
+        :param: function the function that writes the label
+        :param: args the arguments to the function
+        """
+        if self.errors:
+            raise self.errors[0]
+        self.queue.put((function, args))
+
+    def close(self):
+        """close
+        wait for every label to be written and stop the thread
+        """
+        self.queue.put(END_OF_QUEUE)
+        self.thread.join()
+        if self.errors:
+            raise self.errors[0]
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import threading
+from ccam_prospect import __version__
+from ccam_prospect.utils.InputFiles import open_input, input_exists, input_stat
+
+# digests of files that do not change during a run (gain and reference files), by path
+_digest_cache = {}
+
+
+def compute_digest(filename):
+    """compute_digest
+    the sha256 hex digest of the contents of a file
+
+    :param: filename the file to hash
+    :return: the hex digest
+    """
+    sha = hashlib.sha256()
+    with open_input(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def file_digest(filename):
+    """file_digest
+    the digest of a constants file, computed once per process
+
+    :param: filename the file to hash
+    :return: the hex digest
+    """
+    if filename not in _digest_cache:
+        _digest_cache[filename] = compute_digest(filename)
+    return _digest_cache[filename]
+
+
+def combined_digest(filenames):
+    """combined_digest
+    one digest covering several constants files, e.g. all the reference files
+
+    :param: filenames the files to hash
+    :return: the hex digest
+    """
+    sha = hashlib.sha256()
+    for filename in filenames:
+        sha.update(file_digest(filename).encode())
+    return sha.hexdigest()
+
+
+class Manifest:
+    """Manifest
+    Record, for every output written, the digests of the input file, its label, the gain
+    file, the reference files and the tool version.  An output only needs to be calibrated
+    again when one of those has changed since it was written.
+
+    The size and modification time of each input are kept with its digest, so an input
+    that has not been touched is not read again to check it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.inputs = {}
+        self.outputs = {}
+        self.changes = {'inputs': {}, 'outputs': {}}  # recorded since the last take_changes
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            self.inputs = manifest.get('inputs', {})
+            self.outputs = manifest.get('outputs', {})
+
+    def input_digest(self, filename):
+        """input_digest
+        the digest of an input file, hashing it only if it changed since it was last recorded
+
+        :param: filename the input file
+        :return: the hex digest
+        """
+        key = os.path.abspath(filename)
+        (size, mtime_ns) = input_stat(filename)
+        with self.lock:
+            known = self.inputs.get(key)
+        if known is not None and known['size'] == size and known['mtime_ns'] == mtime_ns:
+            return known['sha256']
+        digest = compute_digest(filename)
+        with self.lock:
+            self.inputs[key] = {'size': size, 'mtime_ns': mtime_ns, 'sha256': digest}
+            self.changes['inputs'][key] = self.inputs[key]
+        return digest
+
+    def make_record(self, input_file, label_file=None, gain_file=None, reference_files=None):
+        """make_record
+        the digests that an output made from these files depends on
+
+        :param: input_file the PSV or RAD input file
+        :param: label_file the original label of the input, if any
+        :param: gain_file the gain file used for the radiance calibration
+        :param: reference_files the reference files used for the relative reflectance calibration
+        :return: the record for the output
+        """
+        return {
+            'input': self.input_digest(input_file),
+            'label': self.input_digest(label_file) if label_file and input_exists(label_file) else None,
+            'gain': file_digest(gain_file) if gain_file else None,
+            'reference': combined_digest(reference_files) if reference_files else None,
+            'version': __version__
+        }
+
+    def is_current(self, output_file, record):
+        """is_current
+        check if the output exists and was written from exactly these inputs and constants
+
+        :param: output_file the output file
+        :param: record the record for the output from make_record
+        :return: True if the output does not need to be calibrated again
+        """
+        key = os.path.abspath(output_file)
+        with self.lock:
+            recorded = self.outputs.get(key)
+        return recorded == record and os.path.isfile(output_file)
+
+    def record(self, output_file, record):
+        """record
+        keep the record for an output that was just written
+
+        :param: output_file the output file
+        :param: record the record for the output from make_record
+        """
+        key = os.path.abspath(output_file)
+        with self.lock:
+            self.outputs[key] = record
+            self.changes['outputs'][key] = record
+
+    def take_changes(self):
+        """take_changes
+        the outputs recorded since the last call, to send from a worker process to the main process
+
+        :return: dictionary of the new input digests and output records
+        """
+        with self.lock:
+            changes = self.changes
+            self.changes = {'inputs': {}, 'outputs': {}}
+        return changes
+
+    def update(self, changes):
+        """update
+        add the records from a worker process
+
+        :param: changes the result of take_changes in the worker
+        """
+        with self.lock:
+            self.outputs.update(changes['outputs'])
+            self.inputs.update(changes['inputs'])
+
+    def save(self):
+        """save
+        write the manifest, replacing the previous one only once it is completely written
+        """
+        with self.lock:
+            manifest = {'version': __version__, 'inputs': self.inputs, 'outputs': self.outputs}
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+# manifests already loaded in this process, by path
+_manifests = {}
+
+
+def get_manifest(path):
+    """get_manifest
+    the manifest at this path, loaded once per process (e.g. once in each worker process)
+
+    :param: path the manifest file
+    :return: the manifest
+    """
+    if path not in _manifests:
+        _manifests[path] = Manifest(path)
+    return _manifests[path]
@@ -0,0 +1,206 @@
+import os
+import numpy as np
+from ccam_prospect.utils.Discovery import discover_files, is_rad_file, is_ref_file
+from ccam_prospect.utils.InputFiles import open_input
+from ccam_prospect.utils.CalibrationConstants import get_calibration_constants
+from ccam_prospect.utils.SpectralCube import get_index_filename, open_cube
+from ccam_prospect.utils.Parallel import run_in_pool
+
+# channel ranges of each spectrometer in a RAD or REF table, which is ordered by wavelength
+CHANNEL_RANGES = [('UV', 0, 2048), ('VIS', 2048, 4096), ('VNIR', 4096, 6144)]
+# the wavelengths of a table are written to 3 decimals, see Utilities.TABLE_ROW_FORMAT
+WAVELENGTH_TOLERANCE = 0.0005
+# the width of the wavelength column of a table.  A value too large for its column runs
+# into the wavelength, so the columns are split by position rather than by whitespace.
+WAVELENGTH_WIDTH = 10
+# the number of spectra compared at once, to bound the memory of a comparison of a large tree
+CHUNK_SIZE = 1024
+
+
+def is_output_file(filename):
+    """is_output_file
+    :param: filename the file name or path
+    :return: True if the file is a RAD or REF file
+    """
+    return is_rad_file(filename) or is_ref_file(filename)
+
+
+def is_table_row(line):
+    """is_table_row
+    :param: line a line of a RAD or REF file
+    :return: True if the line is a row of the table: a wavelength and a value
+    """
+    try:
+        float(line[:WAVELENGTH_WIDTH])
+        float(line[WAVELENGTH_WIDTH:])
+    except ValueError:
+        return False
+    return True
+
+
+def read_table(filename):
+    """read_table
+    read a RAD or REF file in one pass: the header lines copied from the PSV file, if any,
+    and the wavelength and value columns of the table
+
+    :param: filename the RAD or REF file
+    :return: the header lines, the wavelengths and the values
+    """
+    with open_input(filename) as f:
+        lines = f.read().splitlines()
+    start = 0
+    while start < len(lines) and not is_table_row(lines[start]):
+        start += 1
+    rows = lines[start:]
+    wavelength = np.fromiter((float(row[:WAVELENGTH_WIDTH]) for row in rows), dtype=float, count=len(rows))
+    values = np.fromiter((float(row[WAVELENGTH_WIDTH:]) for row in rows), dtype=float, count=len(rows))
+    return lines[:start], wavelength, values
+
+
+def load_outputs(path, jobs=1):
+    """load_outputs
+    load every spectrum of an output tree, or of a cube written with --cube
+
+    :param: path a directory of RAD and REF files, searched recursively, or a cube file
+    :param: jobs the number of processes to read the files of a directory
+    :return: dictionary of the header lines, wavelengths and values of each spectrum, by its name:
+             the path of the file in the directory, or the source file of a row of the cube
+    """
+    if os.path.isfile(path) and os.path.isfile(get_index_filename(path)):
+        (spectra, index) = open_cube(path)
+        wavelength = np.asarray(index['wavelength'], dtype=float) if index['wavelength'] else None
+        return {os.path.basename(entry['file']): ([], wavelength, spectra[entry['row']])
+                for entry in index['spectra']}
+
+    files = discover_files(path, is_output_file)
+    if jobs > 1:
+        tables = run_in_pool(read_table, files, jobs)
+    else:
+        tables = map(read_table, files)
+    return {os.path.relpath(filename, path): table for (filename, table) in zip(files, tables)}
+
+
+def get_deviations(golden, new):
+    """get_deviations
+    the absolute and relative deviation of each channel of a stack of spectra.  Channels
+    that are NaN in both are equal; a NaN in only one of them is an infinite deviation.
+
+    :param: golden N x C array of the golden values
+    :param: new N x C array of the new values
+    :return: the N x C absolute deviations and the N x C relative deviations
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        absolute = np.abs(new - golden)
+        both_nan = np.isnan(golden) & np.isnan(new)
+        absolute[both_nan] = 0
+        absolute[np.isnan(absolute)] = np.inf
+        relative = absolute / np.abs(golden)
+        relative[absolute == 0] = 0
+        relative[np.isnan(relative)] = np.inf
+    return absolute, relative
+
+
+def compare_outputs(golden, new, atol=1E-6, rtol=0.0):
+    """compare_outputs
+    compare the spectra with the same name in two sets of outputs from load_outputs.  A channel
+    differs if |new - golden| > atol + rtol * |golden|.  The spectra are compared in stacks, so
+    every check is one vectorized operation over many spectra.  The wavelengths of the new
+    outputs are also checked against those of the golden outputs and the wavelength grid of
+    the gain file, as written by write_final.  The worst wavelength of a file is the one in
+    the new output, or on the grid if the new output has no wavelengths, e.g. a cube.
+
+    :param: golden the golden outputs
+    :param: new the new outputs
+    :param: atol the absolute tolerance
+    :param: rtol the relative tolerance
+    :return: the report: the number of files compared and that differ, the files in only one
+             of the sets, the largest deviation of each channel range, and for each file its
+             largest deviations, the channels that differ and any other difference
+    """
+    names = sorted(set(golden) & set(new))
+    grid = np.round(get_calibration_constants().wavelength, 3)
+    n_channels = len(grid)
+    range_names = [name for (name, start, end) in CHANNEL_RANGES]
+    files = []
+    ranges = {name: {'max_abs': 0.0, 'max_rel': 0.0} for name in range_names}
+
+    for chunk_start in range(0, len(names), CHUNK_SIZE):
+        chunk = names[chunk_start:chunk_start + CHUNK_SIZE]
+        entries = []
+        stackable = []
+        wavelengths = []  # the wavelengths of each stackable spectrum, as written in the new output if it has them
+        for name in chunk:
+            (golden_header, golden_wl, golden_values) = golden[name]
+            (new_header, new_wl, new_values) = new[name]
+            entry = {'file': name, 'problems': []}
+            if len(golden_values) != n_channels or len(new_values) != n_channels:
+                entry['problems'].append('{} and {} channels, expected {}'.format(
+                    len(golden_values), len(new_values), n_channels))
+            else:
+                stackable.append(entry)
+                wavelengths.append(grid if new_wl is None else new_wl)
+                if new_wl is not None and golden_wl is not None \
+                        and np.any(np.abs(new_wl - golden_wl) > WAVELENGTH_TOLERANCE):
+                    entry['problems'].append('wavelengths differ from the golden file')
+                if new_wl is not None and np.any(np.abs(new_wl - grid) > WAVELENGTH_TOLERANCE):
+                    entry['problems'].append('wavelengths differ from the gain file grid')
+            if golden_header != new_header:
+                entry['problems'].append('header differs')
+            entries.append(entry)
+
+        if stackable:
+            golden_stack = np.stack([golden[entry['file']][2] for entry in stackable]).astype(float)
+            new_stack = np.stack([new[entry['file']][2] for entry in stackable]).astype(float)
+            (absolute, relative) = get_deviations(golden_stack, new_stack)
+            differs = absolute > atol + rtol * np.abs(golden_stack)
+            n_differ = differs.sum(axis=1)
+            for (name, start, end) in CHANNEL_RANGES:
+                range_abs = absolute[:, start:end].max(axis=1)
+                range_rel = relative[:, start:end].max(axis=1)
+                ranges[name]['max_abs'] = max(ranges[name]['max_abs'], float(range_abs.max()))
+                ranges[name]['max_rel'] = max(ranges[name]['max_rel'], float(range_rel.max()))
+                for (i, entry) in enumerate(stackable):
+                    entry[name] = {'max_abs': float(range_abs[i]), 'max_rel': float(range_rel[i])}
+            worst = absolute.argmax(axis=1)
+            for (i, entry) in enumerate(stackable):
+                entry['max_abs'] = float(absolute[i, worst[i]])
+                entry['max_rel'] = float(relative[i].max())
+                entry['worst_channel'] = int(worst[i])
+                entry['worst_wavelength'] = float(wavelengths[i][worst[i]])
+                entry['channels_differ'] = int(n_differ[i])
+                if n_differ[i]:
+                    entry['problems'].append('{} channels differ'.format(int(n_differ[i])))
+        files.extend(entries)
+
+    failed = [entry for entry in files if entry['problems']]
+    return {
+        'atol': atol,
+        'rtol': rtol,
+        'files_compared': len(files),
+        'files_differ': len(failed),
+        'only_in_golden': sorted(set(golden) - set(new)),
+        'only_in_new': sorted(set(new) - set(golden)),
+        'max_abs': max([entry.get('max_abs', 0.0) for entry in files] or [0.0]),
+        'max_rel': max([entry.get('max_rel', 0.0) for entry in files] or [0.0]),
+        'ranges': ranges,
+        'files': files
+    }
+
+
+def print_summary(report, worst=10):
+    """print_summary
+    print the result of a comparison and the files with the largest deviations
+
+    :param: report the report from compare_outputs
+    :param: worst the number of files to list
+    """
+    print('{} files compared, {} differ (atol {}, rtol {}); {} only in golden, {} only in new'.format(
+        report['files_compared'], report['files_differ'], report['atol'], report['rtol'],
+        len(report['only_in_golden']), len(report['only_in_new'])))
+    for (name, deviation) in report['ranges'].items():
+        print('  {:<5} max abs deviation {:.6g}, max rel deviation {:.6g}'.format(
+            name, deviation['max_abs'], deviation['max_rel']))
+    failed = sorted((entry for entry in report['files'] if entry['problems']),
+                    key=lambda entry: -entry.get('max_abs', np.inf))
+    for entry in failed[:worst]:
+        print('  {}: {}'.format(entry['file'], ', '.join(entry['problems'])))
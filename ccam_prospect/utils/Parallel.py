@@ -0,0 +1,48 @@
+from ccam_prospect.utils.InputFiles import use_archive_index
+
+
+def get_chunk_size(n_tasks, jobs):
+    """get_chunk_size
+    the number of tasks to send to a worker process at once.  Larger chunks cut the
+    inter-process overhead, smaller chunks keep the workers evenly loaded.
+
+    :param: n_tasks the total number of tasks
+    :param: jobs the number of worker processes
+    :return: the chunk size
+    """
+    return max(1, min(16, n_tasks // (jobs * 4)))
+
+
+def initialize_worker(archives, initializer, initargs):
+    """initialize_worker
+    initializer of each worker process of run_in_pool: use the members of the archives listed
+    by the main process, then run the given initializer
+    """
+    if archives:
+        use_archive_index(archives)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def run_in_pool(worker, tasks, jobs, initializer=None, initargs=(), archives=None):
+    """run_in_pool
+    run worker on each task in a pool of processes.  The results are
+    yielded in the same order as the tasks, no matter which process finishes first.
+
+    :param: worker a module-level function that takes one task
+    :param: tasks the list of tasks
+    :param: jobs the number of worker processes
+    :param: initializer a module-level function to run once in each worker process, e.g. attach_constants
+    :param: initargs the arguments to initializer
+    :param: archives the members of the compressed tar archives of the inputs of the tasks, see get_archive_index
+    :return: generator of the results, in task order
+    """
+    jobs = min(jobs, len(tasks))
+    if jobs < 1:
+        return
+    # imported here rather than at the top, so a run on one process does not pay for the import
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initialize_worker,
+                             initargs=(archives, initializer, initargs)) as executor:
+        for result in executor.map(worker, tasks, chunksize=get_chunk_size(len(tasks), jobs)):
+            yield result
@@ -0,0 +1,123 @@
+import queue
+import threading
+
+# marks the end of the items in a queue
+END_OF_QUEUE = object()
+
+
+class CalibrationJob:
+    """CalibrationJob
+    one input file as it moves through the read, calibrate and write stages
+    of a calibration.  result is set once the file is finished (written, skipped, or invalid),
+    and skipped is set if its output was already there.
+    """
+
+    def __init__(self, input_file, out_dir, overwrite=True, overwrite_rad=True, custom_file=None):
+        self.input_file = input_file
+        self.out_dir = out_dir
+        self.overwrite = overwrite
+        self.overwrite_rad = overwrite_rad
+        self.custom_file = custom_file
+        self.out_filename = None
+        self.original_label = None
+        self.label_values = None
+        self.rad_file = None
+        self.headers = {}
+        self.header_string = None
+        self.calibration_headers = None
+        self.reference_values = None
+        self.wavelength = None
+        self.values = None
+        self.record = None
+        self.result = None
+        self.skipped = False
+
+
+def run_stages(stages, job):
+    """run_stages
+    run each stage on the job, one after another, stopping at the first stage that drops it
+
+    :param: stages list of functions that take the job and return it, or None once it is finished
+    :param: job the job to run
+    :return: the result of the job
+    """
+    for stage in stages:
+        if stage(job) is None:
+            break
+    return job.result
+
+
+class Pipeline:
+    """Pipeline
+    run each stage in its own thread, connected by bounded queues, so that reading,
+    calibrating and writing of different files overlap.  Each queue holds at most
+    max_queue items, so memory stays bounded no matter how many items there are.
+    """
+
+    def __init__(self, stages, max_queue=8, on_finished=None):
+        """
+        :param: stages list of functions that take an item and return it to pass it on, or None to drop it
+        :param: max_queue the maximum number of items waiting between two stages
+        :param: on_finished function called with each item once it is dropped or through the last stage
+        """
+        self.stages = stages
+        self.max_queue = max_queue
+        self.on_finished = on_finished
+        self.errors = []
+
+    def feed(self, items, out_queue):
+        """feed
+        put each item on the first queue, stopping early if a stage failed
+        """
+        try:
+            for item in items:
+                if self.errors:
+                    break
+                out_queue.put(item)
+        except BaseException as e:
+            self.errors.append(e)
+        out_queue.put(END_OF_QUEUE)
+
+    def work(self, stage, in_queue, out_queue):
+        """work
+        run the stage on each item from in_queue and pass the result on to out_queue.
+        After a failure, keep taking items so the stages before this one are not blocked.
+        """
+        while True:
+            item = in_queue.get()
+            if item is END_OF_QUEUE:
+                break
+            if self.errors:
+                continue
+            try:
+                result = stage(item)
+                if self.on_finished is not None and (result is None or out_queue is None):
+                    self.on_finished(item)
+            except BaseException as e:
+                self.errors.append(e)
+                continue
+            if result is not None and out_queue is not None:
+                out_queue.put(result)
+        if out_queue is not None:
+            out_queue.put(END_OF_QUEUE)
+
+    def run(self, items):
+        """run
+        run every item through the stages.  items may be a generator, e.g. the
+        discovery of files in a directory, and is read in its own thread.
+
+        :param: items iterable of the items to process
+        """
+        self.errors = []
+        queues = [queue.Queue(maxsize=self.max_queue) for _ in self.stages]
+        threads = [threading.Thread(target=self.feed, args=(items, queues[0]))]
+        for i, stage in enumerate(self.stages):
+            out_queue = queues[i + 1] if i + 1 < len(queues) else None
+            threads.append(threading.Thread(target=self.work, args=(stage, queues[i], out_queue)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
@@ -0,0 +1,134 @@
+import json
+import os
+import sqlite3
+from ccam_prospect.utils.InputType import InputType
+from ccam_prospect.utils.CustomExceptions import NonStandardHeaderException
+from ccam_prospect.utils.Utilities import get_header_values, integration_time_from_headers
+from ccam_prospect.utils.Discovery import discover_files, is_psv_file, is_psv_or_rad_file, read_file_list
+from ccam_prospect.utils.InputFiles import INPUT_ERRORS, get_archive_index, input_exists
+from ccam_prospect.utils.HeaderCatalog import HeaderCatalog
+from ccam_prospect.utils.ReferenceSpectra import REFERENCE_FILES, get_reference_integration_time
+from ccam_prospect.utils.Parallel import run_in_pool
+from ccam_prospect.utils.RunLog import MISSING, UNREADABLE, INVALID_HEADER, NONSTANDARD_EXPOSURE, CUSTOM_MISMATCH
+
+# the status of each input in a preflight report, from the first problem found: OK, NOT_AN_INPUT
+# or the reason the calibration would skip it, as in the run log
+OK = 'ok'
+NOT_AN_INPUT = 'not_an_input'  # the file name is not that of a PSV (or RAD) file
+
+
+def list_inputs(file_type, file_name, is_candidate, exclude_dir=None, catalog=None):
+    """list_inputs
+    every input of a calibration, without calibrating them
+
+    :param: file_type the type of input: file, list of files, directory, or query of the header catalog
+    :param: file_name the input file, list of files or directory, or the query
+    :param: is_candidate function of the path, True if a file in a directory or catalog is an input
+    :param: exclude_dir a directory not to search, e.g. the output directory
+    :param: catalog the header catalog file, for a query
+    :return: list of the input files, or None if the query is not a valid catalog query
+    """
+    if file_type.value is InputType.FILE.value:
+        return [file_name]
+    elif file_type.value is InputType.FILE_LIST.value:
+        with open(file_name) as f:
+            return list(read_file_list(f))
+    elif file_type.value is InputType.QUERY.value:
+        header_catalog = HeaderCatalog(catalog, create=False)
+        try:
+            return header_catalog.select(file_name, is_candidate)
+        except sqlite3.Error as e:
+            print(file_name + ': not a valid catalog query - ' + str(e))
+            return None
+        finally:
+            header_catalog.close()
+    return discover_files(file_name, is_candidate, exclude_dir)
+
+
+def check_header(task):
+    """check_header
+    classify one input from its header alone, as the calibration would
+
+    :param: task tuple of the input file, True to check it for relative reflectance,
+            and the integration time of the custom target file (ms), if any
+    :return: dictionary of the file, its status, a message and its integration time (ms)
+    """
+    (filename, reflectance, custom_t_int) = task
+    result = {'file': filename, 'status': OK, 'message': '', 't_int': None}
+    if not input_exists(filename):
+        result.update(status=MISSING, message='file does not exist')
+        return result
+    if not (is_psv_or_rad_file(filename) if reflectance else is_psv_file(filename)):
+        result.update(status=NOT_AN_INPUT, message='not a PSV or RAD file' if reflectance else 'not a PSV file')
+        return result
+    try:
+        headers = get_header_values(filename)
+    except INPUT_ERRORS as e:
+        result.update(status=UNREADABLE, message=str(e))
+        return result
+
+    try:
+        t_int = round(integration_time_from_headers(headers) * 1000)
+        if is_psv_file(filename):
+            float(headers['distToTarget'])
+    except (NonStandardHeaderException, KeyError, ValueError):
+        result.update(status=INVALID_HEADER, message='not a valid PSV or RAD file header')
+        return result
+    result['t_int'] = t_int
+
+    if reflectance:
+        if custom_t_int is None and t_int not in REFERENCE_FILES:
+            result.update(status=NONSTANDARD_EXPOSURE, message='Exposure time is not one of 7, 34, 404, or 5004')
+        elif custom_t_int is not None and t_int != custom_t_int:
+            result.update(status=CUSTOM_MISMATCH, message='integration time ' + str(t_int) +
+                          ' does not match the custom target file (' + str(custom_t_int) + ')')
+    return result
+
+
+def preflight(files, reflectance, custom_file=None, jobs=1):
+    """preflight
+    classify every input from its header, before calibrating any of them.  Only the header
+    of each file is read, on a pool of processes if jobs > 1.
+
+    :param: files the input files
+    :param: reflectance True to check the inputs for relative reflectance, False for radiance
+    :param: custom_file the custom target file, if not using the built-in references
+    :param: jobs the number of processes
+    :return: the report: the status of each file, in order, and the number of files with each status
+    """
+    report = {'custom_file': custom_file, 'custom_t_int': None, 'custom_file_error': None}
+    custom_t_int = None
+    if reflectance and custom_file:
+        try:
+            custom_t_int = get_reference_integration_time(custom_file)
+        except (NonStandardHeaderException, OSError, ValueError) as e:
+            report['custom_file_error'] = str(e) or 'not a valid custom target file header'
+        report['custom_t_int'] = custom_t_int
+
+    tasks = [(filename, reflectance, custom_t_int) for filename in files]
+    if jobs > 1:
+        results = list(run_in_pool(check_header, tasks, jobs, archives=get_archive_index(files)))
+    else:
+        results = [check_header(task) for task in tasks]
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    report.update(files=len(results), counts=counts, results=results)
+    return report
+
+
+def write_report(report_file, report):
+    """write_report
+    write a preflight report as JSON and print a summary of it
+
+    :param: report_file the report file
+    :param: report the report from preflight
+    """
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=1)
+    summary = ', '.join('{} {}'.format(count, status) for (status, count) in sorted(report['counts'].items()))
+    print('preflight of {} files: {}. Report written to {}'.format(report['files'], summary or 'nothing to check',
+                                                                  os.path.abspath(report_file)))
+    if report['custom_file_error']:
+        print('custom target file ' + str(report['custom_file']) + ': ' + report['custom_file_error'])
@@ -0,0 +1,306 @@
+import abc
+import json
+import os
+import sys
+import threading
+import time
+
+# the outcome of each file of a run
+DONE = 'done'        # calibrated and written
+SKIPPED = 'skipped'  # the output already exists, or is up to date in the manifest
+FAILED = 'failed'    # missing, unreadable or invalid; see the run log for why
+OUTCOMES = [DONE, SKIPPED, FAILED]
+# the width of the terminal progress bar, in characters
+BAR_WIDTH = 30
+
+
+def get_outcome(job):
+    """get_outcome
+    :param: job a finished CalibrationJob
+    :return: the outcome of the job, one of OUTCOMES
+    """
+    if job.skipped:
+        return SKIPPED
+    return DONE if job.result else FAILED
+
+
+def get_file_size(filename):
+    """get_file_size
+    :param: filename the input file
+    :return: the size of the file in bytes, or 0 if it does not exist
+    """
+    try:
+        return os.path.getsize(filename)
+    except (OSError, TypeError):
+        return 0
+
+
+def format_duration(seconds):
+    """format_duration
+    :param: seconds a duration, or None
+    :return: the duration as H:MM:SS, or ? if it is not known
+    """
+    if seconds is None:
+        return '?'
+    (minutes, seconds) = divmod(int(seconds), 60)
+    (hours, minutes) = divmod(minutes, 60)
+    return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+
+class ProgressSink(abc.ABC):
+    """ProgressSink
+    Somewhere to show the progress of a run.  A sink is given the status of the run at
+    most once every interval seconds, and always when the run finishes.  Each kind of
+    sink implements update.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_update = None
+
+    def is_due(self, now):
+        """is_due
+        :param: now the time, from time.monotonic
+        :return: True if the sink is to be given the status
+        """
+        return self.last_update is None or now - self.last_update >= self.interval
+
+    @abc.abstractmethod
+    def update(self, status, final):
+        """update
+        show the status of the run
+
+        :param: status the status, from RunProgress.get_status
+        :param: final True once the run has finished
+        """
+
+
+class TerminalProgress(ProgressSink):
+    """TerminalProgress
+    A progress bar on the terminal, redrawn in place.  If the output is not a terminal,
+    e.g. a log of a batch job, a line is written every line_interval seconds instead.
+    """
+
+    def __init__(self, stream=None, interval=0.2, line_interval=30.0):
+        self.stream = stream if stream is not None else sys.stderr
+        self.is_terminal = self.stream.isatty()
+        ProgressSink.__init__(self, interval if self.is_terminal else line_interval)
+
+    def update(self, status, final):
+        """update
+        draw the bar: files finished of the total, throughput, ETA and the count of each outcome
+        """
+        total = status['files_total']
+        if total:
+            filled = int(BAR_WIDTH * status['files_finished'] / total)
+            bar = '[{}{}] {}/{} {:5.1f}%'.format('#' * filled, '-' * (BAR_WIDTH - filled),
+                                                status['files_finished'], total, status['percent'])
+        else:
+            bar = '{} files'.format(status['files_finished'])
+        line = '{}  {:.1f} files/s  {:.2f} MB/s  ETA {}  ({} done, {} skipped, {} failed)'.format(
+            bar, status['files_per_second'], status['bytes_per_second'] / 1E6,
+            format_duration(status['eta_seconds']), status['files_done'], status['files_skipped'],
+            status['files_failed'])
+        if self.is_terminal:
+            self.stream.write('\r' + line + ('\n' if final else ''))
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+
+
+class AppProgress(ProgressSink):
+    """AppProgress
+    The progress bar of the main application.  The application may rate-limit
+    its redraws, so it is given every update.
+    """
+
+    def __init__(self, main_app):
+        ProgressSink.__init__(self, 0.0)
+        self.main_app = main_app
+
+    def update(self, status, final):
+        """update
+        set the progress bar to the percent of the files finished, if the total is known
+        """
+        if status['percent'] is not None:
+            self.main_app.update_progress(status['percent'])
+        elif final:
+            self.main_app.update_progress(100)
+
+
+class StatusFile(ProgressSink):
+    """StatusFile
+    A file with the status of the run, rewritten every interval seconds so a long run on a
+    headless node can be monitored.  The file is JSON, or in the Prometheus text format if
+    its name ends with .prom, for the textfile collector of node_exporter.  It is replaced
+    in one step, so a reader never sees half of it.
+    """
+
+    def __init__(self, path, interval=10.0):
+        ProgressSink.__init__(self, interval)
+        self.path = path
+
+    def update(self, status, final):
+        """update
+        rewrite the status file
+        """
+        if self.path.endswith('.prom'):
+            text = self.get_metrics(status)
+        else:
+            text = json.dumps(status, indent=1) + '\n'
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(text)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def get_metrics(status):
+        """get_metrics
+        :param: status the status of the run
+        :return: the status as metrics in the Prometheus text format
+        """
+        labels = 'calibration="{}"'.format(status['calibration'])
+        metrics = [
+            ('ccam_prospect_files', 'gauge', 'files finished in the run, by outcome',
+             ['{{{},outcome="{}"}} {}'.format(labels, outcome, status['files_' + outcome]) for outcome in OUTCOMES]),
+            ('ccam_prospect_files_expected', 'gauge', 'files in the run, if known',
+             ['{{{}}} {}'.format(labels, status['files_total'] or 'NaN')]),
+            ('ccam_prospect_bytes_read', 'gauge', 'bytes of the input files finished',
+             ['{{{}}} {}'.format(labels, status['bytes'])]),
+            ('ccam_prospect_files_per_second', 'gauge', 'files finished per second',
+             ['{{{}}} {}'.format(labels, status['files_per_second'])]),
+            ('ccam_prospect_bytes_per_second', 'gauge', 'bytes of input finished per second',
+             ['{{{}}} {}'.format(labels, status['bytes_per_second'])]),
+            ('ccam_prospect_eta_seconds', 'gauge', 'estimated seconds to the end of the run',
+             ['{{{}}} {}'.format(labels, 'NaN' if status['eta_seconds'] is None else status['eta_seconds'])]),
+            ('ccam_prospect_elapsed_seconds', 'gauge', 'seconds since the start of the run',
+             ['{{{}}} {}'.format(labels, status['elapsed_seconds'])]),
+            ('ccam_prospect_running', 'gauge', '1 while the run is going, 0 once it has finished',
+             ['{{{}}} {}'.format(labels, 0 if status['finished'] else 1)]),
+            ('ccam_prospect_last_update_timestamp_seconds', 'gauge', 'time of this status',
+             ['{{{}}} {}'.format(labels, status['updated'])])
+        ]
+        lines = []
+        for (name, kind, description, samples) in metrics:
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            lines.extend(name + sample for sample in samples)
+        return '\n'.join(lines) + '\n'
+
+
+class RunProgress:
+    """RunProgress
+    The progress of a run: the files done, skipped and failed, the files and bytes per
+    second and the time left, passed on to each sink.  Files may be reported from several
+    threads; worker processes send their outcomes back to the main process.
+    """
+
+    def __init__(self, calibration, sinks):
+        """
+        :param: calibration the name of the calibration, e.g. radiance
+        :param: sinks list of ProgressSinks to show the progress on
+        """
+        self.calibration = calibration
+        self.sinks = sinks
+        self.total = None
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+        self.bytes = 0
+        self.started = time.time()
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_total(self, total):
+        """set_total
+        set the number of files in the run, once it is known
+        """
+        with self.lock:
+            self.total = total
+
+    def add(self, file, outcome):
+        """add
+        count a finished file and update the sinks that are due
+        """
+        size = get_file_size(file)
+        with self.lock:
+            self.counts[outcome] += 1
+            self.bytes += size
+            self.publish(False)
+
+    def finish(self):
+        """finish
+        give the final status of the run to every sink
+        """
+        with self.lock:
+            self.publish(True)
+
+    def publish(self, final):
+        """publish
+        give the status to the sinks that are due.  The caller holds the lock.  Every sink
+        is updated even if one raises, e.g. the application when the run is cancelled, so
+        the others still get the final status; the first exception is raised afterwards.
+        """
+        now = time.monotonic()
+        due = [sink for sink in self.sinks if final or sink.is_due(now)]
+        if not due:
+            return
+        status = self.get_status(now, final)
+        error = None
+        for sink in due:
+            sink.last_update = now
+            try:
+                sink.update(status, final)
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+
+    def get_status(self, now, final):
+        """get_status
+        :param: now the time, from time.monotonic
+        :param: final True once the run has finished
+        :return: dictionary of the status of the run
+        """
+        finished = sum(self.counts.values())
+        elapsed = now - self.start
+        files_per_second = finished / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total is not None and files_per_second > 0:
+            eta = max(self.total - finished, 0) / files_per_second
+        return {
+            'calibration': self.calibration,
+            'finished': final,
+            'files_total': self.total,
+            'files_finished': finished,
+            'files_done': self.counts[DONE],
+            'files_skipped': self.counts[SKIPPED],
+            'files_failed': self.counts[FAILED],
+            'percent': 100.0 * finished / self.total if self.total else None,
+            'bytes': self.bytes,
+            'files_per_second': files_per_second,
+            'bytes_per_second': self.bytes / elapsed if elapsed > 0 else 0.0,
+            'elapsed_seconds': elapsed,
+            'eta_seconds': 0.0 if final else eta,
+            'started': self.started,
+            'updated': time.time()
+        }
+
+
+def make_run_progress(calibration, main_app=None, progress_bar=False, status_file=None):
+    """make_run_progress
+    the progress of a new run, shown on the main application, the terminal and a status file
+
+    :param: calibration the name of the calibration, e.g. radiance
+    :param: main_app the main application, or None
+    :param: progress_bar True to draw a progress bar on the terminal
+    :param: status_file the status file, or None
+    :return: the RunProgress, or None if the progress is not shown anywhere
+    """
+    sinks = []
+    if main_app is not None:
+        sinks.append(AppProgress(main_app))
+    if progress_bar:
+        sinks.append(TerminalProgress())
+    if status_file is not None:
+        sinks.append(StatusFile(status_file))
+    return RunProgress(calibration, sinks) if sinks else None
@@ -0,0 +1,97 @@
+import contextlib
+import numpy as np
+from ccam_prospect.utils.Utilities import parse_header_values, integration_time_from_headers
+from ccam_prospect.utils.CustomExceptions import NonStandardHeaderException
+from ccam_prospect.utils.InputFiles import open_input
+
+# number of header lines copied to the calibrated rad file
+HEADER_LINES = 29
+
+# line ranges of each spectrometer in the PSV table
+VNIR_LINES = (79, 2127)
+VIS_LINES = (2227, 4275)
+UV_LINES = (4375, 6423)
+
+
+def read_channel(lines, line_range):
+    """read_channel
+    convert the lines of one spectrometer into an array of floats
+
+    :param: lines all lines of the PSV file
+    :param: line_range the (start, end) lines of the spectrometer
+    :return: the values of the spectrometer
+    """
+    (start, end) = line_range
+    return np.fromiter(map(float, lines[start:end]), dtype=float, count=end - start)
+
+
+def no_timer(stage):
+    """no_timer
+    a timer for PsvFile that does not time anything
+    """
+    return contextlib.nullcontext()
+
+
+class PsvFile:
+    """PsvFile
+    Read a PSV file once and keep the header values, the raw header lines and the
+    spectra of each spectrometer.  The file may be compressed or inside an archive, see open_input.
+    Raises ValueError if the spectra are not formatted correctly.
+
+        field    line
+
+        vnir:     79:2127
+        vis:      2227:4275
+        uv:       4375:6423
+    """
+
+    def __init__(self, filename, timer=None):
+        """
+        :param: filename the PSV file
+        :param: timer function of a stage name that returns a context manager timing that stage,
+                to time reading the file and parsing the header and the spectra, see StageTimings
+        """
+        if timer is None:
+            timer = no_timer
+        self.filename = filename
+        with timer('read'):
+            with open_input(filename) as f:
+                lines = f.readlines()
+
+        with timer('header'):
+            self.headers = parse_header_values(lines)
+            self.header_string = lines[0:HEADER_LINES]
+        with timer('spectra'):
+            self.vnir = read_channel(lines, VNIR_LINES)
+            self.vis = read_channel(lines, VIS_LINES)
+            self.uv = read_channel(lines, UV_LINES)
+
+    def get_integration_time(self):
+        """get_integration_time
+        Calculate the integration time based on values in the header
+
+        :return: integration time
+        """
+        return integration_time_from_headers(self.headers)
+
+    def get_calibration_headers(self):
+        """get_calibration_headers
+        the header values needed for the radiance calibration
+
+        :return: distance to target, IPBC divisor and ICT divisor
+        """
+        try:
+            distance = float(self.headers['distToTarget'])
+            ipbc = float(self.headers['IPBCdivisor'])
+            ict = float(self.headers['ICTdivisor'])
+        except KeyError:
+            raise NonStandardHeaderException
+        return distance, ipbc, ict
+
+    def get_spectrum(self):
+        """get_spectrum
+        combine the uv, vis and vnir spectra into one array ordered by wavelength
+
+        :return: the combined spectrum, in DN
+        """
+        return np.concatenate([self.uv, self.vis, self.vnir])
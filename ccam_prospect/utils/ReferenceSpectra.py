@@ -0,0 +1,133 @@
+import os
+import numpy as np
+from ccam_prospect.utils.Utilities import get_integration_time
+
+# the sol 76 target 11 reference files built in to the tool
+my_path = os.path.abspath(os.path.dirname(__file__))
+SOL76_DIR = os.path.join(my_path, "../sol76")
+REFERENCE_FILES = {
+    7: os.path.join(SOL76_DIR, 'CL0_404238481PSV_F0050104CCAM02076P1.TXT.RAD.cor.7ms.txt.cos'),
+    34: os.path.join(SOL76_DIR, 'CL0_404238492PSV_F0050104CCAM02076P1.TXT.RAD.cor.34ms.txt.cos'),
+    404: os.path.join(SOL76_DIR, 'CL9_404238503PSV_F0050104CCAM02076P1.TXT.RAD.cor.404ms.txt.cos'),
+    5004: os.path.join(SOL76_DIR, 'CL9_404238538PSV_F0050104CCAM02076P1.TXT.RAD.cor.5004ms.txt.cos')
+}
+CONVOLUTION_FILE = os.path.join(SOL76_DIR, 'Target11_60_95.txt.conv')
+
+# reference spectra already read in this process, by file name
+_reference_cache = {}
+# integration times (ms) of custom target files already read in this process, by file name
+_integration_time_cache = {}
+
+
+class ReferenceSpectrum:
+    """ReferenceSpectrum
+    the wavelengths and values of a 2-column reference file, skipping any header lines
+    (lines with a '"').  The arrays are shared by every calibration in the process, so they are read-only.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename) as f:
+            table = np.array([x.split()[0:2] for x in f if '"' not in x], dtype=float)
+        self.wavelength = table[:, 0]
+        self.values = table[:, 1]
+        self.wavelength.flags.writeable = False
+        self.values.flags.writeable = False
+
+    @classmethod
+    def from_arrays(cls, filename, wavelength, values):
+        """from_arrays
+        a reference spectrum made from arrays that were already read, e.g. in shared memory
+
+        :param: filename the reference file the arrays were read from
+        :param: wavelength the wavelengths
+        :param: values the values
+        :return: the ReferenceSpectrum
+        """
+        reference = cls.__new__(cls)
+        reference.filename = filename
+        reference.wavelength = wavelength
+        reference.values = values
+        return reference
+
+
+def get_reference_files(custom_file=None):
+    """get_reference_files
+    every file that the relative reflectance of an output depends on
+
+    :param: custom_file the custom calibration file, if not using the built-in references
+    :return: list of the reference files
+    """
+    if custom_file:
+        return [custom_file, CONVOLUTION_FILE]
+    return [REFERENCE_FILES[t_int] for t_int in sorted(REFERENCE_FILES)] + [CONVOLUTION_FILE]
+
+
+def get_reference(filename):
+    """get_reference
+    the reference spectrum in this file, read once per process
+
+    :param: filename the reference file
+    :return: the ReferenceSpectrum
+    """
+    reference = _reference_cache.get(filename)
+    if reference is None:
+        reference = ReferenceSpectrum(filename)
+        _reference_cache[filename] = reference
+    return reference
+
+
+def set_reference(reference):
+    """set_reference
+    use a reference spectrum that was already read, e.g. attached from shared memory
+
+    :param: reference the ReferenceSpectrum
+    """
+    _reference_cache[reference.filename] = reference
+
+
+def get_reference_for_time(t_int, custom_file=None):
+    """get_reference_for_time
+    the built-in reference spectrum for this integration time, or the custom reference
+
+    :param: t_int the integration time, in ms
+    :param: custom_file the custom calibration file, if not using the built-in references
+    :return: the ReferenceSpectrum, or None if there is no built-in reference for this time
+    """
+    if custom_file:
+        return get_reference(custom_file)
+    if t_int not in REFERENCE_FILES:
+        return None
+    return get_reference(REFERENCE_FILES[t_int])
+
+
+def get_convolution():
+    """get_convolution
+    the lab bidirectional spectrum of target 11, read once per process
+
+    :return: the values of the lab spectrum
+    """
+    return get_reference(CONVOLUTION_FILE).values
+
+
+def get_reference_integration_time(filename):
+    """get_reference_integration_time
+    the integration time of a custom target file from its header, read once per process.
+    Raises NonStandardHeaderException if the header does not have the integration time.
+
+    :param: filename the custom target file
+    :return: the integration time, in ms
+    """
+    t_int = _integration_time_cache.get(filename)
+    if t_int is None:
+        t_int = round(get_integration_time(filename) * 1000)
+        _integration_time_cache[filename] = t_int
+    return t_int
+
+
+def clear_reference_cache():
+    """clear_reference_cache
+    forget every reference read so far, e.g. after a reference file changed
+    """
+    _reference_cache.clear()
+    _integration_time_cache.clear()
@@ -0,0 +1,164 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+# the reason an input was skipped, for the entries of a run log and a preflight report
+MISSING = 'missing'                            # the file or directory does not exist
+UNREADABLE = 'unreadable'                      # the file could not be read or decompressed
+INVALID_HEADER = 'invalid_header'              # a header value needed for the calibration is missing
+NONSTANDARD_EXPOSURE = 'nonstandard_exposure'  # the integration time is not 7, 34, 404 or 5004 ms
+CUSTOM_MISMATCH = 'custom_mismatch'            # the integration time is not that of the custom target file
+INVALID_QUERY = 'invalid_query'                # the query of the header catalog could not be run
+
+# run logs already opened in this process, by path.  A forked worker process does not
+# inherit the entries waiting to be written by the process it was forked from.
+_run_logs = {}
+_run_logs_lock = threading.Lock()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_run_logs.clear)
+
+
+def get_json_filename(log_file):
+    """get_json_filename
+    the JSON lines file of a run log, next to the text log, e.g. badInput_x.jsonl for badInput_x.log
+
+    :param: log_file the text log file
+    :return: the JSON lines file
+    """
+    return os.path.splitext(log_file)[0] + '.jsonl'
+
+
+def make_entry(file, stage, reason, message):
+    """make_entry
+    one entry of a run log, stamped with the time it happened
+
+    :param: file the input file (or directory, list or query) that was skipped
+    :param: stage the stage that skipped it, e.g. radiance calibration
+    :param: reason the reason it was skipped, one of MISSING, UNREADABLE, ...
+    :param: message the description of the problem
+    :return: the entry
+    """
+    return {'time': time.time(), 'file': file, 'stage': stage, 'reason': reason, 'message': message}
+
+
+def read_run_log(log_file):
+    """read_run_log
+    the entries of a run log, to query the failures of a run
+
+    :param: log_file the text log file, or its JSON lines file
+    :return: list of the entries, in the order they were logged
+    """
+    with open(get_json_filename(log_file)) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(entries):
+    """summarize
+    :param: entries the entries of a run log
+    :return: the number of entries for each reason
+    """
+    counts = {}
+    for entry in entries:
+        counts[entry['reason']] = counts.get(entry['reason'], 0) + 1
+    return counts
+
+
+class RunLog:
+    """RunLog
+    The inputs skipped in a run, kept in memory and written in batches rather than opening
+    the log file for every entry.  Each entry is written both as a line of the text log
+    (badInput_*.log) and as a JSON line with the file, stage, reason, message, time and the
+    seconds since the start of the run.  Entries may be added from several threads; worker
+    processes send their entries back to the main process, which adds them in input order.
+    """
+
+    def __init__(self, path, batch_size=256):
+        """
+        :param: path the text log file.  Neither file is created until there is an entry to write.
+        :param: batch_size the number of entries kept before they are written
+        """
+        self.path = path
+        self.json_path = get_json_filename(path)
+        self.batch_size = batch_size
+        self.entries = []
+        self.counts = {}
+        self.start = time.time()
+        self.lock = threading.Lock()
+
+    def start_run(self):
+        """start_run
+        start counting the entries and the elapsed time of a new run
+        """
+        with self.lock:
+            self.counts = {}
+            self.start = time.time()
+
+    def add(self, entry):
+        """add
+        log an entry from make_entry, writing the entries kept so far once there is a batch of them
+        """
+        with self.lock:
+            self.entries.append(dict(entry, elapsed=round(entry['time'] - self.start, 6)))
+            self.counts[entry['reason']] = self.counts.get(entry['reason'], 0) + 1
+            if len(self.entries) >= self.batch_size:
+                self.write_entries()
+
+    def flush(self):
+        """flush
+        write every entry kept so far
+        """
+        with self.lock:
+            self.write_entries()
+
+    def write_entries(self):
+        """write_entries
+        append the entries kept so far to both files, with one open of each.  The caller holds the lock.
+        """
+        if not self.entries:
+            return
+        with open(self.path, 'a+') as log:
+            log.write(''.join('{}: {} - {} \n'.format(entry['file'], entry['stage'], entry['message'])
+                              for entry in self.entries))
+        with open(self.json_path, 'a+') as log:
+            log.write(''.join(json.dumps(entry) + '\n' for entry in self.entries))
+        self.entries = []
+
+    def finish_run(self):
+        """finish_run
+        write every entry kept so far and print the number of inputs skipped for each reason
+
+        :return: the number of entries for each reason in this run
+        """
+        self.flush()
+        with self.lock:
+            counts = dict(self.counts)
+        if counts:
+            summary = ', '.join('{} {}'.format(count, reason) for (reason, count) in sorted(counts.items()))
+            print('{} inputs skipped ({}), see {}'.format(sum(counts.values()), summary,
+                                                         os.path.abspath(self.path)))
+        return counts
+
+
+def get_run_log(path):
+    """get_run_log
+    the run log at this path, opened once per process, so every calibration writing to the
+    same log file (e.g. the radiance calibration inside the relative reflectance calibration) shares it
+
+    :param: path the text log file
+    :return: the run log
+    """
+    with _run_logs_lock:
+        if path not in _run_logs:
+            _run_logs[path] = RunLog(path)
+        return _run_logs[path]
+
+
+@atexit.register
+def flush_run_logs():
+    """flush_run_logs
+    write the entries still kept by every run log, when the process exits
+    """
+    for run_log in list(_run_logs.values()):
+        run_log.flush()
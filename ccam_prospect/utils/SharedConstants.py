@@ -0,0 +1,98 @@
+import numpy as np
+from ccam_prospect.utils.CalibrationConstants import CalibrationConstants, get_calibration_constants, \
+    use_calibration_constants
+from ccam_prospect.utils.ReferenceSpectra import ReferenceSpectrum, get_reference, set_reference
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # no shared memory on this platform, so each worker process loads its own constants
+    shared_memory = None
+
+# the shared memory attached in this worker process, kept open while its arrays are in use
+_attached_memory = None
+
+
+class SharedConstants:
+    """SharedConstants
+    Publish the calibration constants and reference spectra once, in one block of shared
+    memory, for a pool of worker processes.  Each worker attaches to the block in
+    attach_constants and uses the arrays in place, so it does not read and parse the
+    gain and reference files again or keep its own copy of them.
+
+    If shared memory is not available, descriptor is None and each worker loads the
+    constants itself the first time they are used.
+    """
+
+    def __init__(self, reference_files=()):
+        """
+        :param: reference_files the reference files to share along with the gain file, if any
+        """
+        self.memory = None
+        self.descriptor = None
+        if shared_memory is None:
+            return
+
+        calibration_constants = get_calibration_constants()
+        # (kind, file name, array name, array) of each array to share
+        arrays = [('gain', calibration_constants.gain_file, name, getattr(calibration_constants, name))
+                  for name in CalibrationConstants.ARRAYS]
+        for filename in reference_files:
+            try:
+                reference = get_reference(filename)
+            except (OSError, ValueError):
+                # not a readable reference, the workers will report it
+                continue
+            arrays.append(('reference', filename, 'wavelength', reference.wavelength))
+            arrays.append(('reference', filename, 'values', reference.values))
+
+        size = sum(len(array) for (kind, filename, name, array) in arrays)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1) * 8)
+        data = np.ndarray((size,), dtype=float, buffer=self.memory.buf)
+        layout = []
+        offset = 0
+        for (kind, filename, name, array) in arrays:
+            data[offset:offset + len(array)] = array
+            layout.append((kind, filename, name, offset, len(array)))
+            offset += len(array)
+        self.descriptor = (self.memory.name, size, layout)
+
+    def close(self):
+        """close
+        release the shared memory, once the workers are finished with it
+        """
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+
+def attach_constants(descriptor):
+    """attach_constants
+    initializer for a worker process: use the calibration constants and reference
+    spectra published by SharedConstants, without copying them
+
+    :param: descriptor the descriptor of the SharedConstants, or None to load the constants in this process
+    """
+    global _attached_memory
+    if descriptor is None:
+        return
+    (name, size, layout) = descriptor
+    _attached_memory = shared_memory.SharedMemory(name=name)
+    data = np.ndarray((size,), dtype=float, buffer=_attached_memory.buf)
+    data.flags.writeable = False
+
+    gain_file = None
+    gain_arrays = {}
+    reference_arrays = {}
+    for (kind, filename, array_name, offset, length) in layout:
+        array = data[offset:offset + length]
+        if kind == 'gain':
+            gain_file = filename
+            gain_arrays[array_name] = array
+        else:
+            reference_arrays.setdefault(filename, {})[array_name] = array
+
+    use_calibration_constants(CalibrationConstants.from_arrays(gain_file, gain_arrays))
+    for (filename, arrays) in reference_arrays.items():
+        set_reference(ReferenceSpectrum.from_arrays(filename, arrays['wavelength'], arrays['values']))
@@ -0,0 +1,146 @@
+import json
+import os
+import re
+import threading
+import numpy as np
+from ccam_prospect.utils.Utilities import LABEL_KEYS, get_label_values, integration_time_from_headers
+from ccam_prospect.utils.CustomExceptions import NonStandardHeaderException
+from ccam_prospect.utils.InputFiles import input_exists
+
+# data type of the spectra in a cube, little-endian 64-bit floats
+CUBE_DTYPE = '<f8'
+# the spacecraft clock in a CCAM file name, e.g. CL5_404238000PSV_...
+SCLK_PATTERN = re.compile(r'cl\d_(\d{9})', re.IGNORECASE)
+
+
+def get_index_filename(cube_file):
+    """get_index_filename
+    the sidecar index of a cube, next to the cube file
+
+    :param: cube_file the cube file
+    :return: the index file
+    """
+    return cube_file + '.json'
+
+
+def parse_sclk(value):
+    """parse_sclk
+    :param: value the spacecraft clock of a label, e.g. "404238481.123", or None
+    :return: the whole seconds of the clock, or None if there is none or it is a placeholder such as UNK
+    """
+    if value is None:
+        return None
+    try:
+        return int(float(value.strip('"')))
+    except ValueError:
+        return None
+
+
+def make_cube_entry(source_file, headers, label_file=None, label_values=None):
+    """make_cube_entry
+    the index entry of one spectrum in a cube: the file it came from, the sol and
+    spacecraft clock from its original label (the clock falls back to the file name),
+    and the integration time (s) and distance to target from its header
+
+    :param: source_file the input file of the spectrum
+    :param: headers the header values of the PSV or RAD file
+    :param: label_file the original PDS3 label of the input, if any
+    :param: label_values the LABEL_KEYS values of the label, if already read
+    :return: the index entry
+    """
+    label = label_values or {}
+    if label_values is None and label_file and input_exists(label_file):
+        label = get_label_values(label_file, LABEL_KEYS)
+    sol = label.get('PLANET_DAY_NUMBER')
+    if sol is not None:
+        sol = sol.strip('"')
+    sclk = parse_sclk(label.get('SPACECRAFT_CLOCK_START_COUNT'))
+    if sclk is None:
+        match = SCLK_PATTERN.search(os.path.basename(source_file))
+        sclk = int(match.group(1)) if match else None
+    try:
+        t_int = integration_time_from_headers(headers)
+    except (NonStandardHeaderException, ValueError):
+        t_int = None
+    try:
+        distance = float(headers['distToTarget'])
+    except (KeyError, ValueError):
+        distance = None
+    return {
+        'file': source_file,
+        'sol': int(sol) if sol is not None and sol.isdigit() else sol,
+        'sclk': sclk,
+        'integration_time': t_int,
+        'distance': distance
+    }
+
+
+class SpectralCube:
+    """SpectralCube
+    Every spectrum calibrated in a run, one row each, appended to one binary file of
+    N x 6144 floats, with a sidecar JSON index of the source file, sol, spacecraft clock,
+    integration time and distance of each row and the wavelength of each channel.
+    The index is written by close, and open_cube maps the rows back into memory.
+    """
+
+    def __init__(self, path, kind):
+        """
+        :param: path the cube file to write
+        :param: kind the kind of spectra in the cube, RAD or REF
+        """
+        self.path = path
+        self.kind = kind
+        self.wavelength = None
+        self.entries = []
+        self.lock = threading.Lock()
+        self.data = open(path, 'wb')
+
+    def append(self, entry, wavelength, values):
+        """append
+        add one spectrum to the end of the cube
+
+        :param: entry the index entry of the spectrum, from make_cube_entry
+        :param: wavelength the wavelength of each channel
+        :param: values the calibrated values
+        """
+        with self.lock:
+            if self.wavelength is None:
+                self.wavelength = [float(wl) for wl in wavelength]
+            self.data.write(np.asarray(values, dtype=CUBE_DTYPE).tobytes())
+            self.entries.append(dict(entry, row=len(self.entries)))
+
+    def close(self):
+        """close
+        finish the cube file and write its index, replacing the previous index only once it is completely written
+        """
+        with self.lock:
+            if self.data.closed:
+                return
+            self.data.close()
+            index = {
+                'kind': self.kind,
+                'dtype': CUBE_DTYPE,
+                'shape': [len(self.entries), len(self.wavelength) if self.wavelength is not None else 0],
+                'wavelength': self.wavelength,
+                'spectra': self.entries
+            }
+            index_file = get_index_filename(self.path)
+            with open(index_file + '.tmp', 'w') as f:
+                json.dump(index, f, indent=1)
+            os.replace(index_file + '.tmp', index_file)
+
+
+def open_cube(path):
+    """open_cube
+    map a cube written by SpectralCube into memory, without reading it
+
+    :param: path the cube file
+    :return: the read-only N x 6144 array of spectra, or None if the cube is empty
+    :return: the index of the cube
+    """
+    with open(get_index_filename(path)) as f:
+        index = json.load(f)
+    if index['shape'][0] == 0:
+        return None, index
+    spectra = np.memmap(path, dtype=index['dtype'], mode='r', shape=tuple(index['shape']))
+    return spectra, index
@@ -0,0 +1,138 @@
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# the stages timed in a calibration, in the order they run.  Stages that do not apply
+# to a file, e.g. the radiance stages of a RAD input, are not timed for that file.
+STAGES = ['read', 'header', 'spectra', 'read_label', 'offsets', 'radiance', 'reflectance', 'write_table', 'write_label']
+
+
+def get_statistics(seconds):
+    """get_statistics
+    the distribution of some durations
+
+    :param: seconds the durations, in seconds
+    :return: dictionary of the count, total, mean, p50, p95 and max, in seconds
+    """
+    seconds = np.asarray(seconds, dtype=float)
+    if len(seconds) == 0:
+        return {'count': 0, 'total': 0.0, 'mean': None, 'p50': None, 'p95': None, 'max': None}
+    return {
+        'count': len(seconds),
+        'total': float(seconds.sum()),
+        'mean': float(seconds.mean()),
+        'p50': float(np.percentile(seconds, 50)),
+        'p95': float(np.percentile(seconds, 95)),
+        'max': float(seconds.max())
+    }
+
+
+class StageTimings:
+    """StageTimings
+    The time spent in each stage of the calibration of each file in a run: reading the file,
+    parsing the header, the spectra and the original label, removing offsets, the radiance
+    and reflectance math, and writing the table and the label.  Stages may be timed from
+    several threads; worker processes send their records back to the main process, see extend.
+    """
+
+    def __init__(self):
+        self.records = []  # (file, stage, seconds) for each stage timed
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def time(self, file, stage):
+        """time
+        time the code in a with block as one stage of a file
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(file, stage, time.perf_counter() - start)
+
+    def add(self, file, stage, seconds):
+        """add
+        record the time of one stage of a file, in seconds
+        """
+        with self.lock:
+            self.records.append((file, stage, seconds))
+
+    def extend(self, records):
+        """extend
+        add the records of another StageTimings, e.g. from a worker process
+        """
+        with self.lock:
+            self.records.extend(records)
+
+    def get_report(self):
+        """get_report
+        the timing report of the run so far: the distribution of the time of each stage and
+        of the total time per file, the number of files per second of the run, and the time
+        of each stage of each file
+
+        :return: the report
+        """
+        with self.lock:
+            records = list(self.records)
+        wall_time = time.perf_counter() - self.start
+
+        per_file = {}
+        per_stage = {}
+        for (file, stage, seconds) in records:
+            file_stages = per_file.setdefault(file, {})
+            file_stages[stage] = file_stages.get(stage, 0.0) + seconds
+            per_stage.setdefault(stage, []).append(seconds)
+        stages = sorted(per_stage, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES))
+
+        return {
+            'files': len(per_file),
+            'wall_time': wall_time,
+            'files_per_second': len(per_file) / wall_time if wall_time > 0 else None,
+            'stages': {stage: get_statistics(per_stage[stage]) for stage in stages},
+            'file_total': get_statistics([sum(s.values()) for s in per_file.values()]),
+            'per_file': [dict(file=file, total=sum(s.values()), **s) for (file, s) in per_file.items()]
+        }
+
+    def write_report(self, report_file):
+        """write_report
+        write the timing report as JSON and print the time of each stage
+
+        :param: report_file the report file
+        :return: the report
+        """
+        report = self.get_report()
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=1)
+        print('{} files in {:.3f} s ({:.2f} files/s). Timing report written to {}'.format(
+            report['files'], report['wall_time'], report['files_per_second'] or 0, os.path.abspath(report_file)))
+        for (stage, statistics) in report['stages'].items():
+            print('  {:<12} p50 {:9.6f} s  p95 {:9.6f} s  max {:9.6f} s'.format(
+                stage, statistics['p50'], statistics['p95'], statistics['max']))
+        return report
+
+
+def run_profiled(profile_file, function, *args):
+    """run_profiled
+    call a function, under cProfile if there is a profile file to write.  Only the calling
+    thread of the main process is profiled, so profile a run without -j or --pipeline.
+
+    :param: profile_file the file to dump the profile statistics to, for pstats or snakeviz, or None
+    :param: function the function to call
+    :param: args the arguments to the function
+    :return: the result of the function
+    """
+    if profile_file is None:
+        return function(*args)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return function(*args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+        print('profile written to ' + os.path.abspath(profile_file))
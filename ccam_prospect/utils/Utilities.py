@@ -1,7 +1,19 @@
-from jinja2 import Environment, FileSystemLoader
 import os
+import threading
+import numpy as np
 from datetime import date
 from ccam_prospect.utils.CustomExceptions import NonStandardHeaderException
+from ccam_prospect.utils.InputFiles import open_input, strip_compression
+
+# the keywords read from the original PDS3 label of an input, for the new label and the cube
+LABEL_KEYS = ('START_TIME', 'PLANET_DAY_NUMBER', 'SPACECRAFT_CLOCK_START_COUNT')
+# the keywords only looked for at the top of the label, and the index of the last line they
+# are looked for in.  The observation start of a new label has always come from lines 0 to 57.
+LABEL_KEY_LINES = {'START_TIME': 57}
+
+# the RAD and REF label templates, compiled once per process, see get_template
+_templates = {}
+_templates_lock = threading.Lock()
 
 
 def get_integration_time(filename):
@@ -11,17 +23,53 @@ def get_integration_time(filename):
     :param: filename the name of the file to read
     :return: integration time
     """
-    headers = get_header_values(filename)
+    return integration_time_from_headers(get_header_values(filename))
+
 
+def integration_time_from_headers(headers):
+    """integration_time_from_headers
+    Calculate the integration time from header values that were already read
+
+    :param: headers the header values of the file
+    :return: integration time
+    """
     try:
         ipbc = float(headers['IPBCdivisor'])
         ict = float(headers['ICTdivisor'])
-        return ((ipbc * ict) / 33000000) + 0.00356
+        return integration_time(ipbc, ict)
     except KeyError:
         raise NonStandardHeaderException
         return None
 
 
+def integration_time(ipbc, ict):
+    """integration_time
+    Calculate the integration time from the IPBC and ICT divisors.
+    Works on single values or on arrays of divisors.
+
+    :param: ipbc the IPBC divisor
+    :param: ict the ICT divisor
+    :return: integration time
+    """
+    return ((ipbc * ict) / 33000000) + 0.00356
+
+
+# fixed-width PDS layout of one row of a RAD or REF table
+TABLE_ROW_FORMAT = "%10.3f%20f            \r\n"
+
+
+def format_table(wavelengths, values):
+    """format_table
+    format the whole 2-column table in one pass, one fixed-width row for each wavelength
+
+    :param: wavelengths the values of the wavelengths, the first column
+    :param: values the calibrated values, the second column
+    :return: the formatted table
+    """
+    table = np.column_stack((wavelengths, values)).ravel().tolist()
+    return (TABLE_ROW_FORMAT * len(wavelengths)) % tuple(table)
+
+
 def write_final(file_to_write, wavelengths, values, header=None):
     """write_final
     given the file to write to, the wavelengths, and the values, write them to file in a 2-column table
@@ -30,19 +78,20 @@ def write_final(file_to_write, wavelengths, values, header=None):
     :param: wavelenghts the values of the wavelengths, the first column
     :param: values the calibrated values, the second column
     """
+    output = format_table(wavelengths, values)
+    if header is not None:
+        output = "".join(header).replace("\n", "\r\n") + output
     with open(file_to_write, 'w') as f:
-        if header is not None:
-            [f.write(header[ii].replace("\n", "\r\n")) for ii in range(0, len(header))]
-        n = len(wavelengths)
-        [f.write("{:10.3f}{:20f}            \r\n".format(wavelengths[ii], values[ii])) for ii in range(0, n)]
+        f.write(output)
 
 
-def get_context(label_path, psv_label):
+def get_context(label_path, psv_label, label_values=None):
     """get_context
     given the old label, get some values and create a context to fill in the PDS4 label template
 
     :param: label_path the path to the new label
     :param: psv_label the path to the old label for the PSV file
+    :param: label_values the LABEL_KEYS values of the old label, if already read, see get_label_values
     :return: the context for creating the new label from template
     """
     # get filename with and without extension
@@ -55,16 +104,11 @@ def get_context(label_path, psv_label):
     creation_date = today.strftime("%Y-%m-%d")
 
     # get PSV filename and observation start time
-    start_time = "UNK" # just in case
-    with open(psv_label) as psv:
-        for i, line in enumerate(psv):
-            line_parts = line.split("=")
-            if line_parts[0].strip() == "START_TIME":
-                start_time = line_parts[1].strip()
-            if i > 56:
-                break
+    if label_values is None:
+        label_values = get_label_values(psv_label, LABEL_KEYS)
+    start_time = label_values.get("START_TIME", "UNK")  # just in case
 
-    path, psv_label_name = os.path.split(psv_label)
+    path, psv_label_name = os.path.split(strip_compression(psv_label))
     psv_filename = psv_label_name.replace("LBL", "TAB")
     psv_filename = psv_filename.replace("lbl", "tab")
 
@@ -77,46 +121,91 @@ def get_context(label_path, psv_label):
     return context
 
 
-def write_label(label_path, psv_label, is_rad):
-    """write_label
-    given the path to the new label and some information from the psv label,
-    write a PDS4 label from the provided template
-    """
-    # get context to fill in template
-    context = get_context(label_path, psv_label)
+def get_template(is_rad):
+    """get_template
+    the template of a RAD or REF label, loaded and compiled on first use in this process
 
-    # set up template environment and choose the appropriate template
-    my_path = os.path.abspath(os.path.dirname(__file__))
-    templates = os.path.join(my_path, "../templates")
-    template_loader = FileSystemLoader(searchpath=templates)
-    template_env = Environment(loader=template_loader)
+    :param: is_rad True for the RAD template, False for the REF template
+    :return: the compiled template
+    """
     if is_rad:
         template_file = "rad_template.xml"
     else:
         template_file = "ref_template.xml"
-    template = template_env.get_template(template_file)
+    with _templates_lock:
+        if template_file not in _templates:
+            # jinja2 is imported here, so a run that writes no labels does not pay for the import
+            from jinja2 import Environment, FileSystemLoader
+            my_path = os.path.abspath(os.path.dirname(__file__))
+            templates = os.path.join(my_path, "../templates")
+            template_env = Environment(loader=FileSystemLoader(searchpath=templates), auto_reload=False)
+            _templates[template_file] = template_env.get_template(template_file)
+        return _templates[template_file]
+
+
+def write_label(label_path, psv_label, is_rad, label_values=None):
+    """write_label
+    given the path to the new label and some information from the psv label,
+    write a PDS4 label from the provided template
+
+    :param: label_path the path to the new label
+    :param: psv_label the path to the old label for the PSV file
+    :param: is_rad True for a RAD label, False for a REF label
+    :param: label_values the LABEL_KEYS values of the old label, if already read
+    """
+    # get context to fill in template
+    context = get_context(label_path, psv_label, label_values)
 
     # write the label
     with open(label_path, 'w') as label:
-        label.write(template.render(context))
+        label.write(get_template(is_rad).render(context))
 
 
 def get_header_values(filename):
     """get_header_values
     open the response file and read the header values into a dictionary
     """
+    with open_input(filename) as infile:
+        return parse_header_values(infile)
+
+
+def parse_header_values(lines):
+    """parse_header_values
+    read the header values into a dictionary from the lines of a file, stopping at the start of the data
+
+    :param: lines an iterable of the lines of the file
+    :return: the header values
+    """
     headers = {}
 
-    with open(filename, "r") as infile:
-        for line in infile:
-            if ">>>>Begin" in line:
-                return headers
-            else:
-                parts = line.rsplit(':')
-                if len(parts) > 1:
-                    key = parts[0].lstrip('"')
-                    value = parts[1].rstrip('"\n')
-                    headers[key] = value
+    for line in lines:
+        if ">>>>Begin" in line:
+            return headers
+        else:
+            parts = line.rsplit(':')
+            if len(parts) > 1:
+                key = parts[0].lstrip('"')
+                value = parts[1].rstrip('"\n')
+                headers[key] = value
 
     return headers
 
+
+def get_label_values(label_file, keys):
+    """get_label_values
+    read the values of some keywords from a PDS3 label, e.g. the original label of a PSV file
+
+    :param: label_file the label to read
+    :param: keys the keywords to look for.  Those in LABEL_KEY_LINES are only looked for in the first lines.
+    :return: dictionary of the value of each keyword found, as it is written in the label, quotes included
+    """
+    values = {}
+    with open_input(label_file) as label:
+        for i, line in enumerate(label):
+            line_parts = line.split("=")
+            key = line_parts[0].strip()
+            if len(line_parts) > 1 and key in keys and i <= LABEL_KEY_LINES.get(key, i):
+                values[key] = line_parts[1].strip()
+            if line.strip() == "END":
+                break
+    return values
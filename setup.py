@@ -16,4 +16,5 @@ setup(
    package_data={'ccam_prospect': ['constants/*', 'sol76/*', 'templates/*']
    },
    install_requires=['numpy', 'jinja2', 'matplotlib'],
+   entry_points={'console_scripts': ['ccam-prospect = ccam_prospect.ccamProspect:main']},
 )
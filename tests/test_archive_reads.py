@@ -0,0 +1,69 @@
+import filecmp
+import os
+import tarfile
+import tempfile
+import unittest
+import numpy as np
+from benchmarks.syntheticData import make_psv
+from ccam_prospect.radianceCalibration import RadianceCalibration
+from ccam_prospect.utils.InputFiles import Archive, get_archive, get_archive_index, _archives, _archive_index
+from ccam_prospect.utils.InputType import InputType
+
+
+class ArchiveReadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(_archives.clear)
+        self.addCleanup(_archive_index.clear)
+        self.sources = os.path.join(self.directory.name, 'sources')
+        os.mkdir(self.sources)
+        rng = np.random.default_rng(0)
+        self.tables = [make_psv(self.sources, index, rng) for index in range(6)]
+        os.mkdir(os.path.join(self.directory.name, 'volume'))
+        self.archive = os.path.join(self.directory.name, 'volume', 'volume.tar.gz')
+        with tarfile.open(self.archive, 'w:gz') as tar:
+            # stored in name order, so each label is before its table
+            for name in sorted(os.listdir(self.sources)):
+                tar.add(os.path.join(self.sources, name), arcname='data/' + name)
+
+    def test_table_then_label_reads_forward_only(self):
+        archive = Archive(self.archive)
+        for table in self.tables:
+            label = table.replace('.tab', '.lbl')
+            for file in (table, label, table):
+                with open(file, 'rb') as f:
+                    self.assertEqual(archive.read('data/' + os.path.basename(file)), f.read())
+        self.assertEqual(archive.rewinds, 0)
+
+    def test_listed_members_are_not_listed_again(self):
+        files = [os.path.join(self.archive, 'data', os.path.basename(table)) for table in self.tables]
+        index = get_archive_index(files)
+        self.assertEqual(len(index[self.archive]), 12)
+        archive = Archive(self.archive, index[self.archive])
+        self.assertIsNone(archive.tar)
+        with open(self.tables[-1], 'rb') as f:
+            self.assertEqual(archive.read('data/' + os.path.basename(self.tables[-1])), f.read())
+
+    def test_calibration_reads_forward_only(self):
+        outputs = {}
+        for jobs in (1, 2):
+            _archives.clear()
+            out_dir = os.path.join(self.directory.name, 'out{}'.format(jobs))
+            os.mkdir(out_dir)
+            calibration = RadianceCalibration(os.path.join(self.directory.name, 'badInput.log'), jobs=jobs)
+            calibration.calibrate_to_radiance(InputType.DIRECTORY, os.path.dirname(self.archive), out_dir + '/', True)
+            outputs[jobs] = sorted(os.listdir(out_dir))
+            if jobs == 1:
+                self.assertEqual(get_archive(self.archive).rewinds, 0)
+        tables = [name for name in outputs[1] if name.endswith('.tab')]
+        self.assertEqual(len(tables), 6)
+        self.assertEqual(outputs[1], outputs[2])
+        (match, mismatch, errors) = filecmp.cmpfiles(os.path.join(self.directory.name, 'out1'),
+                                                     os.path.join(self.directory.name, 'out2'), tables, shallow=False)
+        self.assertEqual((mismatch, errors), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import glob
+import os
+import tempfile
+import unittest
+import numpy as np
+from benchmarks.syntheticData import make_psv
+from ccam_prospect.radianceCalibration import RadianceCalibration
+from ccam_prospect.utils.Discovery import read_file_list
+from ccam_prospect.utils.InputType import InputType
+
+
+class FileListTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        rng = np.random.default_rng(0)
+        self.files = [make_psv(self.directory.name, index, rng) for index in range(2)]
+        self.list_file = os.path.join(self.directory.name, 'list.txt')
+        # a list written on Windows, with a blank line in the middle and at the end
+        with open(self.list_file, 'wb') as f:
+            f.write('{}\r\n\r\n{}\r\n\r\n'.format(*self.files).encode())
+
+    def test_crlf_lines(self):
+        # without newline translation, as a list read in binary and decoded would be
+        with open(self.list_file, newline='') as f:
+            self.assertEqual(list(read_file_list(f)), self.files)
+        with open(self.list_file) as f:
+            self.assertEqual(list(read_file_list(f)), self.files)
+
+    def test_crlf_list_with_and_without_pipeline(self):
+        for pipeline in (False, True):
+            with self.subTest(pipeline=pipeline):
+                for rad_file in glob.glob(os.path.join(self.directory.name, '*rad_*')):
+                    os.remove(rad_file)
+                log_file = os.path.join(self.directory.name, 'badInput.log')
+                calibration = RadianceCalibration(log_file, pipeline=pipeline)
+                calibration.calibrate_to_radiance(InputType.FILE_LIST, self.list_file, None, True)
+                self.assertEqual(len(glob.glob(os.path.join(self.directory.name, '*rad_*.tab'))), len(self.files))
+                self.assertFalse(os.path.exists(log_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
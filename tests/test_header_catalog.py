@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from benchmarks.syntheticData import make_psv
+from ccam_prospect.headerCatalog import main
+from ccam_prospect.utils.HeaderCatalog import HeaderCatalog
+from ccam_prospect.utils.InputType import InputType
+from ccam_prospect.utils.Preflight import list_inputs
+
+
+class HeaderCatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.catalog_file = os.path.join(self.directory.name, 'catalog.db')
+
+    def test_bad_label_skips_only_that_file(self):
+        rng = np.random.default_rng(0)
+        good = make_psv(self.directory.name, 0, rng)
+        bad = make_psv(self.directory.name, 1, rng)
+        with open(bad.replace('.tab', '.lbl'), 'wb') as f:
+            f.write(b'SPACECRAFT_CLOCK_START_COUNT = \xff\xfe\nEND\n')
+        catalog = HeaderCatalog(self.catalog_file)
+        try:
+            (read, removed) = catalog.update(self.directory.name)
+            self.assertEqual(read, 1)
+            self.assertEqual(catalog.select('1'), [os.path.abspath(good)])
+        finally:
+            catalog.close()
+
+    def test_query_of_missing_catalog(self):
+        with self.assertRaises(FileNotFoundError):
+            HeaderCatalog(self.catalog_file, create=False)
+        self.assertFalse(os.path.exists(self.catalog_file))
+
+    def test_invalid_query(self):
+        make_psv(self.directory.name, 0, np.random.default_rng(0))
+        main(['--catalog', self.catalog_file, '-d', self.directory.name])
+        with self.assertRaises(SystemExit) as exit_code:
+            main(['--catalog', self.catalog_file, '-q', 'bogus ==='])
+        self.assertEqual(exit_code.exception.code, 1)
+        self.assertIsNone(list_inputs(InputType.QUERY, 'bogus ===', None, catalog=self.catalog_file))
+        self.assertEqual(len(list_inputs(InputType.QUERY, 'sol = 76', None, catalog=self.catalog_file)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
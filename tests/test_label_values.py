@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+from ccam_prospect.utils.Utilities import LABEL_KEYS, get_context, get_label_values
+from ccam_prospect.utils.SpectralCube import make_cube_entry
+
+
+class LabelValuesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.label_file = os.path.join(self.directory.name, 'cl5_404238000psv_f0050104ccam01076p1.lbl')
+
+    def write_label(self, lines):
+        with open(self.label_file, 'w') as f:
+            f.write('\n'.join(lines + ['END']) + '\n')
+
+    def test_quoted_values_are_kept(self):
+        self.write_label(['START_TIME = "2012-10-20T12:00:00.000"', 'PLANET_DAY_NUMBER = "76"',
+                          'SPACECRAFT_CLOCK_START_COUNT = "404238481.123"'])
+        values = get_label_values(self.label_file, LABEL_KEYS)
+        self.assertEqual(values['START_TIME'], '"2012-10-20T12:00:00.000"')
+        context = get_context('cl5_404238000ref_f0050104ccam01076p1.xml', self.label_file, values)
+        self.assertEqual(context['observation_start'], '"2012-10-20T12:00:00.000"')
+        # the cube takes the numbers out of the quotes
+        entry = make_cube_entry('spectrum.txt', {}, label_values=values)
+        self.assertEqual((entry['sol'], entry['sclk']), (76, 404238481))
+
+    def test_start_time_only_from_the_first_lines(self):
+        self.write_label(['COMMENT = {}'.format(i) for i in range(57)] + ['START_TIME = 2012-10-20T12:00:00.000'])
+        self.assertEqual(get_label_values(self.label_file, LABEL_KEYS)['START_TIME'], '2012-10-20T12:00:00.000')
+        self.write_label(['COMMENT = {}'.format(i) for i in range(58)] + ['START_TIME = 2012-10-20T12:00:00.000',
+                                                                          'PLANET_DAY_NUMBER = 76'])
+        values = get_label_values(self.label_file, LABEL_KEYS)
+        self.assertNotIn('START_TIME', values)
+        self.assertEqual(values['PLANET_DAY_NUMBER'], '76')
+        self.assertEqual(get_context('new.xml', self.label_file)['observation_start'], 'UNK')
+
+
+if __name__ == '__main__':
+    unittest.main()
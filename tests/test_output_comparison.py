@@ -0,0 +1,34 @@
+import unittest
+import numpy as np
+from ccam_prospect.utils.CalibrationConstants import get_calibration_constants
+from ccam_prospect.utils.OutputComparison import compare_outputs
+
+
+class OutputComparisonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = np.round(get_calibration_constants().wavelength, 3)
+        self.golden_values = np.linspace(1, 2, len(self.grid))
+        self.new_values = self.golden_values.copy()
+        self.new_values[3000] += 1
+
+    def test_worst_wavelength_is_from_the_new_output(self):
+        new_wl = self.grid + 0.5  # shifted off the gain file grid
+        report = compare_outputs({'x_rad.tab': ([], self.grid, self.golden_values)},
+                                 {'x_rad.tab': ([], new_wl, self.new_values)})
+        entry = report['files'][0]
+        self.assertIn('wavelengths differ from the gain file grid', entry['problems'])
+        self.assertEqual(entry['worst_channel'], 3000)
+        self.assertEqual(entry['worst_wavelength'], new_wl[3000])
+
+    def test_worst_wavelength_without_wavelengths_is_from_the_grid(self):
+        # the rows of a cube have no wavelengths of their own
+        report = compare_outputs({'x_rad.tab': ([], None, self.golden_values)},
+                                 {'x_rad.tab': ([], None, self.new_values)})
+        entry = report['files'][0]
+        self.assertEqual(entry['problems'], ['1 channels differ'])
+        self.assertEqual(entry['worst_wavelength'], self.grid[3000])
+
+
+if __name__ == '__main__':
+    unittest.main()
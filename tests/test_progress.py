@@ -0,0 +1,31 @@
+import os
+import tempfile
+import unittest
+from ccam_prospect.utils.CalibrationWorker import CalibrationWorker
+from ccam_prospect.utils.CustomExceptions import CancelExecutionException
+from ccam_prospect.utils.Progress import DONE, AppProgress, ProgressSink, RunProgress, StatusFile
+
+
+class ProgressTest(unittest.TestCase):
+
+    def test_sink_is_abstract(self):
+        with self.assertRaises(TypeError):
+            ProgressSink(1.0)
+
+    def test_cancel_still_finishes_the_status_file(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        status_file = os.path.join(directory.name, 'status.prom')
+        worker = CalibrationWorker()
+        progress = RunProgress('radiance', [AppProgress(worker), StatusFile(status_file)])
+        progress.set_total(2)
+        progress.add('a.tab', DONE)
+        worker.cancel()
+        with self.assertRaises(CancelExecutionException):
+            progress.finish()
+        with open(status_file) as f:
+            self.assertIn('ccam_prospect_running{calibration="radiance"} 0\n', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
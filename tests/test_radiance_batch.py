@@ -0,0 +1,55 @@
+import math
+import tempfile
+import unittest
+import numpy as np
+from benchmarks.syntheticData import make_psv
+import ccam_prospect.utils.constant as constants
+from ccam_prospect.radianceCalibration import RadianceCalibration
+from ccam_prospect.utils.CalibrationConstants import get_calibration_constants
+from ccam_prospect.utils.PsvFile import PsvFile
+
+
+def get_single_radiance(psv):
+    """get_single_radiance
+    the radiance of one spectrum, calibrated one step at a time as it was before the batch methods
+
+    :param: psv the parsed PSV file
+    :return: the radiance values, in W/m^2/sr/um
+    """
+    # remove the offsets of each spectrometer
+    vnir = psv.vnir - np.mean(psv.vnir[1816:1832])
+    vis = psv.vis - np.mean(psv.vis[0:5])
+    uv = psv.uv - np.mean(psv.uv[0:11])
+
+    distance = float(psv.headers['distToTarget'])
+    t_int = psv.get_integration_time()
+    sa_steradian = math.pi * math.pow(math.sin(math.atan(constants.aperture / 2 / distance)), 2)
+    fov_tgt = math.pi * math.pow(constants.fov * distance / 2 / 10, 2)
+
+    calibration_constants = get_calibration_constants()
+    wavelength = calibration_constants.wavelength
+    photons = np.multiply(np.concatenate([uv, vis, vnir]), calibration_constants.gain)
+    radiance = photons / t_int / fov_tgt / sa_steradian
+    radiance = np.divide(radiance, np.append(np.diff(wavelength), wavelength[-1] - wavelength[-2]))
+
+    # convert to units of W/m^2/sr/um from phot/sec/cm^2/sr/nm
+    return np.multiply(np.divide(np.multiply(radiance, constants.hc), np.multiply(wavelength, 1E-9)), 1E7)
+
+
+class RadianceBatchTest(unittest.TestCase):
+
+    def test_batch_matches_each_spectrum(self):
+        with tempfile.TemporaryDirectory() as directory:
+            rng = np.random.default_rng(0)
+            psv_files = [PsvFile(make_psv(directory, index, rng)) for index in range(8)]
+        headers = np.array([psv.get_calibration_headers() for psv in psv_files], dtype=float)
+
+        radiance = RadianceCalibration.calibrate_batch([psv.get_spectrum() for psv in psv_files],
+                                                       headers[:, 0], headers[:, 1], headers[:, 2])
+        self.assertEqual(radiance.shape, (8, 6144))
+        for (row, psv) in enumerate(psv_files):
+            np.testing.assert_allclose(radiance[row], get_single_radiance(psv), rtol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from benchmarks.syntheticData import make_psv
+from ccam_prospect.relativeReflectanceCalibration import RelativeReflectanceCalibration
+from ccam_prospect.utils.InputType import InputType
+from ccam_prospect.utils.RunLog import NONSTANDARD_EXPOSURE
+from ccam_prospect.utils.Utilities import format_table, get_integration_time
+
+
+class ReflectanceBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        rng = np.random.default_rng(0)
+        # one file for each built-in reference, 7, 34, 404 and 5004 ms
+        self.files = [make_psv(self.directory.name, index, rng) for index in range(4)]
+
+    def test_batch_matches_each_file(self):
+        log_file = os.path.join(self.directory.name, 'badInput.log')
+        RelativeReflectanceCalibration(log_file).calibrate_relative_reflectance(
+            InputType.DIRECTORY, self.directory.name, None, None, True, True)
+
+        calibration = RelativeReflectanceCalibration(log_file)
+        rad_files = [file.replace('psv', 'rad') for file in self.files]
+        radiance = [calibration.read_rad_values(rad_file) for rad_file in rad_files]
+        t_int = [round(get_integration_time(rad_file) * 1000) for rad_file in rad_files]
+        # shuffle the rows, so the groups are not in order
+        order = [2, 0, 3, 1]
+        (reflectance, calibrated) = calibration.calibrate_batch([radiance[i] for i in order],
+                                                                [t_int[i] for i in order])
+        self.assertTrue(calibrated.all())
+        for (row, i) in enumerate(order):
+            with open(self.files[i].replace('psv', 'ref'), newline='') as f:
+                self.assertEqual(format_table(calibration.wavelength, reflectance[row]), f.read())
+
+    def test_rows_without_a_reference_are_logged(self):
+        calibration = RelativeReflectanceCalibration(os.path.join(self.directory.name, 'badInput.log'))
+        calibration.log_entries = []
+        radiance = np.ones((3, 6144))
+        (reflectance, calibrated) = calibration.calibrate_batch(radiance, [7, 100, 34], files=['a', 'b', 'c'])
+        self.assertEqual(calibrated.tolist(), [True, False, True])
+        self.assertTrue(np.isnan(reflectance[1]).all())
+        self.assertFalse(np.isnan(reflectance[[0, 2]]).any())
+        self.assertEqual([(entry['file'], entry['reason']) for entry in calibration.log_entries],
+                         [('b', NONSTANDARD_EXPOSURE)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+from ccam_prospect.utils.SpectralCube import make_cube_entry
+
+HEADERS = {'distToTarget': '2.5'}
+
+
+class MakeCubeEntryTest(unittest.TestCase):
+
+    def test_numeric_clock_from_label(self):
+        entry = make_cube_entry('CL5_404238000PSV_F0050104CCAM02076P1.TXT', HEADERS,
+                                label_values={'SPACECRAFT_CLOCK_START_COUNT': '404238481.123'})
+        self.assertEqual(entry['sclk'], 404238481)
+
+    def test_placeholder_clock_falls_back_to_file_name(self):
+        entry = make_cube_entry('CL5_404238000PSV_F0050104CCAM02076P1.TXT', HEADERS,
+                                label_values={'SPACECRAFT_CLOCK_START_COUNT': 'UNK'})
+        self.assertEqual(entry['sclk'], 404238000)
+
+    def test_placeholder_clock_without_file_name_clock(self):
+        entry = make_cube_entry('spectrum.txt', HEADERS, label_values={'SPACECRAFT_CLOCK_START_COUNT': 'UNK'})
+        self.assertIsNone(entry['sclk'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from ccam_prospect.utils.Utilities import TABLE_ROW_FORMAT, format_table, write_final
+
+
+class TableFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.wavelengths = np.sort(rng.uniform(240, 906, 6144))
+        self.values = rng.normal(0, 10, 6144)
+        # values too wide for their column, which push the rest of the row right
+        self.wavelengths[:3] = [123456789.5, -98765432.25, 1e12]
+        self.values[:6] = [1e15, -1e15, 123456789012.345678, np.nan, np.inf, -np.inf]
+
+    def test_table_matches_each_row(self):
+        rows = "".join(TABLE_ROW_FORMAT % (wl, value) for (wl, value) in zip(self.wavelengths, self.values))
+        self.assertEqual(format_table(self.wavelengths, self.values), rows)
+
+    def test_file_matches_row_by_row_writer(self):
+        header = ['> first header line\n', '> second header line\n']
+        with tempfile.TemporaryDirectory() as directory:
+            expected = os.path.join(directory, 'expected.tab')
+            with open(expected, 'w') as f:
+                [f.write(line.replace("\n", "\r\n")) for line in header]
+                [f.write("{:10.3f}{:20f}            \r\n".format(wl, value))
+                 for (wl, value) in zip(self.wavelengths, self.values)]
+            written = os.path.join(directory, 'written.tab')
+            write_final(written, self.wavelengths, self.values, header=header)
+
+            with open(expected, 'rb') as f, open(written, 'rb') as g:
+                self.assertEqual(g.read(), f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()